@@ -1,11 +1,8 @@
 import gradio as gr
 import uuid, os
-import stylo_app
-
-import smtplib 
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+import stylo_app, metrics
+from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse, FileResponse, JSONResponse
 
 css = """
 h1 {
@@ -117,14 +114,26 @@ with gr.Blocks(title="Styloscope", theme=theme, css=css) as demo:
             diversity.change(
                 show_sttr_span_textbox, diversity, [span_size]
             )
+
+        with gr.Row(variant='panel'):
+            dedup_mode = gr.Radio(choices=['Off', 'Flag', 'Skip'], value='Off', label='Duplicates', interactive=True,
+            info="""Detect exact and near-duplicate texts before parsing. 'Flag' reports them (exact duplicates are only analyzed once), 'Skip' only keeps the first text of every group of duplicates.""")
+            profile = gr.Checkbox(value=False, label='Profile features', interactive=True,
+            info="""Measure the time and memory spent per feature (profile_report.csv and profile.folded in the output). Slows down the analysis.""")
           
         with gr.Row(variant="Panel"):
             button = gr.Button('Submit', variant='primary')
 
+        with gr.Accordion('Run in the background', open=False):
+            with gr.Row(variant='panel'):
+                email = gr.Textbox(label='Email address', info="For long runs: the analysis runs on the server and the results are sent to this address when it has finished, so this page does not have to stay open.")
+                background_button = gr.Button('Submit and email results', variant='secondary')
+            job_status = gr.Markdown(visible=False)
+
         # outputs
         run_id = gr.Textbox(label='Run index', info="", visible=False, interactive=False)
         zip_out = gr.File(label='Output', visible=False)
-        basic_statistics = gr.Dataframe(headers=['Corpus statistics', 'Mean', 'Std.'], visible=False)
+        basic_statistics = gr.Dataframe(headers=['Corpus statistics', 'Mean', 'Std.'], label='Corpus statistics', visible=False)
         dep_plot = gr.Plot(label='Distribution of syntactic dependencies', show_label=True, visible=False)
         pos_plot = gr.Plot(label='Distribution of part-of-speech tags', show_label=True, visible=False)
         punct_plot = gr.Plot(label='Distribution of punctuation marks', show_label=True, visible=False)
@@ -153,7 +162,7 @@ with gr.Blocks(title="Styloscope", theme=theme, css=css) as demo:
             )
         pipe_event = output_event.then( # then run pipeline
             stylo_app.main, 
-            inputs=[input_type, file, dataset, subset, split, column_name, lang, readability, diversity, span_size, run_id], 
+            inputs=[input_type, file, dataset, subset, split, column_name, lang, readability, diversity, span_size, run_id, dedup_mode, profile], 
             outputs=[zip_out, basic_statistics, dep_plot, pos_plot, punct_plot, len_plot, error_or_canceled]
             )  
         plots_event = pipe_event.then( # then make plots visible
@@ -163,6 +172,15 @@ with gr.Blocks(title="Styloscope", theme=theme, css=css) as demo:
             )
                 
         cancel_button.click(stylo_app.stop_function, outputs=[cancel_button, run_id])
+
+        background_button.click( # queue a background job and return immediately
+            generate_run_id,
+            outputs=run_id,
+            ).then(
+            stylo_app.submit_job,
+            inputs=[input_type, file, dataset, subset, split, column_name, lang, readability, diversity, span_size, run_id, dedup_mode, profile, email],
+            outputs=job_status,
+            )
     
     with gr.Tab("Dutch authorship attribution demo"):
         gr.load("clips/xlm-roberta-text-genre-dutch", src="models", title="", description="**Text genre prediction**")
@@ -231,5 +249,37 @@ with gr.Blocks(title="Styloscope", theme=theme, css=css) as demo:
         gr.Markdown("""<center><img src="https://platformdh.uantwerpen.be/wp-content/uploads/2019/03/clariah_def.png" alt="Image" width="200"/></center>""")
         gr.Markdown("""<center><img src="https://thomasmore.be/sites/default/files/2022-11/UA-hor-1-nl-rgb.jpg" alt="Image" width="175"/></center>""")
 
+def metrics_endpoint():
+    """
+    Stage timings and throughput of all runs since startup, in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.TOTALS.prometheus_text(), media_type='text/plain; version=0.0.4')
+
+def download_endpoint(run_id: str):
+    """
+    Output archive of a (background) run, linked in the emails of jobs whose results are too large to attach.
+    """
+    try:
+        run_id = str(uuid.UUID(run_id)) # run ids are uuids, anything else could point outside the output folder
+    except ValueError:
+        raise HTTPException(status_code=404)
+    path = os.path.join('outputs', run_id + '.zip')
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404)
+    return FileResponse(path, filename=f'styloscope_{run_id}.zip')
+
+def job_endpoint(run_id: str):
+    """
+    Status of a background job.
+    """
+    job = stylo_app.JOBS.status(run_id)
+    if job is None:
+        raise HTTPException(status_code=404)
+    return JSONResponse({k: v for k, v in job.items() if k not in {'recipient', 'error'}})
+
 demo.queue(default_concurrency_limit=10)
-demo.launch(server_port=7860, share=True, server_name='0.0.0.0')
+app, _, _ = demo.launch(server_port=7860, share=True, server_name='0.0.0.0', prevent_thread_lock=True)
+app.add_api_route('/metrics', metrics_endpoint, methods=['GET']) # scrape target for Prometheus
+app.add_api_route('/download/{run_id}', download_endpoint, methods=['GET'])
+app.add_api_route('/jobs/{run_id}', job_endpoint, methods=['GET'])
+demo.block_thread()
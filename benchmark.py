@@ -0,0 +1,844 @@
+import os, sys, json, time, random, shutil, subprocess, tempfile
+from configparser import ConfigParser
+
+import numpy as np
+import pandas as pd
+#______________________________________________________________________________________________
+
+STYLO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stylo.py')
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# number of tokens per document and number of documents (at size 1) per document-length profile
+PROFILES = {
+    'tweets': {'tokens': (8, 50), 'n_docs': 500},
+    'articles': {'tokens': (300, 1500), 'n_docs': 50},
+    'novels': {'tokens': (30000, 80000), 'n_docs': 2},
+}
+
+# maximum relative slowdown / memory growth w.r.t. the baseline before a case counts as a regression
+DEFAULT_THRESHOLDS = {
+    'throughput': 0.2, # docs/sec and tokens/sec may drop by at most 20%
+    'memory': 0.25, # peak memory may grow by at most 25%
+    'stage_time': 0.5, # the wall time of a stage may grow by at most 50%...
+    'min_stage_time': 0.5, # ...if it takes at least 0.5 seconds (shorter stages are too noisy to compare)
+    'import_time': 0.25, # the import time of stylo.py may grow by at most 25%...
+    'import_budget': 2.5, # ...and may never exceed 2.5 seconds
+}
+
+# heavy libraries that must only be imported when their code path is taken, not when stylo.py starts
+LAZY_MODULES = ['datasets', 'sklearn', 'plotly', 'gradio', 'smtplib']
+
+# function words and syllables from which the synthetic texts are built
+VOCABULARY = {
+    'English': {
+        'function_words': 'the a an of in on at to for with by from and but or that which who he she it they we you i is was are were be been has have had not this there'.split(),
+        'syllables': 'ba be con de dis ing ment tion ter er al ly pro re un com per sub in ex ven tor ar ble ful'.split(),
+    },
+    'Dutch': {
+        'function_words': 'de het een van in op aan te voor met door uit en maar of dat die wie hij zij het ze wij jij ik is was zijn waren worden werd heeft hebben had niet er'.split(),
+        'syllables': 'be ge ver ont heid lijk ing en er te de aar baar schap kin der wer king stel lin gen'.split(),
+    },
+    'French': {
+        'function_words': 'le la les un une des de du en dans sur à pour avec par et mais ou que qui il elle ils nous vous je est était sont étaient être été a ont avait ne pas ce'.split(),
+        'syllables': 'ré con dé ment tion eur ais ique ter pré par tra vail la ble men son ter ri é té'.split(),
+    },
+    'German': {
+        'function_words': 'der die das ein eine des dem den in auf an zu für mit durch aus und aber oder dass welche wer er sie es wir ihr ich ist war sind waren sein wurde hat haben hatte nicht'.split(),
+        'syllables': 'be ge ver ung keit lich heit en er schaft stel lung ar beit zei tung bau haus kin der'.split(),
+    },
+}
+
+#SYNTHETIC CORPORA_____________________________________________________________________________
+def make_vocabulary(lang, size=5000, seed=0):
+
+    """
+    Generates pseudo content words for a language by combining its syllables.
+    Arguments:
+        lang: 'Dutch', 'English', 'French' or 'German'
+        size: number of content words
+        seed: random seed
+    Returns:
+        list of unique words
+    """
+
+    rng = random.Random(seed)
+    syllables = VOCABULARY[lang]['syllables']
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.choice([1, 2, 2, 3, 3, 4]))))
+    return sorted(words)
+
+def make_corpus(lang, profile, n_docs, seed=0):
+
+    """
+    Generates a synthetic corpus offline. Content words are drawn from a Zipfian distribution so that
+    type-token ratios, word lengths and function word frequencies behave roughly like natural text.
+    Arguments:
+        lang: 'Dutch', 'English', 'French' or 'German'
+        profile: one of PROFILES ('tweets', 'articles', 'novels')
+        n_docs: number of documents
+        seed: random seed
+    Returns:
+        list of strings
+    """
+
+    rng = np.random.default_rng(seed)
+    function_words = np.array(VOCABULARY[lang]['function_words'])
+    content_words = np.array(make_vocabulary(lang, seed=seed))
+    weights = 1 / np.arange(1, len(content_words)+1)
+    weights /= weights.sum()
+
+    low, high = PROFILES[profile]['tokens']
+    texts = []
+    for n_tokens in rng.integers(low, high+1, size=n_docs):
+        is_function_word = rng.random(n_tokens) < 0.45
+        words = np.where(
+            is_function_word,
+            rng.choice(function_words, size=n_tokens),
+            rng.choice(content_words, size=n_tokens, p=weights),
+        )
+        sentences = []
+        start = 0
+        while start < n_tokens:
+            length = int(rng.integers(4, 30))
+            sentence = list(words[start:start+length])
+            if len(sentence) > 8 and rng.random() < 0.5:
+                sentence[int(rng.integers(2, len(sentence)-2))] += ','
+            sentences.append(' '.join(sentence).capitalize() + rng.choice(['.', '.', '.', '?', '!']))
+            start += length
+        paragraph_ends = np.cumsum(rng.integers(3, 13, size=len(sentences)))
+        paragraphs = [' '.join(sentences[i:j]) for i, j in zip(np.r_[0, paragraph_ends], paragraph_ends) if i < len(sentences)]
+        texts.append('\n\n'.join(paragraphs))
+    return texts
+
+#END-TO-END RUNS_______________________________________________________________________________
+def write_case(case_dir, texts, lang, max_memory=0, feature_threads=0):
+
+    """
+    Writes a synthetic corpus and the matching config.ini to a working directory for stylo.py.
+    """
+
+    os.makedirs(case_dir, exist_ok=True)
+    pd.DataFrame(data={'text': texts}).to_csv(os.path.join(case_dir, 'corpus.csv'), index=False)
+
+    config_object = ConfigParser()
+    config_object['INPUT_CONFIG'] = {
+        'input': 'corpus.csv',
+        'input_format': 'csv',
+        'text_column': 'text',
+        'delimiter': ',',
+        'language': lang,
+        'readability metric': 'RIX',
+        'lexical diversity metric': 'STTR',
+        'STTR span size': 100,
+        'deduplication': 'off',
+        'duplicate threshold': 0.9,
+        'max_memory': max_memory,
+        'feature_threads': feature_threads,
+    }
+    config_object['HUGGINGFACE_CONFIG'] = {'dataset_name': '', 'subset': '', 'split': '', 'text_column': ''}
+    config_object['OUTPUT_CONFIG'] = {
+        'output_dir': 'output',
+        'overwrite_output_dir': '1',
+        'visualization_mode': 'separate',
+        'metrics': '1',
+    }
+    with open(os.path.join(case_dir, 'config.ini'), 'w') as conf:
+        config_object.write(conf)
+
+def run_case(case_dir, n_docs):
+
+    """
+    Runs stylo.py end-to-end in a separate process (so that peak memory is measured per run).
+    Arguments:
+        case_dir: working directory prepared with write_case
+        n_docs: number of documents in the corpus
+    Returns:
+        {'wall_time', 'docs_per_sec', 'tokens_per_sec', 'peak_rss_mb', 'stages'}, where the stages come from run_metrics.json
+    """
+
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, STYLO_PATH], cwd=case_dir, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'stylo.py failed')
+
+    with open(os.path.join(case_dir, 'output', 'run_metrics.json')) as f:
+        run_metrics = json.load(f)
+
+    n_tokens = run_metrics['stages'].get('parse', {}).get('tokens', 0)
+    return {
+        'wall_time': wall_time,
+        'docs_per_sec': n_docs / wall_time,
+        'tokens_per_sec': n_tokens / wall_time,
+        'peak_rss_mb': run_metrics['peak_rss_mb'],
+        'stages': {
+            name: {k: stage[k] for k in ('wall_time', 'cpu_time', 'docs_per_sec', 'tokens_per_sec', 'process_peak_rss_mb', 'peak_rss_increase_mb')}
+            for name, stage in run_metrics['stages'].items()
+        },
+    }
+
+def run_benchmark(languages, profiles, sizes, repeat=1, seed=0, work_dir=None, max_memory=0, feature_threads=0):
+
+    """
+    Runs the end-to-end benchmark for every combination of language, document-length profile and corpus size.
+    Arguments:
+        languages: list of languages
+        profiles: list of PROFILES keys
+        sizes: list of multipliers of the number of documents per profile
+        repeat: number of runs per case (the fastest run is kept)
+        seed: random seed of the synthetic corpora
+        work_dir: directory for the corpora and outputs (a temporary directory by default)
+        max_memory: run stylo.py in bounded-memory mode with this budget (MB), 0 to keep everything in memory
+        feature_threads: run stylo.py in pipelined mode with this number of feature threads, 0 to run the stages in sequence
+    Returns:
+        {case name ('<language>/<profile>/<n_docs>'): result of run_case, or {'error': message}}
+    """
+
+    tmp_dir = work_dir or tempfile.mkdtemp(prefix='styloscope_benchmark_')
+    results = {}
+    try:
+        for lang in languages:
+            for profile in profiles:
+                for size in sizes:
+                    n_docs = max(1, int(PROFILES[profile]['n_docs'] * size))
+                    case = f'{lang}/{profile}/{n_docs}'
+                    print(f'Running {case}...')
+                    case_dir = os.path.join(tmp_dir, lang, profile, str(n_docs))
+                    write_case(case_dir, make_corpus(lang, profile, n_docs, seed), lang, max_memory, feature_threads)
+                    try:
+                        runs = [run_case(case_dir, n_docs) for _ in range(repeat)]
+                        results[case] = min(runs, key=lambda r: r['wall_time'])
+                    except RuntimeError as e:
+                        print(f'    failed: {e}')
+                        results[case] = {'error': str(e)}
+    finally:
+        if work_dir is None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+#STARTUP_______________________________________________________________________________________
+def measure_startup(module='stylo', repeat=5):
+
+    """
+    Measures the import time of a module in a fresh interpreter (with python -X importtime).
+    Arguments:
+        module: name of the module to import
+        repeat: number of measurements (the fastest is kept)
+    Returns:
+        {'import_time': seconds, 'lazy_modules_loaded': LAZY_MODULES that were imported at startup,
+         'slowest_imports': the 10 top-level imports with the highest cumulative import time}
+    """
+
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=os.path.dirname(STYLO_PATH), capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip().splitlines()[-1])
+
+        imports = [] # (name, cumulative microseconds, nesting level)
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((name.strip(), int(cumulative), (len(name) - len(name.lstrip())) // 2))
+
+        import_time = next(us for name, us, _ in imports if name == module) / 1e6
+        if best is None or import_time < best['import_time']:
+            loaded = {name.split('.')[0] for name, _, _ in imports}
+            top_level = sorted([(us, name) for name, us, level in imports if level == 1], reverse=True)[:10]
+            best = {
+                'import_time': import_time,
+                'lazy_modules_loaded': [m for m in LAZY_MODULES if m in loaded],
+                'slowest_imports': {name: us / 1e6 for us, name in top_level},
+            }
+    return best
+
+def check_startup(startup, baseline=None):
+
+    """
+    Checks the startup measurement against the import-time budget and the baseline.
+    Returns:
+        list of problems (empty if startup is within budget)
+    """
+
+    thresholds = {**DEFAULT_THRESHOLDS, **(baseline or {}).get('thresholds', {})}
+    problems = []
+    if startup['lazy_modules_loaded']:
+        problems.append(f'imported at startup: {", ".join(startup["lazy_modules_loaded"])}')
+    if startup['import_time'] > thresholds['import_budget']:
+        problems.append(f'import time {startup["import_time"]:.2f}s exceeds the budget of {thresholds["import_budget"]:.2f}s')
+    reference = (baseline or {}).get('startup')
+    if reference and startup['import_time'] > reference['import_time'] * (1 + thresholds['import_time']):
+        problems.append(f'import time {startup["import_time"]:.2f}s vs. {reference["import_time"]:.2f}s in the baseline')
+    return problems
+
+#BASELINE______________________________________________________________________________________
+def save_baseline(results, path, startup=None, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Stores benchmark results (without failed cases), the startup measurement and the regression thresholds as the baseline.
+    """
+    with open(path, 'w') as f:
+        json.dump({
+            'thresholds': thresholds,
+            'startup': startup,
+            'cases': {case: r for case, r in results.items() if 'error' not in r},
+        }, f, indent=4)
+
+def compare_to_baseline(results, baseline):
+
+    """
+    Compares benchmark results with a stored baseline.
+    Arguments:
+        results: output of run_benchmark
+        baseline: contents of a baseline file (see save_baseline)
+    Returns:
+        pd.DataFrame with one row per compared value (case, stage, metric, baseline, current, ratio, regression)
+    """
+
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get('thresholds', {})}
+    rows = []
+    for case, current in results.items():
+        if 'error' in current or case not in baseline['cases']:
+            continue
+        reference = baseline['cases'][case]
+
+        for metric in ('docs_per_sec', 'tokens_per_sec'):
+            if reference[metric]:
+                ratio = current[metric] / reference[metric]
+                rows.append((case, 'total', metric, reference[metric], current[metric], ratio, ratio < 1 - thresholds['throughput']))
+        if reference['peak_rss_mb'] and current['peak_rss_mb']:
+            ratio = current['peak_rss_mb'] / reference['peak_rss_mb']
+            rows.append((case, 'total', 'peak_rss_mb', reference['peak_rss_mb'], current['peak_rss_mb'], ratio, ratio > 1 + thresholds['memory']))
+
+        for name, stage in current['stages'].items():
+            reference_stage = reference['stages'].get(name)
+            if reference_stage is None or reference_stage['wall_time'] < thresholds['min_stage_time']:
+                continue
+            ratio = stage['wall_time'] / reference_stage['wall_time']
+            rows.append((case, name, 'wall_time', reference_stage['wall_time'], stage['wall_time'], ratio, ratio > 1 + thresholds['stage_time']))
+
+    return pd.DataFrame(rows, columns=['case', 'stage', 'metric', 'baseline', 'current', 'ratio', 'regression'])
+
+def summarize(results):
+    """
+    One row per case with the end-to-end numbers and the time spent per stage.
+    """
+    rows = []
+    for case, r in results.items():
+        if 'error' in r:
+            rows.append({'case': case, 'error': r['error']})
+            continue
+        row = {'case': case, **{k: r[k] for k in ('wall_time', 'docs_per_sec', 'tokens_per_sec', 'peak_rss_mb')}}
+        row.update({f'{name} (s)': stage['wall_time'] for name, stage in r['stages'].items()})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+#EQUIVALENCE CHECKS____________________________________________________________________________
+# optimized code paths and the reference implementation they replace must produce the same numbers
+# every check returns a list of mismatch descriptions (empty if the outputs are equivalent)
+EQUIVALENCE_CHECKS = {}
+
+def equivalence_check(name):
+    """
+    Registers an equivalence check.
+    """
+    def register(func):
+        EQUIVALENCE_CHECKS[name] = func
+        return func
+    return register
+
+def compare_arrays(name, expected, actual, rtol=1e-7, atol=1e-9):
+    """
+    Describes the differences between two numeric arrays (an empty list if they are equal within tolerance).
+    """
+    expected, actual = np.asarray(expected, dtype=np.float64), np.asarray(actual, dtype=np.float64)
+    if expected.shape != actual.shape:
+        return [f'{name}: shape {actual.shape} instead of {expected.shape}']
+    close = np.isclose(expected, actual, rtol=rtol, atol=atol, equal_nan=True)
+    if close.all():
+        return []
+    diff = np.nanmax(np.abs(np.where(close, 0, expected - actual)))
+    return [f'{name}: {(~close).sum()} values differ (max abs. difference {diff:.3g})']
+
+def compare_frames(name, expected, actual, rtol=1e-7, atol=1e-9):
+
+    """
+    Describes the differences between two dataframes: missing or extra columns, and numeric differences
+    in the shared columns (non-numeric columns must be identical).
+    """
+
+    mismatches = []
+    missing = [c for c in expected.columns if c not in actual.columns]
+    extra = [c for c in actual.columns if c not in expected.columns]
+    if missing:
+        mismatches.append(f'{name}: missing columns {missing}')
+    if extra:
+        mismatches.append(f'{name}: unexpected columns {extra}')
+    if len(expected) != len(actual):
+        return mismatches + [f'{name}: {len(actual)} rows instead of {len(expected)}']
+
+    for col in [c for c in expected.columns if c in actual.columns]:
+        if pd.api.types.is_numeric_dtype(expected[col]) and pd.api.types.is_numeric_dtype(actual[col]):
+            mismatches += compare_arrays(f'{name}[{col}]', expected[col], actual[col], rtol, atol)
+        elif expected[col].astype(str).tolist() != actual[col].astype(str).tolist():
+            mismatches.append(f'{name}[{col}]: values differ')
+    return mismatches
+
+@equivalence_check('reference_store')
+def check_reference_store(languages):
+    """
+    The compiled reference store vs. the reference csv files.
+    """
+    import reference_store
+    mismatches = []
+    for lang in languages:
+        lang_dir = os.path.join(reference_store.REFERENCE_DIR, reference_store.LANGUAGE_CODES[lang])
+        for fn in sorted(os.listdir(lang_dir)):
+            if not fn.endswith('_combined.csv'):
+                continue
+            task_name = fn[:-len('_combined.csv')]
+            expected = pd.read_csv(os.path.join(lang_dir, fn))
+            expected = expected[expected['doc'].isin(['mean', 'std'])].reset_index(drop=True)
+            actual = reference_store.reference_frame(lang, task_name)
+            actual.columns = [str(c) for c in actual.columns]
+            mismatches += compare_frames(f'{lang}/{task_name}', expected, actual[expected.columns])
+    return mismatches
+
+@equivalence_check('reference_similarity')
+def check_reference_similarity(languages, n_docs=50, seed=0):
+    """
+    The batched similarity scores vs. a per-document computation.
+    """
+    import similarity, reference_store
+    rng = np.random.default_rng(seed)
+    mismatches = []
+    for lang in languages:
+        for task_name in similarity.REFERENCE_TASKS:
+            features, sources, mean, std = reference_store.get_reference(lang, task_name)
+            X = rng.dirichlet(np.ones(len(features)), size=n_docs)
+            M = np.nan_to_num(mean)
+
+            expected_delta, expected_cosine, expected_js = [], [], []
+            for x in X:
+                for m, s in zip(M, np.nan_to_num(std)):
+                    valid = s > 0
+                    expected_delta.append(np.mean(np.abs(x[valid] - m[valid]) / s[valid]))
+                    expected_cosine.append(x @ m / (np.linalg.norm(x) * np.linalg.norm(m)) if np.linalg.norm(m) > 0 else 0)
+                    p, q = x / x.sum(), np.clip(m, 0, None) / np.clip(m, 0, None).sum()
+                    avg = (p + q) / 2
+                    expected_js.append((np.sum(p[p > 0] * np.log2(p[p > 0] / avg[p > 0])) + np.sum(q[q > 0] * np.log2(q[q > 0] / avg[q > 0]))) / 2)
+
+            shape = (n_docs, len(sources))
+            name = f'{lang}/{task_name}'
+            mismatches += compare_arrays(f'{name} delta', np.reshape(expected_delta, shape), similarity.burrows_delta(X, mean, std, chunk_size=7))
+            mismatches += compare_arrays(f'{name} cosine', np.reshape(expected_cosine, shape), similarity.cosine_similarity(X, mean))
+            mismatches += compare_arrays(f'{name} jensen_shannon', np.reshape(expected_js, shape), similarity.jensen_shannon(X, mean, chunk_size=7))
+    return mismatches
+
+@equivalence_check('style_index')
+def check_style_index(languages, n_docs=500, seed=0):
+    """
+    Exact top-k queries on the style index vs. sorting all distances.
+    """
+    import similarity
+    rng = np.random.default_rng(seed)
+    index = {'vectors': rng.standard_normal((n_docs, 40)).astype(np.float32)}
+    Q = index['vectors'][:20]
+    mismatches = []
+    for metric in ('delta', 'cosine'):
+        distances = similarity._scores(Q, index['vectors'], metric)
+        expected = np.sort(distances, axis=1)[:, :10]
+        _, actual = similarity.query_index(index, Q, k=10, metric=metric, block_size=64)
+        mismatches += compare_arrays(f'{metric} top-10 distances', expected, actual, rtol=1e-5, atol=1e-5)
+    return mismatches
+
+@equivalence_check('ngram_profile')
+def check_ngram_profile(languages, seed=0):
+    """
+    The Counter-based n-gram profile vs. the scikit-learn CountVectorizer it replaces (skipped if scikit-learn is not installed).
+    """
+    try:
+        from sklearn.feature_extraction.text import CountVectorizer
+    except ImportError:
+        return []
+    import util
+    mismatches = []
+    for lang in languages:
+        for text in make_corpus(lang, 'articles', 3, seed):
+            tokens = text.split()
+            vec = CountVectorizer(analyzer=lambda x: x)
+            X = vec.fit_transform([[t.lower() for t in tokens]])
+            expected = pd.DataFrame(X.toarray() / X.sum(), columns=vec.get_feature_names_out())
+            actual = pd.DataFrame(util.get_ngram_profile(tokens))
+            if list(expected.columns) != list(actual.columns):
+                mismatches.append(f'{lang}: n-gram profile features differ')
+            else:
+                mismatches += compare_arrays(f'{lang} n-gram profile', expected.to_numpy(), actual.to_numpy(), rtol=0, atol=0)
+    return mismatches
+
+@equivalence_check('parsing_results')
+def check_parsing_results(languages, n_docs=200, seed=0):
+    """
+    The binary parsing results (written in one go and read back memory-mapped) vs. the label sequences.
+    """
+    import parse_store
+    rng = np.random.default_rng(seed)
+    labels = parse_store.UPOS + parse_store.DEPENDENCIES + ['nsubj:pass', 'aux:pass']
+    sequences = [list(rng.choice(labels, size=rng.integers(0, 50))) for _ in range(2*n_docs)]
+    pos, dep = sequences[:n_docs], sequences[n_docs:]
+
+    mismatches = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'parsing_results.bin')
+        writer = parse_store.ParsingResultsWriter(path)
+        for i in range(n_docs):
+            writer.add(i, parse_store.POS_CODEC.encode(pos[i]), parse_store.DEP_CODEC.encode(dep[i]))
+        writer.close()
+        results = parse_store.load_parsing_results(path)
+        if results.docs != list(range(n_docs)):
+            mismatches.append('document ids differ')
+        if any(results.pos_tags(i) != pos[i] or results.dependency_labels(i) != dep[i] for i in range(n_docs)):
+            mismatches.append('decoded labels differ')
+        del results
+    return mismatches
+
+@equivalence_check('passive_ratio')
+def check_passive_ratio(languages, n_docs=50, seed=0):
+
+    """
+    The vectorized passive sentence ratio vs. the SpaCy Matcher applied sentence by sentence, on synthetic
+    parsed documents (no SpaCy model needed).
+    """
+
+    import spacy, util, pipeline
+    from spacy.matcher import Matcher
+    from spacy.tokens import Doc
+    rng = np.random.default_rng(seed)
+    mismatches = []
+    for lang in languages:
+        nlp = spacy.blank('en')
+        matcher = Matcher(nlp.vocab)
+        matcher.add('Passive', [[{'DEP': label}] for label in pipeline.PASSIVE_LABELS[lang]])
+        passive_labels = pipeline.get_passive_labels(nlp, lang)
+        other_labels = ['nsubj', 'obj', 'det', 'amod', 'punct']
+        expected, actual = [], []
+        for _ in range(n_docs):
+            passive_rate = rng.choice([0.01, 0.1])
+            words, heads, deps = [], [], []
+            for _ in range(rng.integers(1, 40)): # sentences, every token attached to the first one
+                start, length = len(words), int(rng.integers(1, 20))
+                words += ['w'] * length
+                heads += [start] * length
+                deps.append('ROOT')
+                for _ in range(length-1):
+                    deps.append(str(rng.choice(pipeline.PASSIVE_LABELS[lang] if rng.random() < passive_rate else other_labels)))
+            doc = Doc(nlp.vocab, words=words, heads=heads, deps=deps)
+            expected.append(round(sum(bool(matcher(s)) for s in doc.sents) / len(list(doc.sents)), 3))
+            actual.append(util.get_passive_ratio(doc, passive_labels))
+        mismatches += compare_arrays(f'{lang} ratio_passive_sentences', expected, actual)
+    return mismatches
+
+@equivalence_check('segmentation')
+def check_segmentation(languages, seed=0, segment_length=20000):
+
+    """
+    Long texts parsed in segments vs. parsed as a whole. The whitespace-normalized segments must add up to the
+    text; the statistics must match up to the tagging of the few words around segment boundaries
+    (the parse comparison is skipped for languages whose SpaCy model is not installed).
+    """
+
+    import pipeline
+    mismatches = []
+    for lang in languages:
+        text = make_corpus(lang, 'novels', 1, seed)[0]
+        segments = pipeline.segment_text(text, segment_length)
+        if any(len(s) > segment_length for s in segments):
+            mismatches.append(f'{lang}: segment longer than {segment_length} characters')
+        if ' '.join(' '.join(s.split()) for s in segments) != ' '.join(text.split()):
+            mismatches.append(f'{lang}: segments do not add up to the text')
+
+        try:
+            nlp, dic = pipeline.load_language(lang)
+        except OSError:
+            print(f'    segmentation: no SpaCy model for {lang}, parse comparison skipped')
+            continue
+        passive_labels = pipeline.get_passive_labels(nlp, lang)
+        for readability_metric in ['SMOG', 'Coleman-Liau']: # both sample the sentences / tokens of the whole text
+            args = (nlp, dic, passive_labels, 'STTR', readability_metric, 100)
+            whole = pipeline.analyze_text(text, *args, segment_length=len(text))
+            segmented = pipeline.analyze_text(text, *args, segment_length=segment_length)
+            for name in pipeline.STATISTICS + pipeline.DISTRIBUTIONS:
+                expected, actual = whole[name], segmented[name].reindex(columns=whole[name].columns, fill_value=0)
+                mismatches += compare_frames(f'{lang} {readability_metric} {name}', expected, actual, rtol=1e-3, atol=1e-3)
+            if len(whole['pos_tags']) != len(segmented['pos_tags']):
+                mismatches.append(f'{lang}: {len(segmented["pos_tags"])} tokens instead of {len(whole["pos_tags"])}')
+    return mismatches
+
+@equivalence_check('minhash')
+def check_minhash(languages, seed=0):
+    """
+    Blocked MinHash signatures vs. signatures computed in a single block.
+    """
+    import dedup
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(dedup.MERSENNE_PRIME), size=64, dtype=np.uint64)
+    b = rng.integers(0, int(dedup.MERSENNE_PRIME), size=64, dtype=np.uint64)
+    mismatches = []
+    for lang in languages:
+        for text in make_corpus(lang, 'articles', 3, seed):
+            hashes = dedup.shingle_hashes(text)
+            expected = dedup.minhash_signature(hashes, a, b, block_size=len(hashes))
+            actual = dedup.minhash_signature(hashes, a, b, block_size=97)
+            if not np.array_equal(expected, actual):
+                mismatches.append(f'{lang}: blocked MinHash signature differs')
+    return mismatches
+
+@equivalence_check('vocabulary_sketch')
+def check_vocabulary_sketch(languages, n_shards=3, seed=0):
+    """
+    Vocabulary sketch estimates vs. exact counts (within their error bounds), and merged shard sketches
+    vs. a sketch of the whole corpus (identical).
+    """
+    from collections import Counter
+    import sketch
+    mismatches = []
+    for lang in languages:
+        docs = [Counter(text.lower().split()) for text in make_corpus(lang, 'articles', 30, seed)]
+        whole = sketch.VocabularySketch(top_k=20, sample_size=64) # a small sample, so that it is estimated
+        shards = [sketch.VocabularySketch(top_k=20, sample_size=64) for _ in range(n_shards)]
+        for i, counts in enumerate(docs):
+            whole.update(counts, counts)
+            shards[i % n_shards].update(counts, counts)
+        merged = shards[0]
+        for shard in shards[1:]:
+            merged.merge(shard)
+        if not merged.summary().equals(whole.summary()) or not merged.frequent_words().equals(whole.frequent_words()):
+            mismatches.append(f'{lang}: merged shard sketches differ from the sketch of the whole corpus')
+
+        exact = sum(docs, Counter())
+        summary = whole.summary().set_index('statistic')
+        n_types, error = summary.at['n_types', 'value'], summary.at['n_types', 'standard_error']
+        if abs(n_types - len(exact)) > 4 * error:
+            mismatches.append(f'{lang}: {n_types:.0f} types estimated instead of {len(exact)} (standard error {error:.1f})')
+        for row in whole.frequent_words().itertuples():
+            if not exact[row.word] <= row.count <= exact[row.word] + row.max_overestimate:
+                mismatches.append(f'{lang}: count of "{row.word}" estimated as {row.count} instead of {exact[row.word]}')
+    return mismatches
+
+@equivalence_check('vocabulary_growth')
+def check_vocabulary_growth(languages, seed=0):
+    """
+    Streamed vocabulary growth curve vs. the number of types of every prefix of the token stream (within its error
+    bounds), and vs. the curve of the same token stream split into documents differently (identical).
+    """
+    import sketch
+    mismatches = []
+    for lang in languages:
+        tokens = [t for text in make_corpus(lang, 'articles', 30, seed) for t in text.lower().split()]
+        growth = sketch.VocabularyGrowth()
+        for start in range(0, len(tokens), 1000):
+            growth.update(tokens[start:start+1000])
+        resplit = sketch.VocabularyGrowth()
+        for start in range(0, len(tokens), 333):
+            resplit.update(tokens[start:start+333])
+        curve = growth.growth_curve()
+        if not curve.equals(resplit.growth_curve()):
+            mismatches.append(f'{lang}: the vocabulary growth curve depends on the document boundaries')
+        for row in curve.itertuples():
+            n_types = len(set(tokens[:row.n_tokens]))
+            if abs(row.n_types - n_types) > max(4 * row.standard_error, 1):
+                mismatches.append(f'{lang}: {row.n_types:.0f} types estimated after {row.n_tokens} tokens instead of {n_types}')
+    return mismatches
+
+@equivalence_check('trajectories')
+def check_trajectories(languages, seed=0):
+    """
+    Incrementally updated sliding windows vs. every window analyzed from scratch as a separate document.
+    """
+    import features, trajectories
+    rng = np.random.default_rng(seed)
+    tags = trajectories.POS_TAGS + ['PUNCT']
+    metrics = [('STTR', 'SMOG'), ('TTR', 'Coleman-Liau'), ('Maas', 'Flesch reading ease'), ('Herdan', 'Gunning Fog'), ('CTTR', 'LIX')]
+    mismatches = []
+    for lang in languages:
+        for text in make_corpus(lang, 'articles', 3, seed):
+            # a synthetic parse: sentences split at the periods, random part-of-speech tags, syllables from the word length
+            parsed_sentences = [[(t, tags[rng.integers(len(tags))]) for t in s.split()] for s in text.split('.') if s.split()]
+            syllables = [[len(t) // 3 + 1 for t, pos in s if pos not in features.NON_WORDS] for s in parsed_sentences]
+            for diversity_metric, readability_metric in metrics:
+                args = (diversity_metric, readability_metric, 100)
+                actual = trajectories.trajectory(parsed_sentences, *args, 400, 90, syllables)
+                for row in actual.itertuples():
+                    # the words of the window, with the sentences cut at its borders
+                    remaining, window, window_syllables = row.start, [], []
+                    n_words = row.end - row.start
+                    for s, syl in zip(parsed_sentences, syllables):
+                        words = [(t, pos) for t, pos in s if pos not in features.NON_WORDS]
+                        skip, remaining = min(remaining, len(words)), remaining - min(remaining, len(words))
+                        words, syl = words[skip:skip+n_words], syl[skip:skip+n_words]
+                        n_words -= len(words)
+                        if words:
+                            window.append(words)
+                            window_syllables.append(syl)
+                    expected = trajectories.trajectory(window, *args, 400, 90, window_syllables).iloc[0]
+                    for col in ['n_tokens', 'lexical_diversity', 'readability'] + [c for c in actual.columns if c.startswith('pos_')]:
+                        a, e = getattr(row, col), expected[col]
+                        if not (a == e or (a is None and e is None) or (a is not None and e is not None and np.isclose(a, e))):
+                            mismatches.append(f'{lang} {diversity_metric}/{readability_metric}: window {row.window} {col} is {a} instead of {e}')
+    return mismatches
+
+@equivalence_check('staged_pipeline')
+def check_staged_pipeline(languages, seed=0):
+    """
+    Pipelined stages (with several threads per stage that finish in random order) vs. the stages applied one after
+    the other, and no threads left behind when the caller stops early or a stage fails.
+    """
+    import threading, staging
+    from collections import Counter
+    rng = np.random.default_rng(seed)
+    delays = rng.random(1000) * 0.001
+    def parse(document): # a synthetic parse stage that takes a random time
+        i, text = document
+        time.sleep(delays[i % len(delays)])
+        return i, text.lower().split()
+    def count(parsed):
+        i, tokens = parsed
+        time.sleep(delays[-i % len(delays)])
+        return i, len(tokens), Counter(tokens).most_common(3)
+    stages = [('parse', parse, 2), ('features', count, 3)]
+    mismatches = []
+    for lang in languages:
+        documents = list(enumerate(make_corpus(lang, 'tweets', 200, seed)))
+        expected = list(staging.StagedPipeline(stages, threaded=False).run(documents))
+        with staging.StagedPipeline(stages, queue_size=4) as staged:
+            actual = list(staged.run(documents))
+        if actual != expected:
+            mismatches.append(f'{lang}: the pipelined stages return different results or a different order')
+        with staging.StagedPipeline(stages, queue_size=4) as staged:
+            for i, _, _ in staged.run(documents):
+                if i == 10:
+                    break
+        def fail(parsed):
+            if parsed[0] == 50:
+                raise ValueError('failed')
+            return parsed
+        try:
+            with staging.StagedPipeline([('parse', parse, 1), ('features', fail, 3)], queue_size=4) as staged:
+                list(staged.run(documents))
+            mismatches.append(f'{lang}: an error in a stage was not raised')
+        except ValueError:
+            pass
+    if any(t.name.startswith(('load', 'parse-', 'features-')) for t in threading.enumerate()):
+        mismatches.append('threads of the staged pipeline were not stopped')
+    return mismatches
+
+@equivalence_check('zip_loading')
+def check_zip_loading(languages, seed=0):
+    """
+    Zip folders read in several threads (UTF-8, cp1252 and gzipped files in nested folders) vs. the texts that
+    were written to them, with load_data and iter_data.
+    """
+    import gzip, zipfile, util
+    mismatches = []
+    tmp_dir = tempfile.mkdtemp(prefix='styloscope_zip_')
+    try:
+        for lang in languages:
+            texts = make_corpus(lang, 'tweets', 60, seed)
+            texts = [t + ' – café' for t in texts] # not ASCII, so the encoding matters
+            expected = []
+            path = os.path.join(tmp_dir, f'{lang}.zip')
+            with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                for i, text in enumerate(texts):
+                    name = f'{["a", "b/c"][i % 2]}/{i:03d}.txt'
+                    if i % 3 == 0:
+                        zip_file.writestr(f'corpus/{name}', text.encode('utf-8'))
+                    elif i % 3 == 1:
+                        zip_file.writestr(f'corpus/{name}', text.encode('cp1252'))
+                    else:
+                        name += '.gz'
+                        zip_file.writestr(f'corpus/{name}', gzip.compress(text.encode('utf-8')))
+                    expected.append((text, name))
+                zip_file.writestr('__MACOSX/corpus/a/._000.txt', b'\x00\x05\x16\x07')
+            expected.sort(key=lambda d: d[1])
+            for n_threads in [1, 4]:
+                if list(zip(*util.load_data('zip', path, n_threads=n_threads))) != expected:
+                    mismatches.append(f'{lang}: load_data with {n_threads} threads returns other texts or names')
+                if list(util.iter_data('zip', path, n_threads=n_threads)) != expected:
+                    mismatches.append(f'{lang}: iter_data with {n_threads} threads returns other texts or names')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return mismatches
+
+def run_equivalence_checks(languages, names=None):
+    """
+    Runs the registered equivalence checks.
+    Returns:
+        {check name: list of mismatches}
+    """
+    return {name: check(languages) for name, check in EQUIVALENCE_CHECKS.items() if names is None or name in names}
+
+#______________________________________________________________________________________________
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on synthetic corpora and check for performance regressions.')
+    parser.add_argument('--languages', nargs='+', default=list(VOCABULARY), choices=list(VOCABULARY))
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1], help='multipliers of the number of documents per profile')
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs per case (the fastest run is kept)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--work-dir', help='keep the synthetic corpora and outputs in this directory')
+    parser.add_argument('--max-memory', type=int, default=0, help='run the cases in bounded-memory mode (MB)')
+    parser.add_argument('--feature-threads', type=int, default=0, help='run the cases in pipelined mode with this number of feature threads')
+    parser.add_argument('--check', action='store_true', help='only run the equivalence checks and the startup check')
+    args = parser.parse_args()
+
+    failed = False
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    startup = measure_startup()
+    problems = check_startup(startup, baseline)
+    print(f'Startup: import stylo took {startup["import_time"]:.3f}s {"OK" if not problems else "FAILED"}')
+    for problem in problems:
+        print(f'    {problem}')
+    failed = failed or bool(problems)
+
+    print('Equivalence checks:')
+    for name, mismatches in run_equivalence_checks(args.languages).items():
+        print(f'    {name}: {"OK" if not mismatches else "FAILED"}')
+        for mismatch in mismatches:
+            print(f'        {mismatch}')
+        failed = failed or bool(mismatches)
+
+    if not args.check:
+        results = run_benchmark(args.languages, args.profiles, args.sizes, args.repeat, args.seed, args.work_dir, args.max_memory, args.feature_threads)
+        print(summarize(results).round(3).to_string(index=False))
+        failed = failed or any('error' in r for r in results.values())
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'startup': startup, 'cases': results}, f, indent=4)
+
+        if args.save_baseline:
+            save_baseline(results, args.baseline, startup)
+            print(f'Saved baseline to {args.baseline}')
+        elif baseline is not None:
+            comparison = compare_to_baseline(results, baseline)
+            print(comparison.round(3).to_string(index=False))
+            regressions = comparison[comparison['regression']]
+            if len(regressions):
+                print(f'{len(regressions)} performance regression(s) w.r.t. {args.baseline}')
+                failed = True
+        else:
+            print(f'No baseline found at {args.baseline} (create one with --save-baseline)')
+
+    sys.exit(1 if failed else 0)
@@ -4,13 +4,34 @@ config_object = ConfigParser()
 
 config_object["INPUT_CONFIG"] = {
     "input": '', #.csv file or path to zip folder
-    "input_format": '', # 'csv', 'zip' or 'huggingface'
-    "text_column": '', #only relevant if input_format==csv
+    "input_format": '', # 'csv', 'parquet', 'zip' or 'huggingface'
+    "text_column": '', #only relevant if input_format==csv or parquet
     "delimiter": ',', #only relevant if input_format==csv
+    "encoding_fallback": 'cp1252, latin-1', # only relevant if input_format==zip: encodings tried for files that are not UTF-8 ('detect' to guess)
+    "load_threads": 4, # only relevant if input_format==zip: number of threads that decompress and decode the files
     "language": '', # Dutch, English, French, German
     "readability metric": 'RIX', # ARI, Coleman-Liau, Flesch reading ease, Flesch Kincaid grade level, Gunning Fog, SMOG, LIX, RIX
     "lexical diversity metric": "STTR", # TTR, RTTR, CTTR, STTR, Herdan, Summer, Dugast, Maas
     "STTR span size": 100, # Span (n tokens) used to compute STTR; irrelevant if other diversity metric is used
+    "deduplication": 'off', # 'off', 'flag' (report duplicates, analyze exact duplicates only once) or 'skip' (only keep the first text of every duplicate cluster)
+    "duplicate threshold": 0.9, # minimum (estimated) Jaccard similarity of character 5-grams for near-duplicates
+    "max_memory": 0, # bounded-memory mode: MB of per-document results kept in memory before they are spilled to disk (0 = keep everything in memory)
+    "segment_length": 100000, # texts longer than this (in characters) are parsed in segments, split at paragraph or sentence boundaries
+    "parse_processes": 1, # number of processes that parse the segments of a long text
+    "feature_threads": 0, # number of threads that compute the features while the next texts are read and parsed (0 = run the stages one after the other)
+    "queue_size": 16, # maximum number of texts in flight between the pipelined stages
+    "passive_labels": '', # comma-separated dependency labels that mark a passive sentence (empty = default labels of the language)
+    "sample_tolerance": 0, # sampling mode: stop once the confidence intervals of all corpus means are narrower than this (0 = analyze all texts)
+    "sample_confidence": 0.95, # confidence level of the intervals
+    "sample_batch_size": 100, # number of texts analyzed between two checks of the intervals
+    "sample_stratify": '', # column (csv or HuggingFace) by which the sample is stratified (optional)
+    "sample_seed": 0, # random seed of the sample
+    "group_by": '', # column (csv, parquet or HuggingFace) whose values are compared: mean and std per group in <output>_by_group.csv and the charts (optional)
+    "max_characters": 0, # texts with more characters are analyzed in an isolated worker process (0 = no limit)
+    "max_tokens": 0, # texts with more (whitespace-separated) tokens are analyzed in an isolated worker process (0 = no limit)
+    "max_word_length": 0, # texts with a longer word (e.g. base64 blobs, minified code) are analyzed in an isolated worker process (0 = no limit)
+    "max_seconds": 60, # the isolated worker is killed and the text skipped after this many seconds (0 = no time limit)
+    "max_document_memory": 0, # the isolated worker may allocate this many MB per text before the text is skipped (0 = no limit, Linux only)
 }
 
 config_object['HUGGINGFACE_CONFIG'] = {
@@ -22,7 +43,20 @@ config_object['HUGGINGFACE_CONFIG'] = {
 
 config_object["OUTPUT_CONFIG"] = {
     "output_dir": 'output', # directory to the output folder
-    "overwrite_output_dir": '1' # 1 or 0
+    "overwrite_output_dir": '1', # 1 or 0
+    "visualization_mode": 'separate', # 'separate' (html per chart, one shared plotly.min.js), 'dashboard' (one html with all charts + figure json), or 'inline' (plotly.js embedded in every html)
+    "parsing_results_csv": '1', # 1 or 0, also write the parsing results as text to parsing_results.csv (parsing_results.bin is always written)
+    "metrics": '1', # 1 or 0, write per-stage timings, throughput and peak memory to run_metrics.json
+    "result_store": 'results.db', # SQLite file to which the parameters and results of every run are added, and from which the csv files are written (empty: off)
+    "outputs": '', # comma-separated outputs to compute, e.g. 'readability_statistics, pos_profile' (empty = all); only the features they need are computed
+    "feature_modules": '', # comma-separated Python modules that register additional features and outputs (see features.py)
+    "vocabulary_sketch": '0', # 1 or 0, estimate corpus vocabulary statistics (types, hapax legomena, most frequent words) in fixed memory (see sketch.py)
+    "sketch_top_k": '100', # number of most frequent tokens and function words reported by the vocabulary sketch
+    "max_function_words": '0', # only keep the n most frequent function words in function_word_distribution (0 = all; enables vocabulary_sketch)
+    "vocabulary_growth": '0', # 1 or 0, write the vocabulary growth (Heaps) and rank-frequency (Zipf) curves of the corpus with their power law fits
+    "zipf_ranks": '1000', # number of ranks of the rank-frequency curve
+    "trajectory_window": '0', # number of words per window of the within-text trajectories of diversity, readability and parts of speech (0 = off)
+    "trajectory_step": '0', # number of words between consecutive windows (0 = the window size)
 }
 
 with open('config.ini', 'w') as conf:
@@ -0,0 +1,194 @@
+import hashlib, os
+
+import numpy as np
+import pandas as pd
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def normalize(text):
+    """
+    Lowercases a text and removes redundant whitespace (for near-duplicate detection).
+    """
+    return ' '.join(text.lower().split())
+
+def exact_hash(text):
+    """
+    Hash of the text without redundant whitespace, used to detect exact duplicates. Case is preserved: exact
+    duplicates reuse each other's results, and case changes the parse and most statistics.
+    """
+    return hashlib.sha1(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+def shingle_hashes(text, shingle_size=5):
+
+    """
+    Hashes all character shingles of a (normalized) text with a vectorized polynomial rolling hash.
+    Arguments:
+        text: str
+        shingle_size: number of characters per shingle
+    Returns:
+        np.ndarray of unique uint64 shingle hashes
+    """
+
+    codes = np.frombuffer(normalize(text).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < shingle_size: # text shorter than one shingle: treat the whole text as a shingle
+        shingle_size = max(len(codes), 1)
+        codes = codes if len(codes) else np.zeros(1, dtype=np.uint64)
+
+    n = len(codes) - shingle_size + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    base = np.uint64(1000003)
+    for j in range(shingle_size): # uint64 arithmetic wraps around, which is fine for hashing
+        hashes = hashes * base + codes[j:j+n]
+    return np.unique(hashes)
+
+def minhash_signature(hashes, a, b, block_size=65536):
+
+    """
+    Computes the MinHash signature of a set of shingle hashes.
+    Arguments:
+        hashes: np.ndarray of uint64 shingle hashes
+        a, b: np.ndarray of uint64 permutation parameters (one per permutation)
+        block_size: number of shingles hashed at once (bounds memory for long texts)
+    Returns:
+        np.ndarray (n_permutations,) of uint64
+    """
+
+    signature = np.full(len(a), MAX_HASH, dtype=np.uint64)
+    hashes = hashes % MERSENNE_PRIME
+    for start in range(0, len(hashes), block_size):
+        block = hashes[start:start+block_size]
+        permuted = ((block[:, None] * a[None, :] + b[None, :]) % MERSENNE_PRIME) & MAX_HASH
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature
+
+def lsh_parameters(threshold, num_perm):
+
+    """
+    Chooses the number of LSH bands and rows per band so that the LSH threshold (1/bands)**(1/rows)
+    is as close as possible to the requested similarity threshold.
+    """
+
+    candidates = [(b, num_perm // b) for b in range(1, num_perm+1) if num_perm % b == 0]
+    return min(candidates, key=lambda br: abs((1/br[0])**(1/br[1]) - threshold))
+
+def find_duplicates(texts, threshold=0.9, num_perm=128, shingle_size=5, seed=1):
+
+    """
+    Detects exact duplicates (identical up to whitespace) and near-duplicates (estimated Jaccard
+    similarity of character shingles >= threshold, found with MinHash and LSH banding).
+    Empty texts are ignored.
+    Arguments:
+        texts: list of strings
+        threshold: minimum estimated Jaccard similarity for near-duplicates
+        num_perm: number of MinHash permutations
+        shingle_size: number of characters per shingle
+        seed: random seed for the permutations
+    Returns:
+        pd.DataFrame with one row per document that belongs to a duplicate cluster, with columns
+        'index' (position in texts), 'cluster', 'canonical' (position of the first text of the cluster),
+        'duplicate_of' (earlier identical text for exact duplicates, else the canonical text),
+        'type' ('canonical', 'exact' or 'near') and 'similarity' (estimated Jaccard similarity to the canonical text)
+    """
+
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    # exact duplicates
+    seen = {}
+    exact = {} # exact duplicate -> first occurrence of the same text
+    unique = []
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        h = exact_hash(text)
+        if h in seen:
+            union(seen[h], i)
+            exact[i] = seen[h]
+        else:
+            seen[h] = i
+            unique.append(i)
+
+    # near-duplicates (only among texts that are not exact duplicates)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    signatures = {i: minhash_signature(shingle_hashes(texts[i], shingle_size), a, b) for i in unique}
+
+    n_bands, n_rows = lsh_parameters(threshold, num_perm)
+    for band in range(n_bands):
+        buckets = {}
+        for i in unique:
+            key = signatures[i][band*n_rows:(band+1)*n_rows].tobytes()
+            buckets.setdefault(key, []).append(i)
+        for bucket in buckets.values():
+            for k, i in enumerate(bucket): # verify all pairs of LSH candidates with the full signature
+                for j in bucket[k+1:]:
+                    if find(i) != find(j) and np.mean(signatures[i] == signatures[j]) >= threshold:
+                        union(i, j)
+
+    # report
+    clusters = {}
+    for i in range(len(texts)):
+        clusters.setdefault(find(i), []).append(i)
+
+    rows = []
+    for cluster_id, members in enumerate(sorted(m for m in clusters.values() if len(m) > 1)):
+        canonical = members[0]
+        for i in members:
+            if i == canonical:
+                dup_type, duplicate_of = 'canonical', i
+            elif i in exact:
+                dup_type, duplicate_of = 'exact', exact[i]
+            else:
+                dup_type, duplicate_of = 'near', canonical
+            sim = float(np.mean(signatures[canonical] == signatures[exact.get(i, i)]))
+            rows.append((i, cluster_id, canonical, duplicate_of, dup_type, sim))
+
+    return pd.DataFrame(rows, columns=['index', 'cluster', 'canonical', 'duplicate_of', 'type', 'similarity'])
+
+def deduplicate(texts, infiles, mode, threshold, dir_out):
+
+    """
+    Pre-parse deduplication stage: detects duplicates, writes duplicate_clusters.csv and applies the mode.
+    Arguments:
+        texts: list of strings
+        infiles: document identifiers
+        mode: 'off', 'flag' (keep all texts; exact duplicates can reuse the results of their first occurrence)
+              or 'skip' (keep only the first text of every duplicate cluster)
+        threshold: minimum estimated Jaccard similarity for near-duplicates
+        dir_out: output directory
+    Returns:
+        texts, infiles (without the skipped duplicates),
+        duplicates_of: {position of an exact duplicate: position of its first occurrence} (only in 'flag' mode)
+    """
+
+    if mode == 'off':
+        return texts, infiles, {}
+    elif mode not in {'flag', 'skip'}:
+        raise ValueError('Please select one of the following deduplication modes: "off", "flag", "skip"')
+
+    duplicates = find_duplicates(texts, threshold)
+    report = duplicates.rename(columns={'index': 'doc'})
+    for col in ['doc', 'canonical', 'duplicate_of']:
+        report[col] = [infiles[i] for i in report[col]]
+    report.to_csv(os.path.join(dir_out, 'duplicate_clusters.csv'), index=False)
+
+    if mode == 'skip':
+        drop = set(duplicates.loc[duplicates['type'] != 'canonical', 'index'])
+        texts = [t for i, t in enumerate(texts) if i not in drop]
+        infiles = [f for i, f in enumerate(infiles) if i not in drop]
+        return texts, infiles, {}
+
+    exact = duplicates[duplicates['type'] == 'exact']
+    return texts, infiles, dict(zip(exact['index'], exact['duplicate_of']))
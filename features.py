@@ -0,0 +1,331 @@
+import heapq
+from collections import Counter
+from statistics import mean, stdev
+
+import pandas as pd
+import util, parse_store
+
+# registered features: {name: {'inputs': list of names or function of the settings, 'function': ..., 'stage': ...}}
+FEATURES = {}
+
+# names of the registered outputs, in the order in which they are written
+STATISTICS = []
+DISTRIBUTIONS = []
+
+# run_metrics stages in the order in which their features are computed (when their dependencies allow it),
+# and the value whose length is counted as the number of tokens of a stage
+STAGES = ['parse', 'syllabification', 'statistics', 'distributions', 'trajectories', 'vocabulary_sketch']
+STAGE_TOKENS = {'syllabification': 'tokens', 'statistics': 'tokens', 'trajectories': 'tokens', 'vocabulary_sketch': 'tokens'}
+
+# values that are always computed (they are written to parsing_results)
+PARSING_RESULTS = ['pos_tags', 'dependencies']
+
+def feature(name, inputs, stage='statistics', output=None):
+
+    """
+    Decorator that registers a feature: a function that computes a named value from other named values.
+    Values are computed lazily: only the features that the requested outputs (transitively) depend on are run.
+    Features can be added from outside the pipeline, e.g. in a module that is listed in feature_modules:
+
+        @features.feature('n_exclamations', ['text'], output='statistics')
+        def n_exclamations(text):
+            return pd.DataFrame(data={'n_exclamations': [text.count('!')]})
+
+    Arguments:
+        name: name of the computed value
+        inputs: names of the values the function takes as (positional) arguments: other features, 'raw_text'
+            (the text as read from the input) or settings ('nlp', 'dic', 'passive_labels', 'diversity_metric',
+            'readability_metric', 'span_size', 'segment_length', 'n_process' and the additional settings passed to
+            pipeline.analyze_text), or a function that returns the names
+            given the settings (for features whose inputs depend on e.g. the selected metric)
+        stage: run_metrics stage to which the time spent in the function is attributed
+        output: None for intermediate values, 'statistics' or 'distribution' for outputs, which return a one-row
+            pd.DataFrame and are written to <name>.csv (statistics: missing values stay empty,
+            distributions: features that do not occur in a document are 0)
+    """
+
+    def register(function):
+        FEATURES[name] = {'inputs': inputs, 'function': function, 'stage': stage}
+        for kind, names in [('statistics', STATISTICS), ('distribution', DISTRIBUTIONS)]:
+            if output == kind and name not in names:
+                names.append(name)
+        return function
+
+    return register
+
+def resolve_outputs(outputs=None):
+    """
+    Validates the names of the requested outputs (None or empty: all registered outputs).
+    Returns:
+        list of output names in the order in which they are written
+    """
+    if not outputs:
+        return STATISTICS + DISTRIBUTIONS
+    unknown = [o for o in outputs if o not in STATISTICS + DISTRIBUTIONS]
+    if unknown:
+        raise ValueError(f'Unknown outputs: {", ".join(unknown)}. Valid outputs are: {", ".join(STATISTICS + DISTRIBUTIONS)}.')
+    return [o for o in STATISTICS + DISTRIBUTIONS if o in outputs]
+
+def plan(outputs, settings):
+
+    """
+    The features that have to be computed for the requested outputs, in an order in which every feature
+    comes after its inputs (and features of earlier stages, as far as possible, before features of later stages).
+    Arguments:
+        outputs: names of the requested outputs (or of other values)
+        settings: {name: value} of the settings and 'raw_text'
+    Returns:
+        list of (feature name, names of its inputs)
+    """
+
+    inputs = {}
+    def visit(name, path):
+        if name in inputs or name in settings:
+            return
+        if name not in FEATURES:
+            raise ValueError(f'Unknown feature or input "{name}" (required by {" -> ".join(path)}).')
+        if name in path:
+            raise ValueError(f'Circular feature dependency: {" -> ".join(path + [name])}.')
+        names = FEATURES[name]['inputs']
+        names = names(settings) if callable(names) else names
+        for i in names:
+            visit(i, path + [name])
+        inputs[name] = names
+    for name in list(outputs) + PARSING_RESULTS:
+        visit(name, [])
+
+    # topological order (Kahn), preferring features of earlier stages, then the order of discovery
+    rank = {name: (STAGES.index(FEATURES[name]['stage']) if FEATURES[name]['stage'] in STAGES else len(STAGES), i) for i, name in enumerate(inputs)}
+    waiting = {name: {i for i in names if i in inputs} for name, names in inputs.items()}
+    ready = [rank[name] + (name,) for name, deps in waiting.items() if not deps]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        name = heapq.heappop(ready)[-1]
+        order.append((name, inputs[name]))
+        for other, deps in waiting.items():
+            if name in deps:
+                deps.remove(name)
+                if not deps:
+                    heapq.heappush(ready, rank[other] + (other,))
+    return order
+
+def compute(steps, values, run_metrics, profiler=None):
+
+    """
+    Runs the features of a plan.
+    Arguments:
+        steps: see plan
+        values: {name: value} with 'raw_text' and the settings, to which the computed values are added
+        run_metrics: metrics.RunMetrics that records the time spent per stage
+        profiler: profiling.FeatureProfiler that records the time and allocations per feature, or None
+    Returns:
+        values
+    """
+
+    i = 0
+    while i < len(steps): # consecutive features of the same stage are timed together
+        stage = FEATURES[steps[i][0]]['stage']
+        with run_metrics.stage(stage):
+            while i < len(steps) and FEATURES[steps[i][0]]['stage'] == stage:
+                name, names = steps[i]
+                args = [values[n] for n in names]
+                values[name] = FEATURES[name]['function'](*args) if profiler is None else profiler.call(name, FEATURES[name]['function'], args)
+                i += 1
+    for stage in dict.fromkeys(FEATURES[name]['stage'] for name, _ in steps):
+        run_metrics.count(stage, docs=1, tokens=len(values.get(STAGE_TOKENS.get(stage), values['doc'])))
+    return values
+
+#PARSE_________________________________________________________________________________________
+# the 'doc' feature (the parsed text) is registered by pipeline, see pipeline.parse
+NON_WORDS = {'PUNCT', 'SYM', 'X'}
+
+@feature('text', ['doc'], stage='parse')
+def text(doc):
+    return doc.text # text without redundant whitespace
+
+@feature('parsed_sentences', ['doc'], stage='parse')
+def parsed_sentences(doc):
+    return [[(w.text, w.pos_) for w in s] for s in doc.sents]
+
+@feature('pos_labels', ['doc'], stage='parse')
+def pos_labels(doc):
+    return [w.pos_ for s in doc.sents for w in s]
+
+@feature('dependency_labels', ['doc'], stage='parse')
+def dependency_labels(doc):
+    return [w.dep_ for s in doc.sents for w in s if w.dep_]
+
+@feature('pos_tags', ['pos_labels'], stage='parse')
+def pos_tags(pos_labels):
+    return parse_store.POS_CODEC.encode(pos_labels)
+
+@feature('dependencies', ['dependency_labels'], stage='parse')
+def dependencies(dependency_labels):
+    return parse_store.DEP_CODEC.encode(dependency_labels)
+
+@feature('tokenized_sentences', ['parsed_sentences'], stage='parse')
+def tokenized_sentences(parsed_sentences):
+    return [[t for t, pos in s if pos not in NON_WORDS] for s in parsed_sentences]
+
+@feature('tokens', ['parsed_sentences'], stage='parse')
+def tokens(parsed_sentences):
+    return [t for s in parsed_sentences for t, pos in s if pos not in NON_WORDS]
+
+@feature('types', ['tokens'], stage='parse')
+def types(tokens):
+    return set([t.lower() for t in tokens])
+
+@feature('syllables', ['parsed_sentences', 'dic'], stage='syllabification')
+def syllables(parsed_sentences, dic):
+    return [[util.get_n_syllables(t, dic) for t, pos in s if pos not in NON_WORDS] for s in parsed_sentences]
+
+#LENGTH STATISTICS_____________________________________________________________________________
+@feature('n_tokens', ['tokens'])
+def n_tokens(tokens):
+    return len(tokens)
+
+@feature('n_types', ['types'])
+def n_types(types):
+    return len(types)
+
+@feature('n_characters', ['text'])
+def n_characters(text):
+    return len(text.replace(' ', ''))
+
+@feature('n_sentences', ['doc'])
+def n_sentences(doc):
+    return len(list(doc.sents))
+
+@feature('n_long_tokens', ['tokens'])
+def n_long_tokens(tokens):
+    return len([t for t in tokens if len(t) > 6])
+
+@feature('avg_words_per_sentence', ['tokenized_sentences'])
+def avg_words_per_sentence(tokenized_sentences):
+    return mean([len(s) for s in tokenized_sentences])
+
+@feature('avg_syllables_per_word', ['syllables', 'n_tokens'])
+def avg_syllables_per_word(syllables, n_tokens):
+    return mean([s for sent in syllables for s in sent]) if n_tokens > 0 else 0
+
+@feature('content_word_ratio', ['doc'])
+def content_word_ratio(doc):
+    return util.ratio_content_words(doc)
+
+# passive auxiliaries of the languages whose dependency labels do not mark every passive, by SpaCy language code:
+# (lemma of the auxiliary, dependency label and tag of the participle), see util.get_passive_ratio
+PASSIVE_AUXILIARIES = {'de': ('werden', 'oc', 'VVPP')} # TIGER: 'sbp' only marks the agent phrase
+
+@feature('passive_ratio', ['doc', 'passive_labels'])
+def passive_ratio(doc, passive_labels):
+    return util.get_passive_ratio(doc, passive_labels, PASSIVE_AUXILIARIES.get(doc.lang_))
+
+@feature('length_statistics', [
+    'tokens', 'tokenized_sentences', 'syllables', 'n_tokens', 'n_types', 'n_characters', 'n_sentences', 'n_long_tokens',
+    'avg_words_per_sentence', 'avg_syllables_per_word', 'content_word_ratio', 'passive_ratio',
+    ], output='statistics')
+def length_statistics(tokens, tokenized_sentences, syllables, n_tokens, n_types, n_char, n_sentences, n_long_tokens, avg_words_per_sent, avg_syl_per_word, content_word_ratio, passive_ratio):
+    return pd.DataFrame(data={
+        'n_characters': [n_char],
+        'n_syllables': [sum([syl for sent in syllables for syl in sent])],
+        'n_tokens': [n_tokens],
+        'n_polysyllabic_tokens': [len([i for sent in syllables for i in sent if i > 1])],
+        'n_long_tokens': [n_long_tokens],
+        'n_types': [n_types],
+        'n_sentences': [n_sentences],
+        'avg_characters_per_word': [mean([len(t) for t in tokens]) if n_tokens > 0 else 0],
+        'std_characters_per_word': [stdev([len(t) for t in tokens]) if n_tokens > 1 else 0],
+        'avg_syllables_per_word': [avg_syl_per_word],
+        'std_syllables_per_word': [stdev([s for sent in syllables for s in sent]) if n_tokens > 1 else 0],
+        'ratio_long_words': [0 if n_tokens == 0 else n_long_tokens/n_tokens],
+        'ratio_content_words': [content_word_ratio],
+        'ratio_passive_sentences': [passive_ratio],
+        'avg_words_per_sentence': [avg_words_per_sent],
+        'std_words_per_sentence': [stdev([len(s) for s in tokenized_sentences]) if n_sentences > 1 else 0],
+        })
+
+#LEXICAL DIVERSITY______________________________________________________________________________
+# metric: util function and its inputs
+DIVERSITY_METRICS = {
+    'TTR': ('ttr', ['n_types', 'n_tokens']),
+    'RTTR': ('rttr', ['n_types', 'n_tokens']),
+    'CTTR': ('cttr', ['n_types', 'n_tokens']),
+    'STTR': ('sttr', ['tokens', 'span_size']),
+    'Herdan': ('Herdan', ['n_types', 'n_tokens']),
+    'Summer': ('Summer', ['n_types', 'n_tokens']),
+    'Dugast': ('Dugast', ['n_types', 'n_tokens']),
+    'Maas': ('Maas', ['n_types', 'n_tokens']),
+}
+
+def diversity_inputs(settings):
+    metric = settings['diversity_metric']
+    if metric not in DIVERSITY_METRICS:
+        raise ValueError('Please provide one of the following lexical diversity metrics: "TTR", "RTTR", "CTTR", "STTR", "Herdan", "Summer", "Dugast", "Maas"')
+    return ['diversity_metric', 'n_tokens'] + DIVERSITY_METRICS[metric][1]
+
+@feature('diversity_score', diversity_inputs)
+def diversity_score(diversity_metric, n_tokens, *values):
+    function, _ = DIVERSITY_METRICS[diversity_metric]
+    if diversity_metric == 'STTR': # span size as given in the config or the app
+        values = (values[0], int(values[1]))
+    return getattr(util, function)(*values) if n_tokens != 0 else None
+
+@feature('lexical_richness_statistics', ['diversity_score'], output='statistics')
+def lexical_richness_statistics(diversity_score):
+    return pd.DataFrame(data={'score': [diversity_score]})
+
+#READABILITY___________________________________________________________________________________
+# metric: util function and its inputs (only the syllable-based metrics need syllabification)
+READABILITY_METRICS = {
+    'ARI': ('ARI', ['n_characters', 'n_tokens', 'n_sentences']),
+    'Coleman-Liau': ('ColemanLiau', ['tokens', 'tokenized_sentences']),
+    'Flesch reading ease': ('Flesch', ['avg_words_per_sentence', 'avg_syllables_per_word']),
+    'Flesch Kincaid grade level': ('Kincaid', ['avg_words_per_sentence', 'avg_syllables_per_word']),
+    'Gunning Fog': ('Fog', ['avg_words_per_sentence', 'syllables']),
+    'SMOG': ('SMOG', ['syllables']),
+    'LIX': ('LIX', ['n_tokens', 'n_sentences', 'n_long_tokens']),
+    'RIX': ('RIX', ['n_long_tokens', 'n_sentences']),
+}
+
+def readability_inputs(settings):
+    metric = settings['readability_metric']
+    if metric not in READABILITY_METRICS:
+        raise ValueError('Please provide one of the following metrics: "ARI", "Coleman-Liau", "Flesch reading ease", "Flesch Kincaid grade level", "Gunning Fog", "SMOG", "LIX", "RIX".')
+    return ['readability_metric', 'n_tokens'] + READABILITY_METRICS[metric][1]
+
+@feature('readability_statistics', readability_inputs, output='statistics')
+def readability_statistics(readability_metric, n_tokens, *values):
+    function, _ = READABILITY_METRICS[readability_metric]
+    score = getattr(util, function)(*values) if n_tokens != 0 else None
+    return pd.DataFrame(data={
+        'score': [score],
+        'interpretation': [util.interpret_readability(score, readability_metric)]
+        })
+
+#DISTRIBUTIONS_________________________________________________________________________________
+@feature('punctuation_distribution', ['text'], stage='distributions', output='distribution')
+def punctuation_distribution(text):
+    return pd.DataFrame(data=util.get_punct_dist(text))
+
+@feature('function_word_distribution', ['doc'], stage='distributions', output='distribution')
+def function_word_distribution(doc):
+    return pd.DataFrame(data=util.get_function_word_distribution(doc))
+
+@feature('pos_profile', ['pos_labels'], stage='distributions', output='distribution')
+def pos_profile(pos_labels):
+    return pd.DataFrame(data=util.get_ngram_profile(pos_labels))
+
+@feature('dependency_profile', ['dependency_labels'], stage='distributions', output='distribution')
+def dependency_profile(dependency_labels):
+    return pd.DataFrame(data=util.get_dependency_distribution(dependency_labels))
+
+@feature('word_length_distribution', ['tokens'], stage='distributions', output='distribution')
+def word_length_distribution(tokens):
+    return pd.DataFrame(data=util.get_word_length_distribution(tokens))
+
+#VOCABULARY____________________________________________________________________________________
+# not an output: the counts are added to the corpus vocabulary sketch (see sketch.VocabularySketch)
+@feature('vocabulary_counts', ['tokens', 'doc'], stage='vocabulary_sketch')
+def vocabulary_counts(tokens, doc):
+    return Counter(t.lower() for t in tokens), Counter(util.get_function_words(doc))
@@ -0,0 +1,157 @@
+import os, re, multiprocessing
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+WORD = re.compile(r'\S+')
+
+def exceeds_limits(text, max_characters=0, max_tokens=0, max_word_length=0):
+
+    """
+    Checks a text against the per-document limits before it is parsed (0 = no limit).
+    Tokens are estimated as whitespace-separated words, which is cheap and close to the number of spaCy tokens.
+    Arguments:
+        text: str
+        max_characters: maximum number of characters
+        max_tokens: maximum number of words
+        max_word_length: maximum number of characters of a word (catches base64 blobs, minified code, ...)
+    Returns:
+        description of the first limit that is exceeded, or None
+    """
+
+    if max_characters and len(text) > max_characters:
+        return f'{len(text)} characters > max_characters ({max_characters})'
+    if max_tokens:
+        n_words = sum(1 for _ in WORD.finditer(text))
+        if n_words > max_tokens:
+            return f'{n_words} tokens > max_tokens ({max_tokens})'
+    if max_word_length:
+        word = re.search(r'\S{%d,}' % (max_word_length+1), text)
+        if word is not None:
+            length = len(WORD.match(text, word.start()).group())
+            return f'word of {length} characters > max_word_length ({max_word_length})'
+    return None
+
+def limit_memory(max_memory):
+    """
+    Limits the address space of the current process to its current size plus max_memory MB (Linux only,
+    elsewhere there is no limit), so that an allocation beyond it raises a MemoryError.
+    """
+    if resource is None or not max_memory:
+        return
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current + int(max_memory * 1024**2)
+    resource.setrlimit(resource.RLIMIT_AS, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+
+def worker(connection, analyze, max_memory, setup=None):
+    """
+    Main loop of the isolated worker: runs setup and reports ('ready', None) (or ('error', message)), then analyzes
+    the texts it receives and sends back ('ok', result), ('memory', None) or ('error', message).
+    """
+    try:
+        if setup is not None:
+            setup()
+    except Exception as e:
+        connection.send(('error', f'{type(e).__name__}: {e}'))
+        return
+    limit_memory(max_memory)
+    connection.send(('ready', None))
+    while True:
+        try:
+            text = connection.recv()
+        except EOFError: # the parent closed the connection
+            return
+        try:
+            connection.send(('ok', analyze(text)))
+        except MemoryError:
+            connection.send(('memory', None))
+        except Exception as e:
+            connection.send(('error', f'{type(e).__name__}: {e}'))
+
+class IsolatedAnalyzer:
+
+    """
+    Analyzes documents in a separate worker process that is killed when it exceeds a time limit, so that a
+    pathological document cannot stall or crash the run. The worker is started on first use and restarted
+    after it was killed or crashed.
+    The worker is spawned (not forked), since the parent may run other threads (e.g. the stages of
+    staging.StagedPipeline) and forking a multi-threaded process can deadlock the child. A spawned worker does not
+    inherit the state of the parent: setup loads what analyze needs (e.g. the language, see pipeline.prepare_worker)
+    before the time and memory limits apply, so every (re)start costs the time to load it.
+    """
+
+    def __init__(self, analyze, max_seconds=0, max_memory=0, setup=None):
+        """
+        Arguments:
+            analyze: picklable function that analyzes one text (e.g. a functools.partial of pipeline.analyze_isolated)
+            max_seconds: time limit per document (0 = no limit)
+            max_memory: memory the worker may allocate on top of its size after setup, in MB (0 = no limit, Linux only)
+            setup: picklable function that prepares the worker when it starts, or None
+        """
+        self.analyze = analyze
+        self.max_seconds = max_seconds
+        self.max_memory = max_memory
+        self.setup = setup
+        self.process = None
+        self.connection = None
+
+    def start(self):
+        """
+        Starts the worker and waits until its setup is done.
+        """
+        context = multiprocessing.get_context('spawn')
+        parent, child = context.Pipe()
+        self.process = context.Process(target=worker, args=(child, self.analyze, self.max_memory, self.setup), daemon=True)
+        self.process.start()
+        child.close()
+        self.connection = parent
+        try:
+            status, value = self.connection.recv()
+        except EOFError:
+            status, value = 'error', 'the worker exited'
+        if status != 'ready':
+            self.stop()
+            raise RuntimeError(f'Could not start the isolated worker ({value}).')
+
+    def run(self, text):
+
+        """
+        Analyzes one text in the worker.
+        Returns:
+            result of analyze and None, or None and the reason why the document was skipped
+        """
+
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        try:
+            self.connection.send(text)
+            if not self.connection.poll(self.max_seconds or None):
+                self.stop()
+                return None, f'timeout (> {self.max_seconds} seconds)'
+            status, value = self.connection.recv()
+        except (EOFError, OSError): # the worker died, e.g. killed by the operating system when out of memory
+            self.stop()
+            return None, 'worker crashed'
+        if status == 'ok':
+            return value, None
+        if status == 'memory':
+            self.stop() # the worker may be in a bad state after a MemoryError
+            return None, f'out of memory (> {self.max_memory} MB)'
+        return None, f'error ({value})'
+
+    def stop(self):
+        """
+        Kills the worker.
+        """
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+        self.process, self.connection = None, None
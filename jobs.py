@@ -0,0 +1,158 @@
+import os, shutil, threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+def smtp_settings():
+
+    """
+    SMTP server and delivery settings, read from environment variables:
+        STYLOSCOPE_SMTP_HOST, STYLOSCOPE_SMTP_PORT: SMTP server (default localhost:25; a local stand-in such as
+            'python -m aiosmtpd -n -l localhost:1025' prints the emails instead of sending them)
+        STYLOSCOPE_SMTP_USER, STYLOSCOPE_SMTP_PASSWORD: login (optional)
+        STYLOSCOPE_SMTP_STARTTLS: 1 to upgrade the connection with STARTTLS
+        STYLOSCOPE_MAIL_FROM: sender address
+        STYLOSCOPE_PUBLIC_URL: public address of the app, used for download links (e.g. https://styloscope.example.org)
+        STYLOSCOPE_MAX_ATTACHMENT_MB: archives up to this size are attached, larger ones are sent as a download link
+    """
+
+    return {
+        'host': os.environ.get('STYLOSCOPE_SMTP_HOST', 'localhost'),
+        'port': int(os.environ.get('STYLOSCOPE_SMTP_PORT', '25')),
+        'user': os.environ.get('STYLOSCOPE_SMTP_USER', ''),
+        'password': os.environ.get('STYLOSCOPE_SMTP_PASSWORD', ''),
+        'starttls': bool(int(os.environ.get('STYLOSCOPE_SMTP_STARTTLS', '0'))),
+        'sender': os.environ.get('STYLOSCOPE_MAIL_FROM', 'styloscope@localhost'),
+        'public_url': os.environ.get('STYLOSCOPE_PUBLIC_URL', '').rstrip('/'),
+        'max_attachment_mb': float(os.environ.get('STYLOSCOPE_MAX_ATTACHMENT_MB', '10')),
+    }
+
+def send_mail(settings, recipient, subject, body, attachment=None):
+
+    """
+    Sends an email, optionally with a file attached.
+    Arguments:
+        settings: see smtp_settings
+        recipient: email address
+        subject, body: str
+        attachment: path of the file to attach, or None
+    """
+
+    # only imported when an email is sent (keeps startup fast)
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.application import MIMEApplication
+
+    message = MIMEMultipart()
+    message['From'] = settings['sender']
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.attach(MIMEText(body, 'plain'))
+    if attachment is not None:
+        with open(attachment, 'rb') as f:
+            part = MIMEApplication(f.read(), Name=os.path.basename(attachment))
+        part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment)}"'
+        message.attach(part)
+
+    with smtplib.SMTP(settings['host'], settings['port'], timeout=60) as server:
+        if settings['starttls']:
+            server.starttls()
+        if settings['user']:
+            server.login(settings['user'], settings['password'])
+        server.send_message(message)
+
+def send_results(settings, recipient, run_id, archive):
+
+    """
+    Emails the output archive of a finished job: attached if it is small enough, else as a download link
+    (served by the app at /download/<run id>).
+    """
+
+    size_mb = os.path.getsize(archive) / 1024**2
+    if size_mb <= settings['max_attachment_mb']:
+        body = f'Your Styloscope analysis (run {run_id}) has finished. The results are attached.'
+        send_mail(settings, recipient, 'Styloscope results', body, archive)
+    else:
+        if settings['public_url']:
+            location = f"{settings['public_url']}/download/{run_id}"
+        else:
+            location = f'run {run_id} on the Styloscope server (no public download address is configured)'
+        body = f'Your Styloscope analysis (run {run_id}) has finished. The results ({size_mb:.0f} MB) are too large to attach, download them from {location}'
+        send_mail(settings, recipient, 'Styloscope results', body)
+
+class JobQueue:
+
+    """
+    Runs pipeline jobs in background threads and emails the results, so that the web app does not have to keep
+    a connection (and a concurrency slot) open for the duration of a run.
+    """
+
+    def __init__(self, max_workers=1, settings=None):
+        """
+        Arguments:
+            max_workers: number of jobs that run at the same time (the others wait in the queue)
+            settings: SMTP settings (default: smtp_settings())
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='styloscope-job')
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, run_id, recipient, run, *args, **kwargs):
+
+        """
+        Queues a job.
+        Arguments:
+            run_id: unique id of the run
+            recipient: email address the results are sent to
+            run: function that runs the pipeline and returns the path of the output archive (e.g. stylo_app.run_pipeline)
+            args, kwargs: arguments of run
+        Returns:
+            {'status': 'queued', ...}, the job record (see status)
+        """
+
+        with self.lock:
+            self.jobs[run_id] = {'status': 'queued', 'recipient': recipient, 'submitted': time.time(), 'error': None}
+        self.executor.submit(self._run, run_id, recipient, run, args, kwargs)
+        return self.status(run_id)
+
+    def _set(self, run_id, **fields):
+        with self.lock:
+            self.jobs[run_id].update(fields)
+
+    def _run(self, run_id, recipient, run, args, kwargs):
+        settings = self.settings or smtp_settings()
+        self._set(run_id, status='running', started=time.time())
+        try:
+            archive = run(*args, **kwargs)
+        except Exception:
+            self._set(run_id, status='failed', error=traceback.format_exc(), finished=time.time())
+            try:
+                body = f'Your Styloscope analysis (run {run_id}) failed. Please check the input and settings and try again.'
+                send_mail(settings, recipient, 'Styloscope analysis failed', body)
+            except Exception:
+                traceback.print_exc()
+            return
+        self._set(run_id, status='sending', archive=archive)
+        try:
+            send_results(settings, recipient, run_id, archive)
+        except Exception:
+            self._set(run_id, status='email failed', error=traceback.format_exc(), finished=time.time())
+            return
+        self._set(run_id, status='done', finished=time.time())
+
+    def status(self, run_id):
+        """
+        The record of a job (status: 'queued', 'running', 'sending', 'done', 'failed' or 'email failed'), or None.
+        """
+        with self.lock:
+            job = self.jobs.get(run_id)
+            return dict(job) if job is not None else None
+
+def stage_input(fn, job_dir):
+    """
+    Copies an uploaded file to the job's own folder, so that it is still available when the job starts.
+    """
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, os.path.basename(fn))
+    shutil.copyfile(fn, path)
+    return path
@@ -0,0 +1,182 @@
+import os, json, sys, time, threading
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the process so far (in MB), or None if unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, kilobytes on Linux
+
+class RunMetrics:
+
+    """
+    Records wall time, CPU time, throughput and memory per pipeline stage.
+    The peak RSS of a process is a high-water mark, so a stage cannot be given a peak of its own without tracing its
+    allocations. Every stage records instead the process peak RSS so far at the end of its last call
+    (process_peak_rss_mb) and by how much its calls raised the process peak (peak_rss_increase_mb): the stages with
+    an increase are those that set the peak memory of the run (when stages run concurrently, the increase goes to
+    whichever stage finishes a call first).
+    When disabled, stage() returns a shared no-op context manager and count() returns immediately.
+    Stages may be timed from several threads at once (see staging.StagedPipeline): the CPU time of a stage is that of
+    the thread that runs it, and the wall times of stages that overlap add up to more than the wall time of the run.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self._noop = nullcontext()
+        self.lock = threading.Lock()
+
+    def _get(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'docs': 0, 'tokens': 0, 'process_peak_rss_mb': None, 'peak_rss_increase_mb': 0.0}
+        return self.stages[name]
+
+    def stage(self, name):
+        """
+        Context manager that times one execution of a stage.
+        """
+        if not self.enabled:
+            return self._noop
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        wall, cpu, peak = time.perf_counter(), time.thread_time(), peak_rss_mb()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            with self.lock:
+                s = self._get(name)
+                s['calls'] += 1
+                s['wall_time'] += wall
+                s['cpu_time'] += cpu
+                s['process_peak_rss_mb'] = peak_rss_mb()
+                if peak is not None:
+                    s['peak_rss_increase_mb'] += s['process_peak_rss_mb'] - peak
+
+    def iterate(self, name, iterable):
+        """
+        Yields the items of an iterable (e.g. a streamed input), timing every step as a call of the stage
+        and counting every item as a document.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            with self._timed(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            self.count(name, docs=1)
+            yield item
+
+    def count(self, name, docs=0, tokens=0):
+        """
+        Adds the number of documents and tokens handled by a stage.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            s = self._get(name)
+            s['docs'] += docs
+            s['tokens'] += tokens
+
+    def to_dict(self):
+        """
+        Summary of the run, with docs/sec and tokens/sec per stage.
+        """
+        with self.lock:
+            stages = {name: dict(s) for name, s in self.stages.items()}
+        for name, s in stages.items():
+            s['docs_per_sec'] = s['docs']/s['wall_time'] if s['docs'] and s['wall_time'] else None
+            s['tokens_per_sec'] = s['tokens']/s['wall_time'] if s['tokens'] and s['wall_time'] else None
+        return {
+            'wall_time': time.perf_counter() - self.start_wall,
+            'cpu_time': time.process_time() - self.start_cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': stages,
+        }
+
+    def write(self, dir_out):
+        """
+        Writes run_metrics.json to the output directory and adds the run to the process-wide totals.
+        """
+        if not self.enabled:
+            return
+        summary = self.to_dict()
+        with open(os.path.join(dir_out, 'run_metrics.json'), 'w') as f:
+            json.dump(summary, f, indent=4)
+        TOTALS.add_run(summary)
+
+class ProcessTotals:
+
+    """
+    Stage totals over all runs in this process, exported in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.stages = {}
+
+    def add_run(self, summary):
+        with self.lock:
+            self.runs += 1
+        for name, stage in summary['stages'].items():
+            self.add_stage(name, stage)
+
+    def add_stage(self, name, stage):
+        """
+        Adds the counts of one stage (e.g. a stage that finished after run_metrics.json was written).
+        """
+        with self.lock:
+            totals = self.stages.setdefault(name, {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'docs': 0, 'tokens': 0})
+            for k in totals:
+                totals[k] += stage[k]
+
+    def prometheus_text(self):
+        metrics = [
+            ('calls', 'styloscope_stage_calls_total', 'Number of executions of a pipeline stage.'),
+            ('wall_time', 'styloscope_stage_wall_seconds_total', 'Wall time spent in a pipeline stage.'),
+            ('cpu_time', 'styloscope_stage_cpu_seconds_total', 'CPU time spent in a pipeline stage.'),
+            ('docs', 'styloscope_stage_documents_total', 'Documents processed by a pipeline stage.'),
+            ('tokens', 'styloscope_stage_tokens_total', 'Tokens processed by a pipeline stage.'),
+        ]
+        with self.lock:
+            lines = [
+                '# HELP styloscope_runs_total Number of completed pipeline runs.',
+                '# TYPE styloscope_runs_total counter',
+                f'styloscope_runs_total {self.runs}',
+            ]
+            for key, metric, description in metrics:
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} counter')
+                for name, totals in sorted(self.stages.items()):
+                    lines.append(f'{metric}{{stage="{name}"}} {totals[key]}')
+
+        peak = peak_rss_mb()
+        if peak is not None:
+            lines += [
+                '# HELP styloscope_peak_rss_bytes Peak resident set size of the process.',
+                '# TYPE styloscope_peak_rss_bytes gauge',
+                f'styloscope_peak_rss_bytes {int(peak*1024**2)}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+TOTALS = ProcessTotals()
+
+DISABLED = RunMetrics(enabled=False)
@@ -0,0 +1,220 @@
+import os, json, struct, threading
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'STYLOPRS'
+VERSION = 1
+ALIGNMENT = 64
+
+# universal part-of-speech tags (plus spaCy's SPACE)
+UPOS = ['ADJ', 'ADP', 'ADV', 'AUX', 'CCONJ', 'DET', 'INTJ', 'NOUN', 'NUM', 'PART', 'PRON', 'PROPN', 'PUNCT', 'SCONJ', 'SYM', 'VERB', 'X', 'SPACE']
+
+# universal dependency relations (spaCy writes the root as 'ROOT') and the ClearNLP labels of the English models;
+# language-specific subtypes (e.g. 'nsubj:pass') are added when they are first encountered
+DEPENDENCIES = [
+    'ROOT', 'acl', 'advcl', 'advmod', 'amod', 'appos', 'aux', 'case', 'cc', 'ccomp', 'clf', 'compound', 'conj',
+    'cop', 'csubj', 'dep', 'det', 'discourse', 'dislocated', 'expl', 'fixed', 'flat', 'goeswith', 'iobj', 'list',
+    'mark', 'nmod', 'nsubj', 'nummod', 'obj', 'obl', 'orphan', 'parataxis', 'punct', 'reparandum', 'vocative', 'xcomp',
+    'acomp', 'agent', 'attr', 'auxpass', 'csubjpass', 'dative', 'dobj', 'intj', 'meta', 'neg', 'npadvmod', 'nsubjpass',
+    'oprd', 'pcomp', 'pobj', 'poss', 'preconj', 'predet', 'prep', 'prt', 'quantmod', 'relcl',
+]
+
+class LabelCodec:
+
+    """
+    Maps labels to uint8 ids. Labels that are not in the initial label set get the next free id, so the ids of
+    such labels depend on the order in which a process encounters them: codes are only meaningful to the codec
+    that produced them (the isolated worker therefore returns labels, see pipeline.analyze_isolated).
+    """
+
+    def __init__(self, labels):
+        self.labels = list(labels)
+        self.ids = {label: i for i, label in enumerate(self.labels)}
+        self.lock = threading.Lock() # concurrent runs (e.g. jobs of the app) share the codec
+
+    def encode(self, sequence):
+        """
+        Encodes a sequence of labels as np.ndarray of uint8.
+        """
+        codes = np.empty(len(sequence), dtype=np.uint8)
+        for i, label in enumerate(sequence):
+            code = self.ids.get(label)
+            if code is None:
+                code = self.add(label)
+            codes[i] = code
+        return codes
+
+    def add(self, label):
+        """
+        Assigns the next free id to a new label and returns its id.
+        """
+        with self.lock:
+            code = self.ids.get(label)
+            if code is None:
+                if len(self.labels) == 256:
+                    raise ValueError(f'Cannot encode more than 256 different labels (new label: "{label}").')
+                self.labels.append(label)
+                code = self.ids[label] = len(self.labels) - 1
+            return code
+
+    def decode(self, codes):
+        """
+        Decodes uint8 ids to a list of labels.
+        """
+        return [self.labels[code] for code in codes]
+
+    def join(self, codes):
+        """
+        Decodes uint8 ids to the space-joined labels stored in parsing_results.csv.
+        """
+        return ' '.join(self.decode(codes))
+
+# shared by all runs in the process, so that ids are consistent between documents
+POS_CODEC = LabelCodec(UPOS)
+DEP_CODEC = LabelCodec(DEPENDENCIES)
+
+class ParsingResultsWriter:
+
+    """
+    Writes part-of-speech and dependency ids of one document after the other to a single binary file:
+    the magic bytes, the offset of a json footer (uint64), the aligned arrays 'pos' and 'dependencies'
+    (uint8 ids of all documents, concatenated) and 'pos_offsets' and 'dep_offsets' (int64, n_docs+1: document i
+    spans [offsets[i], offsets[i+1])), and the footer with the label sets, document ids and array locations.
+    Dependencies are buffered in a temporary file next to the output until close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + struct.pack('<Q', 0))
+        self._align()
+        self.pos_start = self.file.tell()
+        self.dep_file = open(path + '.dep.tmp', 'wb')
+        self.docs = []
+        self.pos_offsets = [0]
+        self.dep_offsets = [0]
+
+    def _align(self):
+        self.file.write(b'\0' * (-self.file.tell() % ALIGNMENT))
+
+    def add(self, doc, pos_codes, dep_codes):
+        """
+        Appends the ids of one document.
+        """
+        self.docs.append(doc.item() if isinstance(doc, np.generic) else doc)
+        self.file.write(np.asarray(pos_codes, dtype=np.uint8).tobytes())
+        self.dep_file.write(np.asarray(dep_codes, dtype=np.uint8).tobytes())
+        self.pos_offsets.append(self.pos_offsets[-1] + len(pos_codes))
+        self.dep_offsets.append(self.dep_offsets[-1] + len(dep_codes))
+
+    def _write_array(self, array):
+        self._align()
+        offset = self.file.tell()
+        self.file.write(array.tobytes())
+        return {'offset': offset, 'dtype': array.dtype.str, 'length': len(array)}
+
+    def close(self):
+        """
+        Copies the dependencies and offsets into the file and writes the footer.
+        """
+        arrays = {'pos': {'offset': self.pos_start, 'dtype': '|u1', 'length': self.pos_offsets[-1]}}
+
+        self.dep_file.close()
+        self._align()
+        arrays['dependencies'] = {'offset': self.file.tell(), 'dtype': '|u1', 'length': self.dep_offsets[-1]}
+        with open(self.dep_file.name, 'rb') as f:
+            while True:
+                block = f.read(1 << 20)
+                if not block:
+                    break
+                self.file.write(block)
+        os.remove(self.dep_file.name)
+
+        arrays['pos_offsets'] = self._write_array(np.array(self.pos_offsets, dtype=np.int64))
+        arrays['dep_offsets'] = self._write_array(np.array(self.dep_offsets, dtype=np.int64))
+
+        footer_offset = self.file.tell()
+        self.file.write(json.dumps({
+            'version': VERSION,
+            'pos_labels': POS_CODEC.labels,
+            'dep_labels': DEP_CODEC.labels,
+            'docs': self.docs,
+            'arrays': arrays,
+        }).encode('utf-8'))
+        self.file.seek(len(MAGIC))
+        self.file.write(struct.pack('<Q', footer_offset))
+        self.file.close()
+
+class ParsingResults:
+
+    """
+    Reader for parsing_results.bin. The id arrays are memory-mapped, so only the documents that are
+    accessed are read from disk.
+    Attributes:
+        docs: document ids
+        pos_labels, dep_labels: labels of the ids
+        pos, dependencies: uint8 ids of all documents (concatenated)
+        pos_offsets, dep_offsets: int64 start of every document in pos / dependencies (plus the total length)
+    """
+
+    def __init__(self, path, mmap=True):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a parsing results file.')
+            footer_offset, = struct.unpack('<Q', f.read(8))
+            f.seek(footer_offset)
+            footer = json.loads(f.read().decode('utf-8'))
+
+        self.docs = footer['docs']
+        self.pos_labels = footer['pos_labels']
+        self.dep_labels = footer['dep_labels']
+        for name, spec in footer['arrays'].items():
+            if mmap and spec['length']:
+                array = np.memmap(path, dtype=spec['dtype'], mode='r', offset=spec['offset'], shape=(spec['length'],))
+            else:
+                array = np.fromfile(path, dtype=spec['dtype'], count=spec['length'], offset=spec['offset'])
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def pos_codes(self, i):
+        """
+        Part-of-speech ids of document i (a view, no copy).
+        """
+        return self.pos[self.pos_offsets[i]:self.pos_offsets[i+1]]
+
+    def dep_codes(self, i):
+        """
+        Dependency ids of document i (a view, no copy).
+        """
+        return self.dependencies[self.dep_offsets[i]:self.dep_offsets[i+1]]
+
+    def pos_tags(self, i):
+        """
+        Part-of-speech tags of document i.
+        """
+        return [self.pos_labels[code] for code in self.pos_codes(i)]
+
+    def dependency_labels(self, i):
+        """
+        Syntactic dependencies of document i.
+        """
+        return [self.dep_labels[code] for code in self.dep_codes(i)]
+
+    def to_frame(self):
+        """
+        The parsing results in the layout of parsing_results.csv.
+        """
+        return pd.DataFrame(data={
+            'document': self.docs,
+            'part-of-speech tags': [' '.join(self.pos_tags(i)) for i in range(len(self))],
+            'syntactic dependencies': [' '.join(self.dependency_labels(i)) for i in range(len(self))],
+        })
+
+def load_parsing_results(path, mmap=True):
+    """
+    Opens parsing_results.bin (see ParsingResults).
+    """
+    return ParsingResults(path, mmap)
@@ -0,0 +1,783 @@
+import os, re, importlib
+from contextlib import contextmanager
+
+import pandas as pd
+import numpy as np
+import spacy, pyphen
+from spacy.tokens import Doc
+import features, isolation, visualizations, similarity, metrics, spill, parse_store, sampling, store
+#______________________________________________________________________________________________
+
+LANGUAGES = {
+    'Dutch': ('nl_core_news_lg', 'nl_NL'),
+    'English': ('en_core_web_lg', 'en'),
+    'French': ('fr_core_news_lg', 'fr_FR'),
+    'German': ('de_core_news_lg', 'de'),
+}
+
+# names of the outputs (the features registered as outputs in features.py, plus those of feature_modules)
+STATISTICS = features.STATISTICS
+DISTRIBUTIONS = features.DISTRIBUTIONS
+
+# distributions that are shown as bar charts (and have reference corpora)
+CHARTED_DISTRIBUTIONS = ['punctuation_distribution', 'pos_profile', 'dependency_profile', 'word_length_distribution']
+
+def load_language(lang):
+
+    """
+    Loads the SpaCy model and Pyphen syllabifier of a language.
+    Arguments:
+        lang: 'Dutch', 'English', 'French' or 'German'
+    Returns:
+        nlp: SpaCy pipeline,
+        dic: Pyphen instance
+    """
+
+    if lang not in LANGUAGES:
+        raise ValueError('Please provide one of the following languages: "Dutch", "English", "French", "German".')
+    model_name, pyphen_lang = LANGUAGES[lang]
+    return spacy.load(model_name), pyphen.Pyphen(lang=pyphen_lang)
+
+# dependency labels that mark a passive construction, per language (Dutch and French: Universal Dependencies,
+# English: ClearNLP, German: TIGER, which only labels the agent phrase)
+PASSIVE_LABELS = {
+    'Dutch': ['nsubj:pass', 'aux:pass', 'csubj:pass'],
+    'English': ['nsubjpass', 'auxpass', 'csubjpass'],
+    'French': ['nsubj:pass', 'aux:pass', 'csubj:pass', 'obl:agent'],
+    'German': ['sbp'], # agentless passives are detected from the auxiliary (see features.PASSIVE_AUXILIARIES)
+}
+
+def get_passive_labels(nlp, lang, labels=None):
+
+    """
+    Hashes the dependency labels that mark a sentence as passive (see util.get_passive_ratio).
+    Arguments:
+        nlp: SpaCy pipeline
+        lang: 'Dutch', 'English', 'French' or 'German'
+        labels: list of labels that replaces the default labels of the language
+    Returns:
+        np.ndarray of uint64 label hashes
+    """
+
+    labels = PASSIVE_LABELS[lang] if labels is None else labels
+    return np.array([nlp.vocab.strings.add(label) for label in labels], dtype=np.uint64)
+
+# texts longer than this (in characters) are split into segments that are parsed separately (spaCy's max_length is 1,000,000)
+SEGMENT_LENGTH = 100000
+
+PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n\s*')
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])[\'"”’)\]]*\s+')
+WHITESPACE = re.compile(r'\s+')
+
+def segment_text(text, max_length=SEGMENT_LENGTH):
+
+    """
+    Splits a long text into segments of at most max_length characters, preferably at paragraph breaks,
+    else at sentence ends, else at whitespace. Segments are split inside whitespace, so joining the
+    whitespace-normalized segments with a space gives the whitespace-normalized text.
+    Arguments:
+        text: str
+        max_length: maximum number of characters per segment
+    Returns:
+        list of strings
+    """
+
+    segments = []
+    start = 0
+    while len(text) - start > max_length:
+        window = text[start:start+max_length]
+        for pattern in (PARAGRAPH_BREAK, SENTENCE_BREAK, WHITESPACE):
+            breaks = [m for m in pattern.finditer(window) if m.start() > 0]
+            if breaks:
+                cut, next_start = start + breaks[-1].start(), start + breaks[-1].end()
+                break
+        else: # no whitespace at all
+            cut = next_start = start + max_length
+        segments.append(text[start:cut])
+        start = next_start
+    segments.append(text[start:])
+    return segments
+
+def parse(text, nlp, segment_length=SEGMENT_LENGTH, n_process=1):
+
+    """
+    Parses a text. Long texts are split with segment_text, the segments are parsed with nlp.pipe
+    (in n_process processes) and merged back into a single Doc, so that all document-level statistics
+    are computed over the whole text.
+    Arguments:
+        text: str (not yet whitespace-normalized)
+        nlp: SpaCy pipeline
+        segment_length: maximum number of characters per segment
+        n_process: number of processes used to parse the segments of one text
+    Returns:
+        SpaCy Doc of the whitespace-normalized text
+    """
+
+    segments = [' '.join(s.split()) for s in segment_text(text, segment_length)]
+    segments = [s for s in segments if s]
+    if len(segments) == 1:
+        return nlp(segments[0])
+    docs = list(nlp.pipe(segments, batch_size=1, n_process=min(n_process, len(segments))))
+    return Doc.from_docs(docs)
+
+# the parsed text, from which all other features are computed
+features.feature('doc', ['raw_text', 'nlp', 'segment_length', 'n_process'], stage='parse')(parse)
+
+def empty_result(outputs=None):
+
+    """
+    Result for an empty text: dummy data that keeps the outputs aligned with the 'doc' column.
+    """
+
+    dummy_df = pd.DataFrame(data={'__Dummy__': ['dummy']})
+    result = {k: dummy_df for k in features.resolve_outputs(outputs)}
+    result['pos_tags'] = parse_store.POS_CODEC.encode([])
+    result['dependencies'] = parse_store.DEP_CODEC.encode([])
+    return result
+
+def parse_text(text, nlp, dic, passive_labels, diversity_metric, readability_metric, span_size, run_metrics=metrics.DISABLED, segment_length=SEGMENT_LENGTH, n_process=1, outputs=None, extra_values=(), settings=None, profiler=None):
+
+    """
+    First part of analyze_text: parses a text and computes the features of the parse stage, which are the only
+    ones that use the SpaCy pipeline (see features.STAGES). The other features are computed by analyze_parsed,
+    possibly in another thread (see staging.StagedPipeline).
+    Arguments:
+        see analyze_text
+    Returns:
+        the values computed so far and the remaining steps of the plan (see features.plan), or None for an empty text
+    """
+
+    if not text.strip():
+        return None
+
+    values = {
+        'raw_text': text,
+        'nlp': nlp,
+        'dic': dic,
+        'passive_labels': passive_labels,
+        'diversity_metric': diversity_metric,
+        'readability_metric': readability_metric,
+        'span_size': span_size,
+        'segment_length': segment_length,
+        'n_process': n_process,
+        **(settings or {}),
+    }
+    steps = features.plan(features.resolve_outputs(outputs) + list(extra_values), values)
+    # parse features only depend on other parse features and the settings, so they can be computed first
+    parsing = [step for step in steps if features.FEATURES[step[0]]['stage'] == 'parse']
+    features.compute(parsing, values, run_metrics, profiler)
+    return values, [step for step in steps if features.FEATURES[step[0]]['stage'] != 'parse']
+
+def analyze_parsed(parsed, run_metrics=metrics.DISABLED, outputs=None, extra_values=(), profiler=None):
+
+    """
+    Second part of analyze_text: computes the remaining features of a parsed text.
+    Arguments:
+        parsed: values and steps returned by parse_text
+        run_metrics, outputs, extra_values, profiler: see analyze_text
+    Returns:
+        see analyze_text
+    """
+
+    values, steps = parsed
+    features.compute(steps, values, run_metrics, profiler)
+    return {k: values[k] for k in features.PARSING_RESULTS + features.resolve_outputs(outputs) + list(extra_values)}
+
+def analyze_text(text, nlp, dic, passive_labels, diversity_metric, readability_metric, span_size, run_metrics=metrics.DISABLED, segment_length=SEGMENT_LENGTH, n_process=1, outputs=None, extra_values=(), settings=None, profiler=None):
+
+    """
+    Computes the requested statistics and distributions of one text. Only the features these outputs depend on
+    are computed (see features.plan), e.g. syllabification is skipped when no output needs syllables.
+    Arguments:
+        text: str
+        nlp: SpaCy pipeline
+        dic: Pyphen instance
+        passive_labels: hashes of the passive dependency labels (see get_passive_labels)
+        diversity_metric: lexical diversity metric name
+        readability_metric: readability metric name
+        span_size: token span used for STTR
+        run_metrics: metrics.RunMetrics that records the time spent per stage
+        segment_length, n_process: see parse
+        outputs: names of the requested outputs (None: all, see features.resolve_outputs)
+        extra_values: names of other feature values to return, e.g. 'vocabulary_counts' (not returned for empty texts)
+        settings: {name: value} of additional settings of the features, e.g. window_size and window_step of the
+            trajectory (see trajectories.trajectory)
+        profiler: profiling.FeatureProfiler of the run, or None
+    Returns:
+        {output name: one-row pd.DataFrame}, plus 'pos_tags' and 'dependencies' as uint8 ids (see parse_store)
+        and the extra values
+    """
+
+    parsed = parse_text(text, nlp, dic, passive_labels, diversity_metric, readability_metric, span_size, run_metrics, segment_length, n_process, outputs, extra_values, settings, profiler)
+    if parsed is None: # empty text
+        return empty_result(outputs)
+    return analyze_parsed(parsed, run_metrics, outputs, extra_values, profiler)
+
+# language of an isolated worker process, loaded by prepare_worker
+WORKER = {}
+
+def prepare_worker(lang, feature_modules=()):
+    """
+    Setup of the isolated worker (see isolation.IsolatedAnalyzer): the worker is spawned, so it imports the modules
+    that register additional features itself and loads its own copy of the language.
+    """
+    for module in feature_modules:
+        importlib.import_module(module)
+    WORKER['nlp'], WORKER['dic'] = load_language(lang)
+
+def analyze_isolated(text, **analysis):
+    """
+    analyze_text in the isolated worker, with the language loaded by prepare_worker. Part-of-speech tags and
+    dependencies are returned as labels: the worker's codecs assign ids to new labels in a different order than
+    the parent's, so the parent encodes them itself (see encode_labels).
+    """
+    result = analyze_text(text, WORKER['nlp'], WORKER['dic'], **analysis)
+    result['pos_tags'] = parse_store.POS_CODEC.decode(result['pos_tags'])
+    result['dependencies'] = parse_store.DEP_CODEC.decode(result['dependencies'])
+    return result
+
+def encode_labels(result):
+    """
+    Encodes the labels of a result of analyze_isolated with the codecs of this process.
+    """
+    result['pos_tags'] = parse_store.POS_CODEC.encode(result['pos_tags'])
+    result['dependencies'] = parse_store.DEP_CODEC.encode(result['dependencies'])
+    return result
+
+def parse_document(document, analysis, limits=None, isolated=None, duplicates_of=(), run_metrics=metrics.DISABLED):
+
+    """
+    Parse stage of the analysis of a corpus document (see staging.StagedPipeline). Texts that exceed the per-document
+    limits are analyzed completely in the isolated worker instead, and exact duplicates are not analyzed at all.
+    Arguments:
+        document: (number of the document, (text, document name))
+        analysis: keyword arguments of analyze_text (nlp, dic, passive_labels, ..., outputs, extra_values, settings, profiler)
+        limits: {limit: value} (see isolation.exceeds_limits), only checked if isolated is given
+        isolated: isolation.IsolatedAnalyzer of analyze_isolated, or None
+        duplicates_of: numbers of the exact duplicates (see dedup.deduplicate)
+        run_metrics: metrics.RunMetrics that records the time spent per stage
+    Returns:
+        {'number', 'infile', 'parsed' (see parse_text), 'result' (see analyze_text, None while the text still has to be
+        analyzed by analyze_document and for duplicates), 'skipped' (row of skipped_documents.csv or None)}
+    """
+
+    i, (text, infile) = document
+    document = {'number': i, 'infile': infile, 'parsed': None, 'result': None, 'skipped': None}
+    if i in duplicates_of:
+        return document
+    limit = isolation.exceeds_limits(text, **limits) if isolated is not None else None
+    if limit is None:
+        document['parsed'] = parse_text(text, run_metrics=run_metrics, **analysis)
+        if document['parsed'] is None:
+            document['result'] = empty_result(analysis.get('outputs'))
+    else:
+        with run_metrics.stage('isolation'):
+            document['result'], reason = isolated.run(text)
+        if document['result'] is None: # skipped documents keep their row (like empty texts), so the outputs stay aligned
+            document['skipped'] = {'doc': infile, 'n_characters': len(text), 'limit': limit, 'reason': reason}
+            document['result'] = empty_result(analysis.get('outputs'))
+        else:
+            document['result'] = encode_labels(document['result'])
+    return document
+
+def analyze_document(document, analysis, run_metrics=metrics.DISABLED):
+    """
+    Feature stage of the analysis of a corpus document: computes the features of a document returned by
+    parse_document (see analyze_parsed).
+    """
+    parsed = document.pop('parsed')
+    if parsed is not None:
+        document['result'] = analyze_parsed(parsed, run_metrics, analysis.get('outputs'), analysis.get('extra_values', ()), analysis.get('profiler'))
+    return document
+
+#AGGREGATION___________________________________________________________________________________
+def add_summary_rows(df):
+
+    """
+    Appends the corpus mean and standard deviation as rows with doc = 'mean' and doc = 'std'.
+    """
+
+    mean_df = df.mean(numeric_only=True).to_frame().T
+    mean_df['doc'] = 'mean'
+
+    std_df = df.std(numeric_only=True).to_frame().T
+    std_df['doc'] = 'std'
+
+    return pd.concat([df, mean_df, std_df])
+
+def group_summary(df, groups):
+
+    """
+    The mean and standard deviation of every group, in one vectorized group reduction.
+    Arguments:
+        df: per-document dataframe with a 'doc' column
+        groups: group of every document (aligned with the rows of df)
+    Returns:
+        pd.DataFrame with the columns 'group' and 'doc' (= 'mean' or 'std') and the numeric columns of df
+    """
+
+    grouped = df.drop(columns=['doc']).select_dtypes('number').groupby(pd.Index([str(g) for g in groups], name='group'))
+    mean_df = grouped.mean().reset_index()
+    mean_df.insert(1, 'doc', 'mean')
+    std_df = grouped.std().reset_index()
+    std_df.insert(1, 'doc', 'std')
+    return pd.concat([mean_df, std_df]).sort_values('group', kind='stable').reset_index(drop=True)
+
+def concat_statistics(dfs, infiles):
+
+    """
+    Concatenates the per-document statistics (one-row dataframes) and adds the 'doc' column.
+    """
+
+    df = pd.concat(dfs, axis=0)
+    df = df.drop(columns=['__Dummy__']) if '__Dummy__' in df.columns else df
+    df.insert(0, 'doc', infiles)
+    return df
+
+def concat_distribution(dfs, infiles):
+
+    """
+    Concatenates the per-document distributions (one-row dataframes) and adds the 'doc' column.
+    Features that do not occur in a document get a relative frequency of 0.
+    """
+
+    dfs = [df if not df.empty else pd.DataFrame([np.nan], columns=['__Empty__']) for df in dfs] # when there is an empty dataframe, pd.concat ignores this leading to incongruencies in length
+    df = pd.concat(dfs, axis=0).fillna(0)
+    df = df.drop(columns=['__Dummy__']) if '__Dummy__' in df.columns else df
+    df = df.drop(columns=['__Empty__']) if '__Empty__' in df.columns else df
+    df.insert(0, 'doc', infiles)
+    return df
+
+def restrict_distribution(name, df, function_words=None):
+    """
+    Keeps only the given function words (e.g. the most frequent ones of the corpus, see sketch.VocabularySketch)
+    of the function_word_distribution, so that its number of columns is bounded. Other distributions are returned as is.
+    """
+    if name != 'function_word_distribution' or function_words is None:
+        return df
+    function_words = set(function_words)
+    return df[[c for c in df.columns if c == 'doc' or c in function_words]]
+
+def write_parsing_results(infiles, pos_codes, dep_codes, dir_out, first=True, writer=None, csv=True):
+
+    """
+    Adds the parsing results of (a chunk of) documents to parsing_results.bin and optionally parsing_results.csv.
+    Arguments:
+        infiles: document identifiers
+        pos_codes, dep_codes: per document, uint8 part-of-speech and dependency ids
+        dir_out: output directory
+        first: whether this is the first chunk (the csv file is created, otherwise appended to)
+        writer: open parse_store.ParsingResultsWriter (if None, parsing_results.bin is written and closed here)
+        csv: also write the labels as space-joined strings to parsing_results.csv
+    """
+
+    own_writer = writer is None
+    writer = parse_store.ParsingResultsWriter(os.path.join(dir_out, 'parsing_results.bin')) if own_writer else writer
+    for doc, pos, dep in zip(infiles, pos_codes, dep_codes):
+        writer.add(doc, pos, dep)
+    if own_writer:
+        writer.close()
+
+    if csv:
+        parsing_df = pd.DataFrame(data={
+            'document': infiles,
+            'part-of-speech tags': [parse_store.POS_CODEC.join(codes) for codes in pos_codes],
+            'syntactic dependencies': [parse_store.DEP_CODEC.join(codes) for codes in dep_codes],
+        })
+        write_chunk(parsing_df, os.path.join(dir_out, 'parsing_results.csv'), first)
+
+def write_results(results, infiles, dir_out, lang, visualization_mode='separate', run_metrics=metrics.DISABLED, parsing_results_csv=True, groups=None, group_by='group', outputs=None, function_words=None, stored_run=None):
+
+    """
+    Aggregates the per-document results, writes all output files and creates the visualizations.
+    Arguments:
+        results: list of analyze_text outputs, aligned with infiles
+        infiles: document identifiers
+        dir_out: output directory (must contain a 'visualizations' folder)
+        lang: language of the corpus
+        visualization_mode: see visualizations.generate_bar_chart
+        run_metrics: metrics.RunMetrics that records the time spent per stage
+        parsing_results_csv: also write parsing_results.csv (parsing_results.bin is always written)
+        groups: group of every document (aligned with infiles), to also write the mean and std per group
+            to <output>_by_group.csv and to show the groups as series in the charts
+        group_by: name of the grouping column (used in the chart legends)
+        outputs: names of the outputs in the results (None: all, see features.resolve_outputs)
+        function_words: function words kept in the function_word_distribution (None: all, see restrict_distribution)
+        stored_run: store.RunWriter to which the statistics and distributions are added (their csv files are then
+            written from the store), or None
+    Returns:
+        {output name: pd.DataFrame (incl. mean and std rows)}, {distribution name: plotly Figure}
+    """
+
+    outputs = features.resolve_outputs(outputs)
+    dfs = {}
+
+    for k in [k for k in STATISTICS if k in outputs]:
+        print(f"    ...{k.replace('_', ' ')}")
+        with run_metrics.stage('aggregation'):
+            df = concat_statistics([r[k] for r in results], infiles)
+            if groups is not None:
+                group_summary(df, groups).round(3).to_csv(os.path.join(dir_out, f'{k}_by_group.csv'), index=False)
+            df = add_summary_rows(df).round(3)
+        write_output(k, df, dir_out, None, stored_run, run_metrics)
+        dfs[k] = df
+
+    # parsing results
+    with run_metrics.stage('write_parsing_results'):
+        write_parsing_results(
+            infiles,
+            [r['pos_tags'] for r in results],
+            [r['dependencies'] for r in results],
+            dir_out,
+            csv=parsing_results_csv,
+            )
+
+    # distributions
+    print('    ...distributions')
+    similarity_dfs = []
+    index_dfs = {}
+    figures = {}
+    for k in [k for k in DISTRIBUTIONS if k in outputs]:
+        with run_metrics.stage('aggregation'):
+            df = restrict_distribution(k, concat_distribution([r[k] for r in results], infiles), function_words)
+            index_dfs[k] = df
+            if groups is not None:
+                group_df = group_summary(df, groups)
+                group_df.round(3).to_csv(os.path.join(dir_out, f'{k}_by_group.csv'), index=False)
+            df = add_summary_rows(df)
+        if k in similarity.REFERENCE_TASKS: # score documents and corpus mean against the reference corpora
+            with run_metrics.stage('reference_similarity'):
+                similarity_dfs.append(similarity.score_against_reference(df, k, lang))
+        df = df.round(3)
+        write_output(k, df, dir_out, 0, stored_run, run_metrics)
+        dfs[k] = df
+        # visualizations
+        if k in CHARTED_DISTRIBUTIONS:
+            with run_metrics.stage('visualizations'):
+                df = df.copy()
+                df.insert(0, 'source', ['input corpus']*len(df))
+                visible = ['input corpus']
+                if groups is not None: # groups are shown as series next to the input corpus
+                    group_df = group_df.round(3).rename(columns={'group': 'source'})
+                    group_df['source'] = [f'{group_by}={g}' for g in group_df['source']]
+                    df = pd.concat([df, group_df])
+                    visible += list(dict.fromkeys(group_df['source']))
+                mean_df, std_df = visualizations.prepare_df(df, k, lang)
+                figures[k] = visualizations.generate_bar_chart(mean_df, std_df, k, dir_out, visualization_mode, visible)
+
+    if visualization_mode == 'dashboard':
+        with run_metrics.stage('visualizations'):
+            visualizations.generate_dashboard(figures, dir_out)
+
+    # reference similarity
+    if similarity_dfs:
+        print('    ...reference similarity')
+        with run_metrics.stage('write_csv'):
+            similarity_df = pd.concat(similarity_dfs, axis=0).round(3)
+            similarity_df.to_csv(os.path.join(dir_out, 'reference_similarity.csv'), index=False)
+
+    # stylometric index for nearest-neighbour queries between documents
+    if any(k in index_dfs for k in similarity.INDEX_TASKS):
+        print('    ...stylometric index')
+        with run_metrics.stage('style_index'):
+            style_index = similarity.build_index(index_dfs)
+            similarity.save_index(style_index, os.path.join(dir_out, 'style_index.npz'))
+
+    return dfs, figures
+
+def write_skipped_documents(skipped, dir_out):
+    """
+    Writes the documents that exceeded a per-document limit and could not be analyzed to skipped_documents.csv
+    (doc, n_characters, the limit that was exceeded and the reason why the document was skipped).
+    """
+    df = pd.DataFrame(skipped, columns=['doc', 'n_characters', 'limit', 'reason'])
+    df.to_csv(os.path.join(dir_out, 'skipped_documents.csv'), index=False)
+
+#VOCABULARY____________________________________________________________________________________
+def add_document_values(doc, values, vocabulary=None, growth=None, trajectory_writer=None, run_metrics=metrics.DISABLED):
+    """
+    Adds the values of one document that are not kept in the results to the corpus vocabulary sketch, the vocabulary
+    growth curves and the trajectories.
+    Arguments:
+        doc: document identifier
+        values: the 'vocabulary_counts', 'tokens' and 'trajectory' of the document (see analyze_text, missing for
+            empty and skipped texts)
+        vocabulary: sketch.VocabularySketch or None
+        growth: sketch.VocabularyGrowth or None
+        trajectory_writer: trajectories.TrajectoryWriter or None
+        run_metrics: metrics.RunMetrics that records the time spent per stage
+    """
+    if vocabulary is not None:
+        with run_metrics.stage('vocabulary_sketch'):
+            vocabulary.update(*values.get('vocabulary_counts', ({}, {})))
+    if growth is not None:
+        with run_metrics.stage('vocabulary_growth'):
+            growth.update(values.get('tokens', []))
+    if trajectory_writer is not None and 'trajectory' in values:
+        with run_metrics.stage('trajectories'):
+            trajectory_writer.add(doc, values['trajectory'])
+
+def write_vocabulary_growth(growth, dir_out, visualization_mode='separate'):
+    """
+    Writes the vocabulary growth and rank-frequency curves and the power laws fitted to them (see sketch.VocabularyGrowth),
+    and charts them on log-log axes.
+    Returns:
+        {chart name: plotly Figure}
+    """
+    curve, ranks, laws = growth.write(dir_out)
+    laws = laws.set_index('law')
+    return {
+        name: visualizations.generate_power_law_chart(df, x, y, laws.at[law, 'coefficient'], laws.at[law, 'exponent'], name, dir_out, visualization_mode)
+        for name, law, df, x, y in [('vocabulary_growth', 'heaps', curve, 'n_tokens', 'n_types'), ('rank_frequency', 'zipf', ranks, 'rank', 'frequency')]
+    }
+
+#TRAJECTORIES__________________________________________________________________________________
+def write_trajectories(trajectory_writer, dir_out, visualization_mode='separate'):
+    """
+    Completes trajectories.csv and charts the trajectories of the first documents.
+    Returns:
+        {'trajectories': plotly Figure}
+    """
+    df = trajectory_writer.close()
+    return {'trajectories': visualizations.generate_trajectory_chart(df, 'trajectories', dir_out, visualization_mode)}
+
+#SAMPLING______________________________________________________________________________________
+# columns of the statistics that are ratios in [0, 1], whose sampling tolerance is absolute (like the distributions)
+BOUNDED_RATIOS = {'length_statistics': ['ratio_long_words', 'ratio_content_words', 'ratio_passive_sentences']}
+
+def sample_intervals(n_docs, tolerance, confidence=0.95):
+    """
+    Confidence intervals of the corpus means of all outputs; the tolerance is absolute for the distributions
+    (relative frequencies) and the BOUNDED_RATIOS, and relative for the other statistics (see sampling.ConfidenceIntervals).
+    """
+    return sampling.ConfidenceIntervals(n_docs, tolerance, confidence, relative=STATISTICS, absolute=BOUNDED_RATIOS)
+
+def update_intervals(intervals, results, infiles, outputs=None):
+    """
+    Adds a batch of per-document results (of the given outputs, None: all) to the confidence intervals.
+    """
+    outputs = features.resolve_outputs(outputs)
+    for k in [k for k in STATISTICS if k in outputs]:
+        intervals.update(k, concat_statistics([r[k] for r in results], infiles))
+    for k in [k for k in DISTRIBUTIONS if k in outputs]:
+        intervals.update(k, concat_distribution([r[k] for r in results], infiles), fill_value=0)
+
+#PARTIAL RESULTS_______________________________________________________________________________
+def running_statistics():
+    """
+    Running mean and std of the statistics and charted distributions, for showing partial results while
+    a corpus is analyzed (see update_running_statistics and partial_results).
+    """
+    statistics = {k: spill.SummaryStatistics() for k in STATISTICS}
+    statistics.update({k: spill.SummaryStatistics(fill_value=0) for k in CHARTED_DISTRIBUTIONS})
+    return statistics
+
+def update_running_statistics(statistics, results, infiles):
+    """
+    Adds a batch of per-document results to the running statistics.
+    """
+    for k, running in statistics.items():
+        concat = concat_statistics if k in STATISTICS else concat_distribution
+        running.update(concat([r[k] for r in results], infiles))
+
+def partial_results(statistics, lang):
+
+    """
+    The corpus mean and std of the documents analyzed so far, and bar charts of the distributions
+    (which are not saved).
+    Arguments:
+        statistics: see running_statistics
+        lang: language of the corpus
+    Returns:
+        {output name: pd.DataFrame with the mean and std rows}, {distribution name: plotly Figure}
+    """
+
+    summaries = {k: running.summary().round(3) for k, running in statistics.items()}
+    figures = {}
+    for k in CHARTED_DISTRIBUTIONS:
+        df = summaries[k].copy()
+        df.insert(0, 'source', ['input corpus']*len(df))
+        mean_df, std_df = visualizations.prepare_df(df, k, lang)
+        figures[k] = visualizations.generate_bar_chart(mean_df, std_df, k, None, mode=None)
+    return summaries, figures
+
+#RESULT STORE__________________________________________________________________________________
+@contextmanager
+def stored_run(path, run_id, parameters, dir_out):
+
+    """
+    Context manager that adds a run to the result store while its outputs are written (see store.RunWriter).
+    Arguments:
+        path: path of the SQLite database (created if it does not exist)
+        run_id: unique id of the run
+        parameters: {setting: value} of the run
+        dir_out: output directory of the run
+    Returns:
+        store.RunWriter to pass to write_results or write_spilled_results; the run is marked as finished at the end,
+        and removed from the store when an exception ends it
+    """
+
+    with store.ResultStore(path) as result_store, result_store.start_run(run_id, parameters, dir_out) as run_writer:
+        yield run_writer
+        run_writer.finish()
+
+def write_output(name, df, dir_out, fill_value, stored_run=None, run_metrics=metrics.DISABLED):
+
+    """
+    Writes a statistics or distribution output (the per-document rows followed by the mean and std rows) to
+    <name>.csv. With a result store, the output is added to the store and the csv file is written from it.
+    Arguments:
+        name: output name
+        df: pd.DataFrame with the 'doc' column
+        dir_out: output directory
+        fill_value: value that the store leaves out (None for statistics, 0 for distributions)
+        stored_run: store.RunWriter or None
+        run_metrics: metrics.RunMetrics that records the time spent per stage
+    """
+
+    path = os.path.join(dir_out, f'{name}.csv')
+    if stored_run is None:
+        with run_metrics.stage('write_csv'):
+            df.to_csv(path, index=False)
+        return
+    with run_metrics.stage('result_store'):
+        stored_run.add_documents(name, df.iloc[:-2], fill_value)
+        stored_run.add_summary(name, df.iloc[-2:], fill_value)
+    with run_metrics.stage('write_csv'):
+        stored_run.write_csv(name, path)
+
+#BOUNDED MEMORY________________________________________________________________________________
+def spill_results(max_memory, dir_out, outputs=None):
+
+    """
+    Creates a spiller that buffers per-document results (of the given outputs, None: all) up to max_memory MB
+    and spills them to a temporary folder in the output directory (removed by spiller.close()).
+    """
+
+    outputs = features.resolve_outputs(outputs)
+    concat = {k: (concat_statistics, np.nan) for k in STATISTICS if k in outputs}
+    concat.update({k: (concat_distribution, 0) for k in DISTRIBUTIONS if k in outputs})
+    return spill.ResultSpiller(concat, max_memory * 1024**2, spill_dir=dir_out)
+
+def write_chunk(df, path, first):
+    """
+    Writes the first chunk of a csv file (with header) or appends a later one.
+    """
+    df.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+
+def write_spilled_results(spiller, dir_out, lang, visualization_mode='separate', run_metrics=metrics.DISABLED, parsing_results_csv=True, function_words=None, stored_run=None):
+
+    """
+    Bounded-memory counterpart of write_results: writes the same output files from spilled chunks,
+    one chunk at a time, with the corpus mean and std computed from running statistics.
+    Arguments:
+        spiller: spill.ResultSpiller (see spill_results)
+        dir_out, lang, visualization_mode, run_metrics, parsing_results_csv, function_words, stored_run: see write_results
+    Returns:
+        {output name: pd.DataFrame with only the mean and std rows}, {distribution name: plotly Figure}
+    """
+
+    def conform(k, df):
+        return restrict_distribution(k, spiller.statistics[k].conform(df), function_words)
+
+    def write(k, df, first, fill_value):
+        # with a result store, the chunks are added to the store and the csv file is written from it at the end
+        if stored_run is not None:
+            with run_metrics.stage('result_store'):
+                stored_run.add_documents(k, df, fill_value)
+        else:
+            with run_metrics.stage('write_csv'):
+                write_chunk(df, os.path.join(dir_out, f'{k}.csv'), first)
+
+    def write_summary(k, summary, fill_value):
+        if stored_run is not None:
+            with run_metrics.stage('result_store'):
+                stored_run.add_summary(k, summary, fill_value)
+            with run_metrics.stage('write_csv'):
+                stored_run.write_csv(k, os.path.join(dir_out, f'{k}.csv'))
+        else:
+            with run_metrics.stage('write_csv'):
+                write_chunk(summary, os.path.join(dir_out, f'{k}.csv'), first=spiller.n_chunks == 0)
+
+    spiller.flush()
+    outputs = {}
+
+    for k in [k for k in STATISTICS if k in spiller.statistics]:
+        print(f"    ...{k.replace('_', ' ')}")
+        statistics = spiller.statistics[k]
+        for i, df in enumerate(spiller.chunks(k)):
+            write(k, statistics.conform(df).round(3), i == 0, None)
+        with run_metrics.stage('aggregation'):
+            summary = statistics.summary().round(3)
+        write_summary(k, summary, None)
+        outputs[k] = summary
+
+    # parsing results
+    with run_metrics.stage('write_parsing_results'):
+        writer = parse_store.ParsingResultsWriter(os.path.join(dir_out, 'parsing_results.bin'))
+        for i, df in enumerate(spiller.chunks('parsing_results')):
+            write_parsing_results(
+                df['document'].tolist(),
+                df['pos_tags'].tolist(),
+                df['dependencies'].tolist(),
+                dir_out,
+                first=i == 0,
+                writer=writer,
+                csv=parsing_results_csv,
+                )
+        writer.close()
+
+    # distributions
+    print('    ...distributions')
+    similarity_path = os.path.join(dir_out, 'reference_similarity.csv')
+    first_similarity = True
+    summaries = {}
+    figures = {}
+    for k in [k for k in DISTRIBUTIONS if k in spiller.statistics]:
+        statistics = spiller.statistics[k]
+        with run_metrics.stage('aggregation'):
+            summary = restrict_distribution(k, statistics.summary(), function_words)
+            summaries[k] = summary
+        for i, df in enumerate(spiller.chunks(k)):
+            df = conform(k, df)
+            if k in similarity.REFERENCE_TASKS: # score documents against the reference corpora
+                with run_metrics.stage('reference_similarity'):
+                    similarity_df = similarity.score_against_reference(df, k, lang).round(3)
+                with run_metrics.stage('write_csv'):
+                    write_chunk(similarity_df, similarity_path, first_similarity)
+                    first_similarity = False
+            write(k, df.round(3), i == 0, 0)
+        if k in similarity.REFERENCE_TASKS: # score the corpus mean
+            with run_metrics.stage('reference_similarity'):
+                similarity_df = similarity.score_against_reference(summary, k, lang).round(3)
+            with run_metrics.stage('write_csv'):
+                write_chunk(similarity_df, similarity_path, first_similarity)
+                first_similarity = False
+        summary = summary.round(3)
+        write_summary(k, summary, 0)
+        outputs[k] = summary
+        # visualizations
+        if k in CHARTED_DISTRIBUTIONS:
+            with run_metrics.stage('visualizations'):
+                df = summary.copy()
+                df.insert(0, 'source', ['input corpus']*len(df))
+                mean_df, std_df = visualizations.prepare_df(df, k, lang)
+                figures[k] = visualizations.generate_bar_chart(mean_df, std_df, k, dir_out, visualization_mode)
+
+    if visualization_mode == 'dashboard':
+        with run_metrics.stage('visualizations'):
+            visualizations.generate_dashboard(figures, dir_out)
+
+    # stylometric index for nearest-neighbour queries between documents
+    index_tasks = [k for k in similarity.INDEX_TASKS if k in summaries]
+    if index_tasks:
+        print('    ...stylometric index')
+        with run_metrics.stage('style_index'):
+            chunks = (
+                {k: conform(k, df) for k, df in zip(index_tasks, dfs)}
+                for dfs in zip(*[spiller.chunks(k) for k in index_tasks])
+            )
+            style_index = similarity.build_index_from_chunks(chunks, summaries, spiller.n_docs, spiller.dir)
+            similarity.save_index(style_index, os.path.join(dir_out, 'style_index.npz'))
+
+    return outputs, figures
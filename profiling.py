@@ -0,0 +1,125 @@
+import os, time, threading, tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+# tracemalloc is process-wide: it is started by the first active profiler and stopped by the last one
+TRACING_LOCK = threading.Lock()
+TRACING = {'profilers': 0, 'started': False}
+
+def start_tracing():
+    with TRACING_LOCK:
+        if not TRACING['profilers']:
+            TRACING['started'] = not tracemalloc.is_tracing()
+            if TRACING['started']:
+                tracemalloc.start()
+        TRACING['profilers'] += 1
+
+def stop_tracing():
+    with TRACING_LOCK:
+        TRACING['profilers'] -= 1
+        if not TRACING['profilers'] and TRACING['started']:
+            tracemalloc.stop()
+
+class FeatureProfiler:
+
+    """
+    Attributes wall time and memory allocations to the features of one run (see features.feature).
+    The profiler is passed to features.compute (e.g. through pipeline.analyze_text), which calls every feature
+    through call(); no module is patched, so runs that overlap (profiled or not) do not show up in each other's
+    times. Allocations are traced with tracemalloc, which is process-wide, so the allocations of overlapping
+    profiled runs (or of feature threads) are attributed to whichever feature is running at the time.
+    """
+
+    def __init__(self, root='analyze_text'):
+        self.root = root
+        self.stats = {}
+        self.stacks = {} # folded call stack -> own time in seconds
+        self.local = threading.local() # call stack of every thread
+        self.lock = threading.Lock()
+        self.elapsed = 0.0
+
+    def call(self, label, function, args):
+        """
+        Calls a feature function and records its time and allocations under label.
+        """
+        call_stack = self.local.__dict__.setdefault('call_stack', [])
+        frame = {'label': label, 'child_time': 0.0, 'peak': 0}
+        if call_stack: # keep the peak of the calling function before resetting it
+            call_stack[-1]['peak'] = max(call_stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        call_stack.append(frame)
+        mem_before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            call_stack.pop()
+            peak = max(peak, frame['peak'])
+            stack = ';'.join([self.root] + [f['label'] for f in call_stack] + [label])
+
+            with self.lock:
+                s = self.stats.setdefault(label, {'calls': 0, 'total_time': 0.0, 'own_time': 0.0, 'allocated_mb': 0.0, 'peak_mb': 0.0})
+                s['calls'] += 1
+                s['total_time'] += elapsed
+                s['own_time'] += elapsed - frame['child_time']
+                s['allocated_mb'] += max(peak - mem_before, 0) / 1024**2
+                s['peak_mb'] = max(s['peak_mb'], (peak - mem_before) / 1024**2)
+                self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed - frame['child_time']
+
+            if call_stack: # report the time and peak memory of this call to the calling feature function
+                call_stack[-1]['child_time'] += elapsed
+                call_stack[-1]['peak'] = max(call_stack[-1]['peak'], peak)
+                tracemalloc.reset_peak()
+
+    @contextmanager
+    def profile(self):
+        """
+        Context manager that traces allocations and measures the profiled time (the share of the features in the report).
+        """
+        start_tracing()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.elapsed += time.perf_counter() - start
+            stop_tracing()
+
+    def report(self):
+
+        """
+        Cost per feature function, sorted by total time.
+        Returns:
+            pd.DataFrame with columns function, calls, total_time, own_time (excluding profiled functions it calls),
+            time_per_call, share (of the profiled time), allocated_mb (sum of the peak allocations per call),
+            peak_mb (largest peak allocation of a single call)
+        """
+
+        rows = []
+        for label, s in self.stats.items():
+            rows.append({
+                'function': label,
+                'calls': s['calls'],
+                'total_time': s['total_time'],
+                'own_time': s['own_time'],
+                'time_per_call': s['total_time'] / s['calls'],
+                'share': s['total_time'] / self.elapsed if self.elapsed else None,
+                'allocated_mb': s['allocated_mb'],
+                'peak_mb': s['peak_mb'],
+            })
+        columns = ['function', 'calls', 'total_time', 'own_time', 'time_per_call', 'share', 'allocated_mb', 'peak_mb']
+        return pd.DataFrame(rows, columns=columns).sort_values('total_time', ascending=False)
+
+    def write(self, dir_out):
+
+        """
+        Writes profile_report.csv and profile.folded (collapsed stacks with own time in microseconds,
+        the input format of flamegraph.pl and speedscope) to the output directory.
+        """
+
+        self.report().round(6).to_csv(os.path.join(dir_out, 'profile_report.csv'), index=False)
+        with open(os.path.join(dir_out, 'profile.folded'), 'w') as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                f.write(f'{stack} {int(round(seconds * 1e6))}\n')
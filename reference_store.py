@@ -0,0 +1,143 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+REFERENCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference_corpora')
+STORE_NAME = 'reference_store.npz'
+LANGUAGE_CODES = {
+    'Dutch': 'nl',
+    'English': 'en',
+    'German': 'de',
+    'French': 'fr',
+}
+
+def compile_language(lang_dir):
+
+    """
+    Compiles the *_combined.csv files of one language into aligned arrays.
+    Arguments:
+        lang_dir: directory with the reference csv files of one language
+    Returns:
+        {array name: np.ndarray}, with per task '<task>__features', '<task>__sources', '<task>__mean' and '<task>__std'
+        (mean and std are (n_sources, n_features) matrices aligned with the feature and source index)
+    """
+
+    arrays = {}
+    for fn in sorted(os.listdir(lang_dir)):
+        if not fn.endswith('_combined.csv'):
+            continue
+        task_name = fn[:-len('_combined.csv')]
+        df = pd.read_csv(os.path.join(lang_dir, fn))
+
+        features = [col for col in df.columns if col not in {'source', 'doc'}]
+        if task_name == 'word_length_distribution': # store word lengths as sorted integers instead of unordered strings
+            features = sorted(features, key=int)
+            feature_index = np.array([int(f) for f in features], dtype=np.int64)
+        else:
+            feature_index = np.array(features, dtype=str)
+
+        sources = list(dict.fromkeys(df['source'])) # unique, in order of appearance
+        mean_df = df[df['doc'] == 'mean'].set_index('source').loc[sources, features]
+        std_df = df[df['doc'] == 'std'].set_index('source').loc[sources, features]
+
+        arrays[f'{task_name}__features'] = feature_index
+        arrays[f'{task_name}__sources'] = np.array(sources, dtype=str)
+        arrays[f'{task_name}__mean'] = mean_df.to_numpy(dtype=np.float64)
+        arrays[f'{task_name}__std'] = std_df.to_numpy(dtype=np.float64)
+
+    return arrays
+
+def build_store(reference_dir=REFERENCE_DIR):
+
+    """
+    (Re)generates the binary reference store (one .npz per language) from the reference csv files.
+    Arguments:
+        reference_dir: directory that contains one folder of reference csv files per language
+    Returns:
+        list of paths to the written stores
+    """
+
+    written = []
+    for code in sorted(os.listdir(reference_dir)):
+        lang_dir = os.path.join(reference_dir, code)
+        if not os.path.isdir(lang_dir):
+            continue
+        arrays = compile_language(lang_dir)
+        save_path = os.path.join(lang_dir, STORE_NAME)
+        np.savez_compressed(save_path, **arrays)
+        written.append(save_path)
+    load_store.cache_clear()
+    return written
+
+@lru_cache(maxsize=None)
+def load_store(lang):
+
+    """
+    Loads the reference store of a language once per process.
+    Falls back to compiling the csv files in memory if the store has not been built.
+    Arguments:
+        lang: 'Dutch', 'English', 'German' or 'French'
+    Returns:
+        {task_name: (features, sources, mean, std)}
+    """
+
+    if lang not in LANGUAGE_CODES:
+        raise ValueError('Language must be one of the following: "Dutch", "English", "German", "French".')
+
+    lang_dir = os.path.join(REFERENCE_DIR, LANGUAGE_CODES[lang])
+    store_path = os.path.join(lang_dir, STORE_NAME)
+    if os.path.exists(store_path):
+        with np.load(store_path, allow_pickle=False) as npz:
+            arrays = {k: npz[k] for k in npz.files}
+    else:
+        arrays = compile_language(lang_dir)
+
+    store = {}
+    for key in arrays:
+        if key.endswith('__features'):
+            task_name = key[:-len('__features')]
+            store[task_name] = tuple(arrays[f'{task_name}__{part}'] for part in ('features', 'sources', 'mean', 'std'))
+    return store
+
+def get_reference(lang, task_name):
+
+    """
+    Returns the reference statistics of one task.
+    Arguments:
+        lang: 'Dutch', 'English', 'German' or 'French'
+        task_name: e.g. 'pos_profile'
+    Returns:
+        features: np.ndarray (n_features,),
+        sources: np.ndarray (n_sources,),
+        mean: np.ndarray (n_sources, n_features),
+        std: np.ndarray (n_sources, n_features)
+    """
+
+    store = load_store(lang)
+    if task_name not in store:
+        raise ValueError(f'No reference statistics available for "{task_name}" in {lang}.')
+    return store[task_name]
+
+def reference_frame(lang, task_name):
+
+    """
+    Returns the reference statistics of one task in the layout of the *_combined.csv files
+    (columns 'source', 'doc' and one column per feature; one 'mean' and one 'std' row per source).
+    """
+
+    features, sources, mean, std = get_reference(lang, task_name)
+    n_sources = len(sources)
+    values = np.empty((2*n_sources, len(features)), dtype=np.float64)
+    values[0::2] = mean
+    values[1::2] = std
+
+    df = pd.DataFrame(values, columns=features.tolist())
+    df.insert(0, 'doc', ['mean', 'std']*n_sources)
+    df.insert(0, 'source', np.repeat(sources, 2).tolist())
+    return df
+
+if __name__ == "__main__":
+    for path in build_store():
+        print(f'Wrote {path}')
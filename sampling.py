@@ -0,0 +1,144 @@
+import os
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from spill import SummaryStatistics
+
+# the intervals are only trusted (and the sampling only stopped) from this many documents on
+MIN_SAMPLE_SIZE = 30
+
+def sample_order(n, strata=None, seed=0):
+
+    """
+    Random order in which the documents are sampled. With strata, the order is proportionally stratified:
+    every prefix contains each stratum in proportion to its size (up to one document), so the sample
+    can be stopped after any batch.
+    Arguments:
+        n: number of documents
+        strata: stratum of every document (list of length n) or None
+        seed: random seed
+    Returns:
+        np.ndarray of document positions
+    """
+
+    rng = np.random.default_rng(seed)
+    if strata is None:
+        return rng.permutation(n)
+
+    # the j-th document of a stratum of size n_s gets the key (j + offset) / n_s, i.e. the strata are interleaved evenly
+    codes = pd.factorize(pd.Series(strata, dtype=object).fillna(''))[0]
+    keys = np.empty(n)
+    for code in range(codes.max()+1):
+        members = rng.permutation(np.flatnonzero(codes == code))
+        keys[members] = (np.arange(len(members)) + rng.random()) / len(members)
+    return np.lexsort((rng.random(n), keys))
+
+def iter_sample(order, ids, load, batch_size=100):
+
+    """
+    Yields the documents in sample order. Their texts are loaded in blocks that start at batch_size documents and
+    double in size, so that the texts of at most twice the final sample are loaded, in few passes over the input.
+    Arguments:
+        order: see sample_order
+        ids: doc indices of all documents (see util.document_ids)
+        load: function that returns the texts of a list of doc indices (e.g. a partial of util.load_documents)
+        batch_size: size of the first block
+    Yields:
+        (text, doc index)
+    """
+
+    start, size = 0, batch_size
+    while start < len(order):
+        block = [ids[j] for j in order[start:start+size]]
+        yield from zip(load(block), block)
+        start, size = start + size, 2 * size
+
+class ConfidenceIntervals:
+
+    """
+    Running confidence intervals of the corpus means of every feature, updated batch by batch.
+    Standard errors are those of a simple random sample (conservative for a stratified sample) with
+    the finite population correction, so the intervals shrink to zero once the whole corpus is sampled.
+    """
+
+    def __init__(self, population_size, tolerance, confidence=0.95, relative=(), absolute=None):
+        """
+        Arguments:
+            population_size: number of documents in the corpus
+            tolerance: maximum half-width of the intervals
+            confidence: confidence level
+            relative: names of the outputs whose tolerance is relative (e.g. statistics on different scales), the
+                tolerance of the other outputs (relative frequencies) is absolute. A relative tolerance is relative
+                to the larger of the absolute mean and the standard deviation, so that it does not shrink to 0 for
+                features with a mean close to 0 (e.g. a Flesch score around 0).
+            absolute: {output: [feature]} of features of relative outputs that are bounded ratios in [0, 1]
+                (e.g. the ratio of passive sentences), whose tolerance is absolute
+        """
+        self.population_size = population_size
+        self.tolerance = tolerance
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.relative = set(relative)
+        self.absolute = {name: set(cols) for name, cols in (absolute or {}).items()}
+        self.statistics = {}
+
+    def update(self, name, df, fill_value=np.nan):
+        """
+        Adds the per-document rows of one output (the 'doc' column is ignored).
+        """
+        if name not in self.statistics:
+            self.statistics[name] = SummaryStatistics(fill_value)
+        self.statistics[name].update(df)
+
+    def intervals(self):
+
+        """
+        Returns:
+            pd.DataFrame with one row per output and numeric feature: output, feature, n, mean, std,
+            lower, upper, half_width, tolerance (absolute value), tolerance_type ('relative' or 'absolute') and converged
+        """
+
+        rows = []
+        for name, statistics in self.statistics.items():
+            summary = statistics.summary().set_index('doc')
+            for col in statistics.columns:
+                n = statistics.count[col]
+                if not statistics.numeric[col] or not n:
+                    continue
+                mean, std = summary.at['mean', col], summary.at['std', col]
+                fpc = np.sqrt((self.population_size - n) / (self.population_size - 1)) if self.population_size > 1 else 0.0
+                half_width = self.z * std / np.sqrt(n) * fpc if n > 1 else np.inf
+                relative = name in self.relative and col not in self.absolute.get(name, ())
+                tolerance = self.tolerance * max(abs(mean), std if n > 1 else 0) if relative else self.tolerance
+                rows.append({
+                    'output': name,
+                    'feature': col,
+                    'n': n,
+                    'mean': mean,
+                    'std': std,
+                    'lower': mean - half_width,
+                    'upper': mean + half_width,
+                    'half_width': half_width,
+                    'tolerance': tolerance,
+                    'tolerance_type': 'relative' if relative else 'absolute',
+                    'converged': bool(half_width <= tolerance),
+                })
+        columns = ['output', 'feature', 'n', 'mean', 'std', 'lower', 'upper', 'half_width', 'tolerance', 'tolerance_type', 'converged']
+        return pd.DataFrame(rows, columns=columns)
+
+    def converged(self, n_sampled):
+        """
+        True if at least MIN_SAMPLE_SIZE documents were sampled and every interval is within tolerance.
+        """
+        if n_sampled < min(MIN_SAMPLE_SIZE, self.population_size):
+            return False
+        return bool(self.intervals()['converged'].all())
+
+    def write(self, dir_out, n_sampled):
+        """
+        Writes sample_intervals.csv (the intervals, with the sample size and the corpus size) to the output directory.
+        """
+        df = self.intervals()
+        df.insert(0, 'sample_size', n_sampled)
+        df.insert(1, 'corpus_size', self.population_size)
+        df.round(6).to_csv(os.path.join(dir_out, 'sample_intervals.csv'), index=False)
@@ -0,0 +1,381 @@
+import os
+import numpy as np
+import pandas as pd
+import reference_store
+
+REFERENCE_TASKS = ['pos_profile', 'dependency_profile', 'punctuation_distribution', 'word_length_distribution']
+
+def align_features(df, features):
+
+    """
+    Aligns the feature columns of a distribution dataframe with a feature index.
+    Features that do not occur in the dataframe get a relative frequency of 0.
+    Arguments:
+        df: pd.DataFrame (rows are documents, columns are features)
+        features: list or np.ndarray of feature names
+    Returns:
+        np.ndarray (n_documents, n_features)
+    """
+
+    return df.reindex(columns=list(features), fill_value=0).fillna(0).to_numpy(dtype=np.float64)
+
+def burrows_delta(X, mean, std, chunk_size=4096):
+
+    """
+    Computes Burrows' Delta (mean absolute z-score) of every document against every reference source,
+    using the mean and standard deviation stored for that source. Features with a missing or zero
+    standard deviation are left out of the average.
+    Arguments:
+        X: np.ndarray (n_documents, n_features)
+        mean: np.ndarray (n_sources, n_features)
+        std: np.ndarray (n_sources, n_features)
+        chunk_size: number of documents scored per batch
+    Returns:
+        np.ndarray (n_documents, n_sources)
+    """
+
+    mean = np.nan_to_num(mean)
+    valid = np.nan_to_num(std) > 0
+    inv_std = np.divide(1.0, std, out=np.zeros_like(mean), where=valid)
+    n_valid = valid.sum(axis=1)
+
+    out = np.empty((X.shape[0], mean.shape[0]), dtype=np.float64)
+    for start in range(0, X.shape[0], chunk_size):
+        chunk = X[start:start+chunk_size]
+        z = np.abs(chunk[:, None, :] - mean[None, :, :]) * inv_std[None, :, :]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[start:start+chunk_size] = z.sum(axis=2) / n_valid
+    return out
+
+def cosine_similarity(X, M):
+
+    """
+    Computes the cosine similarity of every row in X with every row in M.
+    Arguments:
+        X: np.ndarray (n_documents, n_features)
+        M: np.ndarray (n_sources, n_features)
+    Returns:
+        np.ndarray (n_documents, n_sources)
+    """
+
+    M = np.nan_to_num(M)
+    X_norm = np.linalg.norm(X, axis=1, keepdims=True)
+    M_norm = np.linalg.norm(M, axis=1, keepdims=True)
+    X_unit = np.divide(X, X_norm, out=np.zeros_like(X), where=X_norm > 0)
+    M_unit = np.divide(M, M_norm, out=np.zeros_like(M), where=M_norm > 0)
+    return X_unit @ M_unit.T
+
+def normalize_rows(X):
+    """
+    Rescales every row to sum to 1 (rows that sum to 0 are left as is).
+    """
+    totals = X.sum(axis=1, keepdims=True)
+    return np.divide(X, totals, out=np.zeros_like(X), where=totals > 0)
+
+def jensen_shannon(X, M, chunk_size=4096):
+
+    """
+    Computes the Jensen-Shannon divergence (base 2, between 0 and 1) between every row in X and every row in M.
+    Rows are renormalized to probability distributions first.
+    Arguments:
+        X: np.ndarray (n_documents, n_features)
+        M: np.ndarray (n_sources, n_features)
+        chunk_size: number of documents scored per batch
+    Returns:
+        np.ndarray (n_documents, n_sources)
+    """
+
+    P_all = normalize_rows(np.clip(X, 0, None))
+    Q = normalize_rows(np.clip(np.nan_to_num(M), 0, None))[None, :, :]
+
+    out = np.empty((X.shape[0], Q.shape[1]), dtype=np.float64)
+    for start in range(0, X.shape[0], chunk_size):
+        P = P_all[start:start+chunk_size][:, None, :]
+        avg = (P + Q) / 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            kl_p = np.where(P > 0, P * np.log2(P / avg), 0).sum(axis=2)
+            kl_q = np.where(Q > 0, Q * np.log2(Q / avg), 0).sum(axis=2)
+        out[start:start+chunk_size] = (kl_p + kl_q) / 2
+    return out
+
+def score_against_reference(df, task_name, lang, chunk_size=4096):
+
+    """
+    Scores every document (and the corpus mean) against every reference source of a language.
+    Arguments:
+        df: distribution dataframe with a 'doc' column (rows 'std' are ignored)
+        task_name: one of REFERENCE_TASKS
+        lang: 'Dutch', 'English', 'German' or 'French'
+        chunk_size: number of documents scored per batch
+    Returns:
+        pd.DataFrame with columns doc, feature_set, source, delta, cosine, jensen_shannon
+    """
+
+    features, sources, mean, std = reference_store.get_reference(lang, task_name)
+
+    df = df[df['doc'].astype(str) != 'std']
+    docs = df['doc'].to_numpy()
+    X = align_features(df.drop(columns=['doc']), features)
+
+    delta = burrows_delta(X, mean, std, chunk_size)
+    cosine = cosine_similarity(X, mean)
+    js = jensen_shannon(X, mean, chunk_size)
+
+    n_docs, n_sources = delta.shape
+    return pd.DataFrame(data={
+        'doc': np.repeat(docs, n_sources),
+        'feature_set': task_name,
+        'source': np.tile(sources, n_docs),
+        'delta': delta.ravel(),
+        'cosine': cosine.ravel(),
+        'jensen_shannon': js.ravel(),
+    })
+
+#DOCUMENT INDEX_______________________________________________________________________
+INDEX_TASKS = ['function_word_distribution', 'pos_profile', 'punctuation_distribution', 'word_length_distribution']
+
+def build_index(distribution_dfs, n_function_words=150, n_bits=128, seed=0):
+
+    """
+    Builds a stylometric index from the per-document distributions.
+    Features are z-standardized with the corpus mean and std (as in Burrows' Delta); only the
+    n_function_words most frequent function words are kept.
+    Arguments:
+        distribution_dfs: {task_name: pd.DataFrame} with a 'doc' column and one row per document (no mean/std rows)
+        n_function_words: number of most frequent function words used as features
+        n_bits: length of the random-projection signatures used for approximate queries
+        seed: random seed for the projection
+    Returns:
+        index: {name: np.ndarray} with document ids ('docs'), feature names ('features'), corpus 'mean' and 'std',
+               standardized 'vectors' (n_documents, n_features), the random 'projection' and packed 'signatures'
+    """
+
+    docs = None
+    blocks, features = [], []
+    for task_name in INDEX_TASKS:
+        if task_name not in distribution_dfs:
+            continue
+        df = distribution_dfs[task_name]
+        docs = np.array(df['doc'].astype(str).tolist(), dtype=str) if docs is None else docs
+        df = df.drop(columns=['doc']).fillna(0)
+        if task_name == 'function_word_distribution':
+            df = df[df.mean().sort_values(ascending=False).index[:n_function_words]]
+        blocks.append(df.to_numpy(dtype=np.float64))
+        features += [f'{task_name}:{col}' for col in df.columns]
+
+    X = np.hstack(blocks)
+    mean = X.mean(axis=0)
+    std = X.std(axis=0, ddof=1) if len(X) > 1 else np.zeros(X.shape[1])
+    keep = std > 0 # constant features carry no stylistic information
+    Z = ((X[:, keep] - mean[keep]) / std[keep]).astype(np.float32)
+
+    rng = np.random.default_rng(seed)
+    projection = rng.standard_normal((Z.shape[1], n_bits)).astype(np.float32)
+
+    return {
+        'docs': docs,
+        'features': np.array(features, dtype=str)[keep],
+        'mean': mean[keep],
+        'std': std[keep],
+        'vectors': Z,
+        'projection': projection,
+        'signatures': np.packbits(Z @ projection > 0, axis=1),
+    }
+
+def build_index_from_chunks(chunks, summaries, n_docs, vectors_dir, n_function_words=150, n_bits=128, seed=0):
+
+    """
+    Builds the same index as build_index from distributions that are processed in chunks (bounded memory).
+    The standardized vectors and signatures are written to memory-mapped files in vectors_dir.
+    Arguments:
+        chunks: iterable of {task_name: pd.DataFrame} with a 'doc' column and all columns of the corpus (see spill.SummaryStatistics.conform)
+        summaries: {task_name: pd.DataFrame} with the corpus 'mean' and 'std' rows of every task
+        n_docs: total number of documents
+        vectors_dir: directory for the memory-mapped arrays
+        n_function_words, n_bits, seed: see build_index
+    Returns:
+        index: see build_index ('vectors' and 'signatures' are np.memmap arrays)
+    """
+
+    selected, means, stds = {}, [], []
+    for task_name in INDEX_TASKS:
+        if task_name not in summaries:
+            continue
+        summary = summaries[task_name].set_index('doc')
+        mean = summary.loc['mean'].astype(np.float64)
+        if task_name == 'function_word_distribution':
+            mean = mean.sort_values(ascending=False)[:n_function_words]
+        selected[task_name] = list(mean.index)
+        means.append(mean.to_numpy())
+        stds.append(summary.loc['std', mean.index].astype(np.float64).to_numpy())
+
+    features = np.array([f'{task_name}:{col}' for task_name, cols in selected.items() for col in cols], dtype=str)
+    mean, std = np.hstack(means), np.nan_to_num(np.hstack(stds)) # std is undefined for a single document
+    keep = std > 0
+
+    rng = np.random.default_rng(seed)
+    projection = rng.standard_normal((keep.sum(), n_bits)).astype(np.float32)
+
+    vectors = np.lib.format.open_memmap(os.path.join(vectors_dir, 'vectors.npy'), mode='w+', dtype=np.float32, shape=(n_docs, keep.sum()))
+    signatures = np.lib.format.open_memmap(os.path.join(vectors_dir, 'signatures.npy'), mode='w+', dtype=np.uint8, shape=(n_docs, (n_bits+7)//8))
+    docs = []
+    start = 0
+    for chunk in chunks:
+        X = np.hstack([chunk[task_name][cols].fillna(0).to_numpy(dtype=np.float64) for task_name, cols in selected.items()])
+        Z = ((X[:, keep] - mean[keep]) / std[keep]).astype(np.float32)
+        vectors[start:start+len(Z)] = Z
+        signatures[start:start+len(Z)] = np.packbits(Z @ projection > 0, axis=1)
+        docs += chunk[next(iter(selected))]['doc'].astype(str).tolist()
+        start += len(Z)
+
+    return {
+        'docs': np.array(docs, dtype=str),
+        'features': features[keep],
+        'mean': mean[keep],
+        'std': std[keep],
+        'vectors': vectors,
+        'projection': projection,
+        'signatures': signatures,
+    }
+
+def save_index(index, path):
+    """
+    Saves the index as a single .npz file.
+    """
+    np.savez(path, **index)
+
+def load_index(path):
+    """
+    Loads an index saved with save_index.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        return {k: npz[k] for k in npz.files}
+
+def standardize(index, X, features):
+
+    """
+    Projects raw feature vectors into the standardized space of the index.
+    Arguments:
+        index: see build_index
+        X: np.ndarray (n_queries, n_features) of relative frequencies
+        features: feature names of X ('<task_name>:<feature>')
+    Returns:
+        np.ndarray (n_queries, n_index_features)
+    """
+
+    X = pd.DataFrame(X, columns=list(features)).reindex(columns=index['features'].tolist(), fill_value=0)
+    return ((X.to_numpy(dtype=np.float64) - index['mean']) / index['std']).astype(np.float32)
+
+def _scores(Q, block, metric):
+    """
+    Distances between queries and a block of index vectors (lower is closer).
+    """
+    if metric == 'delta':
+        return np.abs(Q[:, None, :] - block[None, :, :]).mean(axis=2)
+    elif metric == 'cosine':
+        Q_norm = np.linalg.norm(Q, axis=1, keepdims=True)
+        B_norm = np.linalg.norm(block, axis=1, keepdims=True)
+        sims = (Q @ block.T) / np.maximum(Q_norm * B_norm.T, 1e-12)
+        return 1 - sims
+    else:
+        raise ValueError('Metric must be one of the following: "delta", "cosine".')
+
+def _merge_top_k(best_idx, best_dist, idx, dist, k):
+    """
+    Merges the running top-k with the candidates of a new block.
+    """
+    all_idx = np.hstack([best_idx, idx])
+    all_dist = np.hstack([best_dist, dist])
+    if all_dist.shape[1] > k:
+        part = np.argpartition(all_dist, k-1, axis=1)[:, :k]
+        all_idx = np.take_along_axis(all_idx, part, axis=1)
+        all_dist = np.take_along_axis(all_dist, part, axis=1)
+    order = np.argsort(all_dist, axis=1)
+    return np.take_along_axis(all_idx, order, axis=1), np.take_along_axis(all_dist, order, axis=1)
+
+def query_index(index, Q, k=10, metric='delta', approximate=False, n_candidates=None, block_size=2048):
+
+    """
+    Finds the k nearest documents for each query vector.
+    Exact queries scan the index in blocks (cosine as one matrix multiplication per block). Approximate
+    queries first select candidates by Hamming distance between random-projection signatures and
+    then rank only those candidates exactly.
+    Arguments:
+        index: see build_index
+        Q: np.ndarray (n_queries, n_index_features), standardized (see standardize)
+        k: number of neighbours
+        metric: 'delta' (Burrows' Delta, mean absolute z-score difference) or 'cosine' (Cosine Delta)
+        approximate: use random-projection candidate selection
+        n_candidates: number of candidates per query in approximate mode (default 20*k)
+        block_size: number of index vectors compared per block
+    Returns:
+        indices: np.ndarray (n_queries, k) of row indices into index['docs'],
+        distances: np.ndarray (n_queries, k)
+    """
+
+    Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+    Z = index['vectors']
+    k = min(k, len(Z))
+
+    if approximate:
+        n_candidates = min(n_candidates or 20*k, len(Z))
+        q_sig = np.packbits(Q @ index['projection'] > 0, axis=1)
+        indices, distances = [], []
+        for q, sig in zip(Q, q_sig):
+            hamming = np.unpackbits(np.bitwise_xor(index['signatures'], sig), axis=1).sum(axis=1)
+            candidates = np.argpartition(hamming, n_candidates-1)[:n_candidates]
+            dist = _scores(q[None, :], Z[candidates], metric)[0]
+            order = np.argsort(dist)[:k]
+            indices.append(candidates[order])
+            distances.append(dist[order])
+        return np.array(indices), np.array(distances)
+
+    best_idx = np.empty((len(Q), 0), dtype=np.int64)
+    best_dist = np.empty((len(Q), 0), dtype=np.float64)
+    for start in range(0, len(Z), block_size):
+        block = Z[start:start+block_size]
+        dist = _scores(Q, block, metric)
+        idx = np.broadcast_to(np.arange(start, start+len(block)), dist.shape)
+        best_idx, best_dist = _merge_top_k(best_idx, best_dist, idx, dist, k)
+    return best_idx, best_dist
+
+def nearest_documents(index, doc, k=10, metric='delta', approximate=False):
+
+    """
+    Finds the documents in the index that are stylistically closest to one of its documents.
+    Arguments:
+        index: see build_index
+        doc: document identifier (as in the 'doc' column of the output)
+        k: number of neighbours
+        metric: 'delta' or 'cosine'
+        approximate: use random-projection candidate selection
+    Returns:
+        pd.DataFrame with columns rank, doc, distance
+    """
+
+    matches = np.flatnonzero(index['docs'] == str(doc))
+    if not len(matches):
+        raise ValueError(f'Document "{doc}" is not in the index.')
+    row = matches[0]
+
+    indices, distances = query_index(index, index['vectors'][row], k+1, metric, approximate)
+    keep = indices[0] != row
+    indices, distances = indices[0][keep][:k], distances[0][keep][:k]
+
+    return pd.DataFrame(data={
+        'rank': np.arange(1, len(indices)+1),
+        'doc': index['docs'][indices],
+        'distance': distances,
+    })
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Query a stylometric index (style_index.npz in the output directory).')
+    parser.add_argument('index', help='path to style_index.npz')
+    parser.add_argument('doc', help='document identifier')
+    parser.add_argument('--k', type=int, default=10, help='number of neighbours')
+    parser.add_argument('--metric', default='delta', choices=['delta', 'cosine'])
+    parser.add_argument('--approximate', action='store_true', help='use random-projection candidate selection')
+    args = parser.parse_args()
+
+    print(nearest_documents(load_index(args.index), args.doc, args.k, args.metric, args.approximate).to_string(index=False))
@@ -0,0 +1,520 @@
+import hashlib, heapq, math, os
+
+import numpy as np
+import pandas as pd
+
+def hash_words(words):
+    """
+    Stable 64-bit hashes of words (the same in every process, so that sketches of different runs can be merged).
+    Returns:
+        np.ndarray of uint64
+    """
+    digests = b''.join(hashlib.blake2b(w.encode('utf-8'), digest_size=8).digest() for w in words)
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+def _sigma(x):
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+def _tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+class HyperLogLog:
+
+    """
+    Estimates the number of distinct items in 2**precision one-byte registers.
+    The relative standard error is 1.04 / sqrt(2**precision), e.g. 0.81% for precision 14 (16 KB).
+    """
+
+    def __init__(self, precision=14):
+        if not 11 <= precision <= 18:
+            raise ValueError('The precision of a HyperLogLog sketch must be between 11 and 18.')
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes):
+        """
+        Adds items given as uint64 hashes (see hash_words).
+        """
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        # the rank is the position of the first 1-bit of the remaining 64 - p bits; frexp gives the bit length
+        # (exact, as the remaining bits fit into the mantissa of a float64)
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        np.maximum.at(self.registers, index, (64 - p - bit_length + 1).astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    @property
+    def standard_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def count(self):
+        """
+        Estimated number of distinct items, with the improved estimator of Ertl (2017), which unlike the original
+        estimator with linear counting for small cardinalities has no bias in the range between the two.
+        """
+        m = len(self.registers)
+        q = 64 - self.precision
+        histogram = np.bincount(self.registers, minlength=q+2).tolist()
+        if histogram[0] == m:
+            return 0.0
+        z = m * _tau(1 - histogram[q+1] / m)
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        z += m * _sigma(histogram[0] / m)
+        return m * m / (2 * math.log(2) * z)
+
+class CountMinSketch:
+
+    """
+    Estimates item counts in a depth x width table of counters. An estimate is never below the true count, and
+    exceeds it by at most e / width * total (the total count of all items) with probability 1 - exp(-depth),
+    e.g. by at most 0.0042% of the total with probability 99.3% for the defaults (2.5 MB).
+    """
+
+    def __init__(self, width=1 << 16, depth=5):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, hashes):
+        # double hashing: the i-th row uses h1 + i * h2
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        return [((h1 + np.uint64(i) * h2) % np.uint64(self.width)).astype(np.intp) for i in range(self.depth)]
+
+    def add(self, hashes, counts):
+        for row, columns in zip(self.table, self._columns(hashes)):
+            np.add.at(row, columns, counts)
+        self.total += int(np.sum(counts))
+
+    def estimate(self, hashes):
+        """
+        Returns:
+            np.ndarray of estimated counts
+        """
+        return np.min([row[columns] for row, columns in zip(self.table, self._columns(hashes))], axis=0)
+
+    def merge(self, other):
+        self.table += other.table
+        self.total += other.total
+
+    @property
+    def max_overestimate(self):
+        return math.e / self.width * self.total
+
+class HeavyHitters:
+
+    """
+    The k most frequent items: a count-min sketch of all items plus at most 2k candidate items (the items whose
+    estimated count was among the k largest when they were last seen), re-estimated from the sketch when they are reported.
+    """
+
+    def __init__(self, k=100, width=1 << 16, depth=5):
+        self.k = k
+        self.counts = CountMinSketch(width, depth)
+        self.candidates = {} # {item: estimated count when it was last seen}
+        self.threshold = 0
+
+    def add(self, items, hashes, counts):
+        self.counts.add(hashes, counts)
+        estimates = self.counts.estimate(hashes)
+        for i in np.flatnonzero(estimates >= self.threshold):
+            self.candidates[items[i]] = int(estimates[i])
+        if len(self.candidates) > 2 * self.k:
+            self._prune()
+
+    def _prune(self):
+        top = heapq.nsmallest(self.k, self.candidates.items(), key=lambda item: (-item[1], item[0]))
+        self.candidates = dict(top)
+        self.threshold = top[-1][1] if len(top) == self.k else 0
+
+    def merge(self, other):
+        self.counts.merge(other.counts)
+        items = list(dict.fromkeys(list(self.candidates) + list(other.candidates)))
+        estimates = self.counts.estimate(hash_words(items)) if items else []
+        self.candidates = dict(zip(items, map(int, estimates)))
+        self._prune()
+
+    def top(self):
+        """
+        Returns:
+            [(item, estimated count)] of the k most frequent items, most frequent (then alphabetically) first
+        """
+        items = list(self.candidates)
+        if not items:
+            return []
+        estimates = self.counts.estimate(hash_words(items))
+        return heapq.nsmallest(self.k, zip(items, map(int, estimates)), key=lambda item: (-item[1], item[0]))
+
+class TypeSample:
+
+    """
+    Bottom-k sample of the types: the size types with the smallest hashes, i.e. a uniform random sample of the
+    vocabulary, with their exact counts (a type that enters the sample stays in it from its first occurrence on, and
+    a type that left it never comes back). It estimates the share of hapax and dis legomena with a standard error
+    of at most 0.5 / sqrt(size), e.g. 0.39% for the default size, and is exact as long as it is not full.
+    """
+
+    def __init__(self, size=1 << 14):
+        self.size = size
+        self.counts = {} # {hash: count}
+        self.heap = [] # negated hashes, so that the largest hash in the sample is evicted first
+
+    @property
+    def full(self):
+        return len(self.counts) >= self.size
+
+    def add(self, hashes, counts):
+        if self.full:
+            mask = hashes < np.uint64(-self.heap[0])
+            hashes, counts = hashes[mask], counts[mask]
+        for h, c in zip(hashes.tolist(), counts.tolist()):
+            if h in self.counts:
+                self.counts[h] += c
+            else:
+                self.counts[h] = c
+                heapq.heappush(self.heap, -h)
+                if len(self.counts) > self.size:
+                    del self.counts[-heapq.heappop(self.heap)]
+
+    def merge(self, other):
+        counts = dict(self.counts)
+        for h, c in other.counts.items():
+            counts[h] = counts.get(h, 0) + c
+        self.counts = {h: counts[h] for h in heapq.nsmallest(self.size, counts)}
+        self.heap = [-h for h in self.counts]
+        heapq.heapify(self.heap)
+
+    def share(self, count):
+        """
+        Share of the types that occur exactly count times, and its standard error.
+        """
+        n = len(self.counts)
+        if not n:
+            return np.nan, np.nan
+        share = sum(1 for c in self.counts.values() if c == count) / n
+        return share, (math.sqrt(share * (1 - share) / n) if self.full else 0.0)
+
+class VocabularySketch:
+
+    """
+    Corpus vocabulary statistics in fixed memory (about 8 MB with the defaults), however large the corpus:
+    the number of distinct types, hapax and dis legomena, and the most frequent tokens and function words,
+    with their error bounds. Sketches of different workers, runs or shards of a corpus can be merged.
+    """
+
+    def __init__(self, top_k=100, precision=14, width=1 << 16, depth=5, sample_size=1 << 14):
+        """
+        Arguments:
+            top_k: number of most frequent tokens and function words that are reported
+            precision: HyperLogLog precision (see HyperLogLog)
+            width, depth: size of the count-min sketches (see CountMinSketch)
+            sample_size: size of the type sample (see TypeSample)
+        """
+        self.parameters = {'top_k': top_k, 'precision': precision, 'width': width, 'depth': depth, 'sample_size': sample_size}
+        self.n_documents = 0
+        self.types = HyperLogLog(precision)
+        self.tokens = HeavyHitters(top_k, width, depth)
+        self.sample = TypeSample(sample_size)
+        self.function_word_types = HyperLogLog(precision)
+        self.function_words = HeavyHitters(top_k, width, depth)
+
+    def update(self, token_counts, function_word_counts):
+        """
+        Adds one document.
+        Arguments:
+            token_counts: {lowercased token: count} (see features.vocabulary_counts)
+            function_word_counts: {function word: count}
+        """
+        self.n_documents += 1
+        for counts, types, frequent in [(token_counts, self.types, self.tokens), (function_word_counts, self.function_word_types, self.function_words)]:
+            if not counts:
+                continue
+            items = list(counts)
+            hashes = hash_words(items)
+            n = np.fromiter(counts.values(), dtype=np.int64, count=len(items))
+            types.add(hashes)
+            frequent.add(items, hashes, n)
+            if types is self.types:
+                self.sample.add(hashes, n)
+
+    def merge(self, other):
+        """
+        Adds the documents of another sketch (with the same parameters) to this one.
+        """
+        if other.parameters != self.parameters:
+            raise ValueError(f'Only sketches with the same parameters can be merged ({self.parameters} vs. {other.parameters}).')
+        self.n_documents += other.n_documents
+        self.types.merge(other.types)
+        self.tokens.merge(other.tokens)
+        self.sample.merge(other.sample)
+        self.function_word_types.merge(other.function_word_types)
+        self.function_words.merge(other.function_words)
+
+    def summary(self):
+
+        """
+        Returns:
+            pd.DataFrame with the columns statistic, value and standard_error (0: exact) of n_documents, n_tokens,
+            n_types, type_token_ratio, n_hapax_legomena, n_dis_legomena, hapax_ratio (share of the types that are
+            hapax legomena), n_function_words and n_function_word_types
+        """
+
+        n_tokens = self.tokens.counts.total
+        if self.sample.full:
+            n_types = self.types.count()
+            types_error = n_types * self.types.standard_error
+        else: # every type is in the sample
+            n_types, types_error = len(self.sample.counts), 0.0
+        hapax, hapax_error = self.sample.share(1)
+        dis, dis_error = self.sample.share(2)
+        n_function_word_types = self.function_word_types.count()
+        rows = [
+            ('n_documents', self.n_documents, 0.0),
+            ('n_tokens', n_tokens, 0.0),
+            ('n_types', n_types, types_error),
+            ('type_token_ratio', n_types / n_tokens if n_tokens else np.nan, types_error / n_tokens if n_tokens else np.nan),
+            # errors of products of estimates: first-order propagation of the relative errors
+            ('n_hapax_legomena', hapax * n_types, hapax * n_types * math.hypot(hapax_error / hapax if hapax else 0, types_error / n_types if n_types else 0)),
+            ('n_dis_legomena', dis * n_types, dis * n_types * math.hypot(dis_error / dis if dis else 0, types_error / n_types if n_types else 0)),
+            ('hapax_ratio', hapax, hapax_error),
+            ('n_function_words', self.function_words.counts.total, 0.0),
+            ('n_function_word_types', n_function_word_types, n_function_word_types * self.function_word_types.standard_error),
+        ]
+        return pd.DataFrame(rows, columns=['statistic', 'value', 'standard_error'])
+
+    def frequent_words(self):
+
+        """
+        Returns:
+            pd.DataFrame with the top_k most frequent tokens and function words: kind ('token' or 'function_word'),
+            rank, word, count (estimate, never below the true count), max_overestimate (the estimate exceeds the true
+            count by at most this much with probability 1 - exp(-depth)) and relative_frequency
+        """
+
+        rows = []
+        for kind, frequent in [('token', self.tokens), ('function_word', self.function_words)]:
+            for rank, (word, count) in enumerate(frequent.top(), start=1):
+                rows.append({
+                    'kind': kind,
+                    'rank': rank,
+                    'word': word,
+                    'count': count,
+                    'max_overestimate': frequent.counts.max_overestimate,
+                    'relative_frequency': count / frequent.counts.total,
+                })
+        return pd.DataFrame(rows, columns=['kind', 'rank', 'word', 'count', 'max_overestimate', 'relative_frequency'])
+
+    def top_function_words(self, n):
+        """
+        The n most frequent function words (n <= top_k), most frequent first.
+        """
+        return [word for word, _ in self.function_words.top()[:n]]
+
+    def save(self, path):
+        """
+        Saves the sketch to an npz file (see load), e.g. to merge it with the sketches of other shards later.
+        """
+        arrays = {f'parameter_{k}': v for k, v in self.parameters.items()}
+        arrays['n_documents'] = self.n_documents
+        arrays['types'] = self.types.registers
+        arrays['function_word_types'] = self.function_word_types.registers
+        for name, frequent in [('tokens', self.tokens), ('function_words', self.function_words)]:
+            arrays[f'{name}_table'] = frequent.counts.table
+            arrays[f'{name}_total'] = frequent.counts.total
+            arrays[f'{name}_candidates'] = np.array(list(frequent.candidates), dtype=str)
+            arrays[f'{name}_estimates'] = np.array(list(frequent.candidates.values()), dtype=np.int64)
+            arrays[f'{name}_threshold'] = frequent.threshold
+        arrays['sample_hashes'] = np.array(list(self.sample.counts), dtype=np.uint64)
+        arrays['sample_counts'] = np.array(list(self.sample.counts.values()), dtype=np.int64)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            sketch = cls(**{k: int(data[f'parameter_{k}']) for k in ['top_k', 'precision', 'width', 'depth', 'sample_size']})
+            sketch.n_documents = int(data['n_documents'])
+            sketch.types.registers = data['types']
+            sketch.function_word_types.registers = data['function_word_types']
+            for name, frequent in [('tokens', sketch.tokens), ('function_words', sketch.function_words)]:
+                frequent.counts.table = data[f'{name}_table']
+                frequent.counts.total = int(data[f'{name}_total'])
+                frequent.candidates = dict(zip(data[f'{name}_candidates'].tolist(), data[f'{name}_estimates'].tolist()))
+                frequent.threshold = int(data[f'{name}_threshold'])
+            sketch.sample.counts = dict(zip(data['sample_hashes'].tolist(), data['sample_counts'].tolist()))
+            sketch.sample.heap = [-h for h in sketch.sample.counts]
+            heapq.heapify(sketch.sample.heap)
+        return sketch
+
+    def write(self, dir_out):
+        """
+        Writes vocabulary.csv (see summary), frequent_words.csv (see frequent_words) and the sketch itself
+        (vocabulary_sketch.npz) to the output directory.
+        """
+        self.summary().round(6).to_csv(os.path.join(dir_out, 'vocabulary.csv'), index=False)
+        self.frequent_words().round(6).to_csv(os.path.join(dir_out, 'frequent_words.csv'), index=False)
+        self.save(os.path.join(dir_out, 'vocabulary_sketch.npz'))
+
+def fit_power_law(x, y):
+    """
+    Least-squares fit of y = coefficient * x ** exponent on log-log scales.
+    Returns:
+        coefficient, exponent, r_squared (NaN if there are fewer than two points with positive x and y)
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    mask = (x > 0) & (y > 0)
+    x, y = np.log(x[mask]), np.log(y[mask])
+    if len(x) < 2 or np.ptp(x) == 0:
+        return np.nan, np.nan, np.nan
+    exponent, intercept = np.polyfit(x, y, 1)
+    residuals = y - (intercept + exponent * x)
+    total = np.sum((y - y.mean()) ** 2)
+    return float(np.exp(intercept)), float(exponent), float(1 - np.sum(residuals ** 2) / total) if total else 1.0
+
+class VocabularyGrowth:
+
+    """
+    The vocabulary growth (Heaps' law) and rank-frequency (Zipf's law) curves of a corpus, computed in a single pass
+    over its token stream in fixed memory. The number of types is estimated with a HyperLogLog sketch and recorded at
+    logarithmically spaced token offsets (checkpoints), and the frequencies of the most frequent types are estimated
+    with a count-min sketch (see HeavyHitters). Every token is added once, so the cost is linear in the number of tokens.
+    """
+
+    def __init__(self, n_ranks=1000, checkpoints_per_decade=10, precision=14, width=1 << 16, depth=5):
+        """
+        Arguments:
+            n_ranks: number of ranks of the rank-frequency curve
+            checkpoints_per_decade: number of checkpoints between 10**k and 10**(k+1) tokens
+            precision: HyperLogLog precision (see HyperLogLog)
+            width, depth: size of the count-min sketch (see CountMinSketch)
+        """
+        self.checkpoints_per_decade = checkpoints_per_decade
+        self.types = HyperLogLog(precision)
+        self.frequencies = HeavyHitters(n_ranks, width, depth)
+        self.n_tokens = 0
+        self.checkpoint = 0 # the k-th checkpoint is at round(10 ** (k / checkpoints_per_decade)) tokens
+        self.next_offset = 1
+        self.curve = [] # [(n_tokens, estimated number of types)]
+
+    def _advance(self):
+        while True: # skip the checkpoints that round to the same offset (below 10 tokens per checkpoint)
+            self.checkpoint += 1
+            offset = int(round(10 ** (self.checkpoint / self.checkpoints_per_decade)))
+            if offset > self.next_offset:
+                self.next_offset = offset
+                return
+
+    def update(self, tokens):
+        """
+        Adds the tokens of the next document (lowercased, in the order of the corpus).
+        """
+        if not len(tokens):
+            return
+        ids = {}
+        inverse = np.fromiter((ids.setdefault(t.lower(), len(ids)) for t in tokens), dtype=np.intp, count=len(tokens))
+        words = list(ids)
+        hashes = hash_words(words)
+        self.frequencies.add(words, hashes, np.bincount(inverse, minlength=len(words)))
+
+        end = self.n_tokens + len(tokens)
+        if self.next_offset > end: # no checkpoint in this document: the order of its tokens does not matter
+            self.types.add(hashes)
+        else:
+            hashes = hashes[inverse]
+            start = 0
+            while self.next_offset <= end:
+                stop = self.next_offset - self.n_tokens
+                self.types.add(hashes[start:stop])
+                self.curve.append((self.next_offset, self.types.count()))
+                start = stop
+                self._advance()
+            self.types.add(hashes[start:])
+        self.n_tokens = end
+
+    def growth_curve(self):
+        """
+        Returns:
+            pd.DataFrame with the columns n_tokens, n_types (estimate) and standard_error (conservative for small
+            numbers of types, which are counted almost exactly), at every checkpoint and at the end of the corpus
+        """
+        curve = list(self.curve)
+        if self.n_tokens and (not curve or curve[-1][0] < self.n_tokens):
+            curve.append((self.n_tokens, self.types.count()))
+        df = pd.DataFrame(curve, columns=['n_tokens', 'n_types'])
+        df['standard_error'] = df['n_types'] * self.types.standard_error
+        return df
+
+    def rank_frequencies(self):
+        """
+        Returns:
+            pd.DataFrame with the columns rank, word, frequency (estimated count, see CountMinSketch),
+            max_overestimate and relative_frequency of the n_ranks most frequent types
+        """
+        df = pd.DataFrame(self.frequencies.top(), columns=['word', 'frequency'])
+        df.insert(0, 'rank', np.arange(1, len(df)+1))
+        df['max_overestimate'] = self.frequencies.counts.max_overestimate
+        df['relative_frequency'] = df['frequency'] / self.n_tokens if self.n_tokens else np.nan
+        return df
+
+    def laws(self):
+        """
+        Returns:
+            pd.DataFrame with the power laws fitted to the curves (see fit_power_law): Heaps' law
+            n_types = coefficient * n_tokens ** exponent and Zipf's law frequency = coefficient * rank ** exponent
+            (the Zipf exponent is negative, about -1 for natural language), with their r_squared and number of points
+        """
+        rows = []
+        for law, df, x, y in [('heaps', self.growth_curve(), 'n_tokens', 'n_types'), ('zipf', self.rank_frequencies(), 'rank', 'frequency')]:
+            coefficient, exponent, r_squared = fit_power_law(df[x], df[y])
+            rows.append({'law': law, 'coefficient': coefficient, 'exponent': exponent, 'r_squared': r_squared, 'n_points': len(df)})
+        return pd.DataFrame(rows, columns=['law', 'coefficient', 'exponent', 'r_squared', 'n_points'])
+
+    def write(self, dir_out):
+        """
+        Writes vocabulary_growth.csv (see growth_curve), rank_frequency.csv (see rank_frequencies) and
+        vocabulary_laws.csv (see laws) to the output directory.
+        Returns:
+            the three dataframes
+        """
+        growth, ranks, laws = self.growth_curve(), self.rank_frequencies(), self.laws()
+        growth.round(3).to_csv(os.path.join(dir_out, 'vocabulary_growth.csv'), index=False)
+        ranks.round(6).to_csv(os.path.join(dir_out, 'rank_frequency.csv'), index=False)
+        laws.round(6).to_csv(os.path.join(dir_out, 'vocabulary_laws.csv'), index=False)
+        return growth, ranks, laws
+
+#______________________________________________________________________________________________
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Merge the vocabulary sketches of several runs (e.g. shards of a corpus) and write the corpus vocabulary statistics.')
+    parser.add_argument('sketches', nargs='+', help='vocabulary_sketch.npz files')
+    parser.add_argument('--output', required=True, help='directory for vocabulary.csv, frequent_words.csv and the merged vocabulary_sketch.npz')
+    args = parser.parse_args()
+
+    merged = VocabularySketch.load(args.sketches[0])
+    for path in args.sketches[1:]:
+        merged.merge(VocabularySketch.load(path))
+    os.makedirs(args.output, exist_ok=True)
+    merged.write(args.output)
+    print(merged.summary().to_string(index=False))
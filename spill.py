@@ -0,0 +1,161 @@
+import os, shutil, tempfile
+
+import numpy as np
+import pandas as pd
+
+# approximate memory footprint of the one-row dataframes returned by pipeline.analyze_text (bytes)
+DATAFRAME_OVERHEAD = 1500
+COLUMN_OVERHEAD = 100
+
+def result_size(result):
+    """
+    Estimates the in-memory size of one analyze_text result (bytes).
+    """
+    size = 0
+    for value in result.values():
+        if isinstance(value, pd.DataFrame):
+            size += DATAFRAME_OVERHEAD + COLUMN_OVERHEAD * value.shape[1]
+        else:
+            size += len(value)
+    return size
+
+class SummaryStatistics:
+
+    """
+    Running count, mean and sum of squared deviations per column, merged chunk by chunk (Chan et al.),
+    so that the corpus mean and standard deviation can be computed without keeping all documents in memory.
+    Columns are kept in order of appearance, like pd.concat does.
+    """
+
+    def __init__(self, fill_value=np.nan):
+        self.fill_value = fill_value # value of a column in documents in which it does not occur (0 for distributions)
+        self.columns = []
+        self.numeric = {}
+        self.n_rows = 0
+        self.count, self.mean, self.m2 = {}, {}, {}
+
+    def update(self, df):
+        """
+        Adds the rows of a dataframe (the 'doc' column is ignored).
+        """
+        for col in df.columns:
+            if col == 'doc':
+                continue
+            if col not in self.numeric:
+                self.columns.append(col)
+                self.numeric[col] = True
+                seen = self.n_rows if self.fill_value == 0 else 0 # earlier documents have the fill value
+                self.count[col], self.mean[col], self.m2[col] = seen, 0.0, 0.0
+            if not pd.api.types.is_numeric_dtype(df[col]) and df[col].map(lambda v: isinstance(v, str)).any():
+                self.numeric[col] = False
+
+        for col in self.columns:
+            if not self.numeric[col]:
+                continue
+            if col in df.columns:
+                values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+            else:
+                values = np.full(len(df), self.fill_value, dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if not len(values):
+                continue
+            n_a, n_b = self.count[col], len(values)
+            mean_b = values.mean()
+            delta = mean_b - self.mean[col]
+            self.count[col] = n_a + n_b
+            self.mean[col] += delta * n_b / (n_a + n_b)
+            self.m2[col] += ((values - mean_b)**2).sum() + delta**2 * n_a * n_b / (n_a + n_b)
+        self.n_rows += len(df)
+
+    def summary(self):
+        """
+        The corpus mean and standard deviation (ddof=1) as rows with doc = 'mean' and doc = 'std'
+        (non-numeric columns are left empty, as in pipeline.add_summary_rows).
+        """
+        mean, std = {}, {}
+        for col in self.columns:
+            n = self.count[col]
+            numeric = self.numeric[col] and n > 0
+            mean[col] = self.mean[col] if numeric else np.nan
+            std[col] = np.sqrt(self.m2[col] / (n - 1)) if numeric and n > 1 else np.nan
+        df = pd.DataFrame([mean, std], columns=self.columns)
+        df.insert(0, 'doc', ['mean', 'std'])
+        return df
+
+    def conform(self, df):
+        """
+        Gives a chunk all columns seen in the corpus (in the same order) and casts numeric columns to float,
+        so that chunks can be written one after the other to the same csv file.
+        """
+        df = df.reindex(columns=['doc'] + self.columns, fill_value=self.fill_value)
+        for col in self.columns:
+            if self.numeric[col]:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float64)
+        return df
+
+class ResultSpiller:
+
+    """
+    Collects per-document results and spills them to disk in chunks once their estimated size exceeds
+    a budget, keeping running summary statistics per output. Chunks are stored as pickled dataframes.
+    """
+
+    def __init__(self, outputs, max_chunk_bytes, spill_dir=None):
+        """
+        Arguments:
+            outputs: {output name: (function that combines per-document dataframes and doc ids into one dataframe, fill value)}
+            max_chunk_bytes: estimated size of the buffered results at which a chunk is spilled
+            spill_dir: parent directory of the temporary chunk directory (default: system temp dir)
+        """
+        self.outputs = outputs
+        self.max_chunk_bytes = max_chunk_bytes
+        self.dir = tempfile.mkdtemp(prefix='spill_', dir=spill_dir)
+        self.statistics = {name: SummaryStatistics(fill_value) for name, (_, fill_value) in outputs.items()}
+        self.pending, self.pending_infiles, self.pending_bytes = [], [], 0
+        self.n_chunks = 0
+        self.n_docs = 0
+
+    def _path(self, chunk, name):
+        return os.path.join(self.dir, f'{chunk:06d}_{name}.pkl')
+
+    def add(self, infile, result):
+        """
+        Buffers the result of one document, spilling the buffer if it exceeds the budget.
+        """
+        self.pending.append(result)
+        self.pending_infiles.append(infile)
+        self.pending_bytes += result_size(result)
+        self.n_docs += 1
+        if self.pending_bytes >= self.max_chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered results to disk as one chunk.
+        """
+        if not self.pending:
+            return
+        for name, (combine, _) in self.outputs.items():
+            df = combine([r[name] for r in self.pending], self.pending_infiles)
+            self.statistics[name].update(df)
+            df.to_pickle(self._path(self.n_chunks, name))
+        pd.DataFrame(data={
+            'document': self.pending_infiles,
+            'pos_tags': [r['pos_tags'] for r in self.pending],
+            'dependencies': [r['dependencies'] for r in self.pending],
+        }).to_pickle(self._path(self.n_chunks, 'parsing_results'))
+        self.n_chunks += 1
+        self.pending, self.pending_infiles, self.pending_bytes = [], [], 0
+
+    def chunks(self, name):
+        """
+        Reads the chunks of one output back, one at a time.
+        """
+        for chunk in range(self.n_chunks):
+            yield pd.read_pickle(self._path(chunk, name))
+
+    def close(self):
+        """
+        Removes the spilled chunks.
+        """
+        shutil.rmtree(self.dir, ignore_errors=True)
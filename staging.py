@@ -0,0 +1,153 @@
+import queue, threading
+
+# end of the stream of items, passed on from stage to stage (also returned by _get when the pipeline is stopped)
+END = object()
+
+class StagedPipeline:
+
+    """
+    Runs the stages of a computation over a stream of items (e.g. parse and features over the documents of a corpus)
+    concurrently: a loader thread iterates over the input (so reading and decoding overlap with the analysis), every
+    stage runs in its own threads, and the stages are connected by bounded queues. The caller receives the results in
+    input order while the next items are processed, so aggregating and writing overlap with the analysis as well.
+    At most queue_size items are in flight (loaded but not yet returned to the caller): when the caller or a stage
+    falls behind, the stages before it block (backpressure), so no stage holds the whole corpus.
+    An exception in a stage stops all threads and is raised to the caller. Use as a context manager, so that the
+    threads are also stopped when the caller stops early (e.g. a converged sample, or an interrupt).
+    Without threads, the stages are applied one after the other in the calling thread.
+    """
+
+    def __init__(self, stages, queue_size=16, threaded=True, timeout=0.1):
+        """
+        Arguments:
+            stages: [(name, function, number of threads)], every function takes the item returned by the previous one
+            queue_size: maximum number of items in flight
+            threaded: False to run the stages in the calling thread
+            timeout: seconds between checks whether the pipeline was stopped while a thread waits
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+        self.threaded = threaded
+        self.timeout = timeout
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+        self.threads = []
+        self.slots = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=self.timeout)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=self.timeout)
+            except queue.Empty:
+                pass
+        return END
+
+    def _fail(self, e):
+        with self.lock:
+            if self.error is None:
+                self.error = e
+        self.stop.set()
+
+    def _load(self, items, sink):
+        try:
+            for i, item in enumerate(items):
+                while not self.slots.acquire(timeout=self.timeout):
+                    if self.stop.is_set():
+                        return
+                if not self._put(sink, (i, item)):
+                    return
+            self._put(sink, END)
+        except BaseException as e:
+            self._fail(e)
+
+    def _work(self, function, source, sink, finished, n_threads):
+        try:
+            while True:
+                entry = self._get(source)
+                if entry is END:
+                    self._put(source, END) # for the other threads of the stage
+                    break
+                i, item = entry
+                if not self._put(sink, (i, function(item))):
+                    return
+        except BaseException as e:
+            self._fail(e)
+            return
+        with self.lock:
+            finished[0] += 1
+            last = finished[0] == n_threads
+        if last: # the stage is done when all its threads are
+            self._put(sink, END)
+
+    def run(self, items):
+
+        """
+        Generator that runs the stages over the items.
+        Arguments:
+            items: iterable, iterated in the loader thread
+        Returns:
+            the results of the last stage, in the order of the items
+        """
+
+        if not self.threaded:
+            for item in items:
+                for _, function, _ in self.stages:
+                    item = function(item)
+                yield item
+            return
+
+        self.slots = threading.Semaphore(self.queue_size)
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        self.threads = [threading.Thread(target=self._load, args=(items, queues[0]), name='load', daemon=True)]
+        for k, (name, function, n_threads) in enumerate(self.stages):
+            finished = [0]
+            self.threads += [
+                threading.Thread(target=self._work, args=(function, queues[k], queues[k+1], finished, n_threads), name=f'{name}-{j}', daemon=True)
+                for j in range(n_threads)
+                ]
+        for thread in self.threads:
+            thread.start()
+
+        pending = {} # results that overtook an earlier item in a stage with several threads
+        n_returned = 0
+        try:
+            while True:
+                entry = self._get(queues[-1])
+                if entry is END: # all items are done, or a stage failed
+                    break
+                i, result = entry
+                pending[i] = result
+                while n_returned in pending:
+                    result = pending.pop(n_returned)
+                    n_returned += 1
+                    self.slots.release()
+                    yield result
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Stops the threads and waits until they finished their current item.
+        """
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -0,0 +1,449 @@
+import os, json, sqlite3
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL UNIQUE,
+    created TEXT NOT NULL,
+    language TEXT,
+    readability_metric TEXT,
+    diversity_metric TEXT,
+    input TEXT,
+    output_dir TEXT,
+    n_documents INTEGER,
+    parameters TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_language ON runs (language);
+CREATE INDEX IF NOT EXISTS runs_readability_metric ON runs (readability_metric);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+
+CREATE TABLE IF NOT EXISTS outputs (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    output TEXT NOT NULL,
+    features TEXT NOT NULL,
+    fill_value REAL,
+    PRIMARY KEY (run, output)
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    position INTEGER NOT NULL,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (run, position)
+);
+CREATE INDEX IF NOT EXISTS documents_doc ON documents (doc);
+
+CREATE TABLE IF NOT EXISTS document_values (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    output TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    feature TEXT NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS document_values_run ON document_values (run, output, position);
+CREATE INDEX IF NOT EXISTS document_values_metric ON document_values (output, feature);
+
+CREATE TABLE IF NOT EXISTS aggregates (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    output TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    mean,
+    std,
+    PRIMARY KEY (run, output, feature)
+);
+CREATE INDEX IF NOT EXISTS aggregates_metric ON aggregates (output, feature, mean);
+"""
+
+def to_sql(value):
+    """
+    Converts a dataframe cell to a SQLite value (NaN becomes NULL).
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+class ResultStore:
+
+    """
+    SQLite database with the parameters, per-document values and corpus aggregates (mean and std) of every run,
+    indexed by run id, document id, language and metric. Runs are referred to by an integer key within the database
+    (runs.id) and by their run id outside of it. Documents are numbered by their position in the outputs,
+    and their values are stored in long format (one row per document and feature); features with the fill value
+    of their output (0 for distributions) are left out.
+    A run is either written to the store while it aggregates its results, in which case its csv files are written
+    from the store (see start_run and RunWriter), or added afterwards from its csv files (add_run). The csv files of
+    a stored run can be exported again at any time (export_csv).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL') # runs can be added while others are queried
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#INGESTION_____________________________________________________________________________________
+    def start_run(self, run_id, parameters, dir_out):
+
+        """
+        Adds a run whose outputs are stored while the run aggregates them.
+        Arguments:
+            run_id: unique id of the run
+            parameters: {setting: value}; language, readability metric, lexical diversity metric and input
+                are also stored in their own (indexed) columns
+            dir_out: output directory of the run
+        Returns:
+            RunWriter
+        """
+
+        with self.connection:
+            self._delete(run_id)
+            run = self._insert_run(run_id, parameters, dir_out)
+        return RunWriter(self, run)
+
+    def add_run(self, run_id, parameters, dir_out, outputs, chunk_size=10000):
+
+        """
+        Stores a run from the csv files in its output directory (e.g. of a run without a result store).
+        The csv files are read in chunks, so memory use does not grow with the size of the corpus.
+        Arguments:
+            run_id, parameters, dir_out: see start_run
+            outputs: {output name: fill value} of the csv files to store (name.csv, with the mean and std rows last)
+            chunk_size: number of csv rows read at once
+        """
+
+        with self.connection:
+            self._delete(run_id)
+            run = self._insert_run(run_id, parameters, dir_out)
+            n_documents = None
+            for name, fill_value in outputs.items():
+                path = os.path.join(dir_out, f'{name}.csv')
+                if os.path.exists(path):
+                    n_documents = self._add_output(run, name, path, fill_value, chunk_size)
+            self.connection.execute('UPDATE runs SET n_documents = ? WHERE id = ?', (n_documents, run))
+
+    def _insert_run(self, run_id, parameters, dir_out):
+        parameters = {k: str(v) for k, v in parameters.items()}
+        return self.connection.execute(
+            'INSERT INTO runs (run_id, created, language, readability_metric, diversity_metric, input, output_dir, parameters) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                run_id,
+                datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                parameters.get('language'),
+                parameters.get('readability metric'),
+                parameters.get('lexical diversity metric'),
+                parameters.get('input'),
+                dir_out,
+                json.dumps(parameters),
+            )).lastrowid
+
+    def _add_output(self, run, name, path, fill_value, chunk_size):
+        features, position, tail = None, 0, None
+        chunks = pd.read_csv(path, dtype={'doc': str}, keep_default_na=False, na_values=[''], chunksize=chunk_size)
+        for chunk in chunks:
+            if features is None:
+                features = [c for c in chunk.columns if c != 'doc']
+            # the last two rows of the file are the mean and std, so two rows are held back until the next chunk
+            rows = chunk if tail is None else pd.concat([tail, chunk])
+            rows, tail = rows.iloc[:-2], rows.iloc[-2:]
+            self._add_documents(run, name, rows, features, fill_value, position)
+            position += len(rows)
+        self._add_summary(run, name, tail, features, fill_value)
+        return position
+
+    def _add_summary(self, run, name, summary, features, fill_value):
+        # feature names are stored as text (as in the header of the csv file), e.g. the word lengths of word_length_distribution
+        self.connection.execute('INSERT INTO outputs VALUES (?, ?, ?, ?)', (run, name, json.dumps([str(f) for f in features]), fill_value))
+        mean, std = summary.iloc[0], summary.iloc[1]
+        self.connection.executemany(
+            'INSERT INTO aggregates VALUES (?, ?, ?, ?, ?)',
+            [(run, name, str(f), to_sql(mean[f]), to_sql(std[f])) for f in features],
+            )
+
+    def _add_documents(self, run, name, rows, features, fill_value, position):
+        self.connection.executemany( # the same documents, in the same order, appear in every output
+            'INSERT OR IGNORE INTO documents VALUES (?, ?, ?)',
+            [(run, position+i, str(doc)) for i, doc in enumerate(rows['doc'])],
+            )
+        values = rows[features].to_numpy(dtype=object)
+        names = [str(f) for f in features]
+        records = []
+        for i in range(len(rows)):
+            for feature, value in zip(names, values[i]):
+                value = to_sql(value)
+                if fill_value is not None and value == fill_value and not isinstance(value, str):
+                    continue
+                records.append((run, name, position+i, feature, value))
+        self.connection.executemany('INSERT INTO document_values VALUES (?, ?, ?, ?, ?)', records)
+
+    def _delete(self, run_id):
+        run = self._run(run_id)
+        if run is not None:
+            self._remove(run)
+
+    def _remove(self, run):
+        for table in ['outputs', 'documents', 'document_values', 'aggregates']:
+            self.connection.execute(f'DELETE FROM {table} WHERE run = ?', (run,))
+        self.connection.execute('DELETE FROM runs WHERE id = ?', (run,))
+
+    def _run(self, run_id):
+        row = self.connection.execute('SELECT id FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def delete_run(self, run_id):
+        """
+        Removes a run from the store.
+        """
+        with self.connection:
+            self._delete(run_id)
+
+#QUERIES_______________________________________________________________________________________
+    def query(self, sql, parameters=()):
+        """
+        Runs a SQL query on the store and returns the result as pd.DataFrame.
+        """
+        return pd.read_sql_query(sql, self.connection, params=parameters)
+
+    def runs(self, language=None, since=None, until=None):
+        """
+        The stored runs, optionally of one language and/or created in [since, until) (ISO dates, UTC).
+        """
+        conditions, parameters = self._run_conditions(language, since, until)
+        return self.query(f'SELECT * FROM runs {self._where(conditions)} ORDER BY created', parameters).drop(columns=['id'])
+
+    def find_runs(self, output, feature, min_mean=None, max_mean=None, language=None, since=None, until=None, readability_metric=None, diversity_metric=None):
+
+        """
+        Runs whose corpus mean of a feature lies in a range, e.g. the runs of last month with a mean RIX above 5:
+        find_runs('readability_statistics', 'score', min_mean=5, readability_metric='RIX', since='2026-09-01')
+        Returns:
+            pd.DataFrame with the run columns plus mean and std of the feature
+        """
+
+        conditions, parameters = self._run_conditions(language, since, until, 'r.')
+        conditions += ['a.output = ?', 'a.feature = ?']
+        parameters += [output, feature]
+        for column, value in [('readability_metric', readability_metric), ('diversity_metric', diversity_metric)]:
+            if value is not None:
+                conditions.append(f'r.{column} = ?')
+                parameters.append(value)
+        if min_mean is not None:
+            conditions.append('a.mean >= ?')
+            parameters.append(min_mean)
+        if max_mean is not None:
+            conditions.append('a.mean <= ?')
+            parameters.append(max_mean)
+        return self.query(
+            f'SELECT r.*, a.mean, a.std FROM aggregates a JOIN runs r ON r.id = a.run {self._where(conditions)} ORDER BY r.created',
+            parameters,
+            ).drop(columns=['id'])
+
+    def aggregates(self, run_id=None, output=None, feature=None):
+        """
+        Corpus mean and std per run, output and feature.
+        """
+        conditions, parameters = self._conditions(**{'r.run_id': run_id, 'a.output': output, 'a.feature': feature})
+        return self.query(
+            f'SELECT r.run_id, a.output, a.feature, a.mean, a.std FROM aggregates a JOIN runs r ON r.id = a.run {self._where(conditions)}',
+            parameters,
+            )
+
+    def document_values(self, run_id=None, output=None, feature=None, doc=None):
+        """
+        Stored per-document values in long format (features with the fill value of their output are not stored).
+        """
+        conditions, parameters = self._conditions(**{'r.run_id': run_id, 'v.output': output, 'v.feature': feature, 'd.doc': doc})
+        return self.query(
+            'SELECT r.run_id, v.output, v.position, d.doc, v.feature, v.value FROM document_values v '
+            'JOIN documents d ON d.run = v.run AND d.position = v.position JOIN runs r ON r.id = v.run '
+            f'{self._where(conditions)} ORDER BY v.run, v.output, v.position',
+            parameters,
+            )
+
+    def chunks(self, run, output, chunk_size=10000):
+
+        """
+        Generator over one output of a run (by its key in the store) in the layout of its csv file: the documents in
+        chunks of at most chunk_size rows, followed by the mean and std rows (as a separate chunk).
+        """
+
+        row = self.connection.execute('SELECT features, fill_value FROM outputs WHERE run = ? AND output = ?', (run, output)).fetchone()
+        if row is None:
+            raise KeyError(f'The run has no output {output}.')
+        features, fill_value = json.loads(row[0]), row[1]
+
+        n_documents = self.connection.execute('SELECT COUNT(*) FROM documents WHERE run = ?', (run,)).fetchone()[0]
+        for start in range(0, n_documents, chunk_size):
+            end = min(start + chunk_size, n_documents)
+            docs = [doc for doc, in self.connection.execute(
+                'SELECT doc FROM documents WHERE run = ? AND position >= ? AND position < ? ORDER BY position', (run, start, end))]
+            columns = {f: [fill_value]*len(docs) for f in features}
+            cursor = self.connection.execute(
+                'SELECT position, feature, value FROM document_values WHERE run = ? AND output = ? AND position >= ? AND position < ?',
+                (run, output, start, end))
+            for position, feature, value in cursor:
+                columns[feature][position-start] = value
+            yield pd.DataFrame({'doc': docs, **columns}, columns=['doc'] + features).fillna(np.nan) # NULL -> NaN
+
+        aggregates = {f: (m, s) for f, m, s in self.connection.execute(
+            'SELECT feature, mean, std FROM aggregates WHERE run = ? AND output = ?', (run, output))}
+        yield pd.DataFrame({'doc': ['mean', 'std'], **{f: list(aggregates[f]) for f in features}}, columns=['doc'] + features).fillna(np.nan)
+
+    def frame(self, run_id, output):
+        """
+        One output of a run in the layout of its csv file: a row per document plus the mean and std rows.
+        """
+        return pd.concat(list(self.chunks(self._run(run_id), output)), ignore_index=True)
+
+    def write_csv(self, run, output, path, chunk_size=10000):
+        """
+        Writes one output of a run (by its key in the store) to a csv file, chunk by chunk.
+        """
+        for i, df in enumerate(self.chunks(run, output, chunk_size)):
+            df.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+    def export_csv(self, run_id, dir_out, outputs=None):
+        """
+        Writes the csv files of a run (all stored outputs, or the given ones) to a directory.
+        """
+        run = self._run(run_id)
+        if outputs is None:
+            outputs = [o for o, in self.connection.execute('SELECT output FROM outputs WHERE run = ?', (run,))]
+        os.makedirs(dir_out, exist_ok=True)
+        for output in outputs:
+            self.write_csv(run, output, os.path.join(dir_out, f'{output}.csv'))
+
+    def _run_conditions(self, language, since, until, prefix=''):
+        conditions, parameters = [], []
+        if language is not None:
+            conditions.append(f'{prefix}language = ?')
+            parameters.append(language)
+        if since is not None:
+            conditions.append(f'{prefix}created >= ?')
+            parameters.append(since)
+        if until is not None:
+            conditions.append(f'{prefix}created < ?')
+            parameters.append(until)
+        return conditions, parameters
+
+    def _conditions(self, **columns):
+        conditions = [f'{column} = ?' for column, value in columns.items() if value is not None]
+        return conditions, [value for value in columns.values() if value is not None]
+
+    def _where(self, conditions):
+        return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+class RunWriter:
+
+    """
+    Adds the outputs of a running run to the store while they are aggregated (see ResultStore.start_run), and
+    writes their csv files from the store, so the store holds exactly what the csv files contain.
+    Every output is committed once its summary is added, so that other runs can write to the store in between;
+    runs.n_documents is only set when the run is finished. Used as a context manager, the run is removed from
+    the store when an exception ends it.
+    """
+
+    def __init__(self, store, run):
+        self.store = store
+        self.run = run
+        self.positions = {} # output -> number of documents added so far
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.abort()
+
+    def add_documents(self, output, df, fill_value):
+        """
+        Adds (a chunk of) the per-document rows of an output, with a 'doc' column, in the order of the documents.
+        fill_value: value that is not stored (0 for distributions, None: all values are stored)
+        """
+        position = self.positions.get(output, 0)
+        self.store._add_documents(self.run, output, df, [c for c in df.columns if c != 'doc'], fill_value, position)
+        self.positions[output] = position + len(df)
+
+    def add_summary(self, output, summary, fill_value):
+        """
+        Adds the mean and std rows of an output (after its documents) and commits the output.
+        """
+        self.store._add_summary(self.run, output, summary, [c for c in summary.columns if c != 'doc'], fill_value)
+        self.store.connection.commit()
+
+    def write_csv(self, output, path):
+        """
+        Writes the csv file of an output from the store.
+        """
+        self.store.write_csv(self.run, output, path)
+
+    def finish(self):
+        """
+        Marks the run as complete.
+        """
+        with self.store.connection:
+            self.store.connection.execute('UPDATE runs SET n_documents = ? WHERE id = ?', (max(self.positions.values(), default=0), self.run))
+
+    def abort(self):
+        """
+        Removes the run from the store.
+        """
+        self.store.connection.rollback() # the output that was being added
+        with self.store.connection:
+            self.store._remove(self.run)
+
+#______________________________________________________________________________________________
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Query the runs and results in a result store.')
+    parser.add_argument('store', help='path of the result store (e.g. results.db)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    runs_parser = subparsers.add_parser('runs', help='list the runs')
+    runs_parser.add_argument('--language')
+    runs_parser.add_argument('--since', help='ISO date, e.g. 2026-09-01')
+    runs_parser.add_argument('--until', help='ISO date')
+
+    find_parser = subparsers.add_parser('find', help='runs whose corpus mean of a feature lies in a range')
+    find_parser.add_argument('output', help='e.g. readability_statistics')
+    find_parser.add_argument('feature', help='e.g. score')
+    find_parser.add_argument('--min', type=float)
+    find_parser.add_argument('--max', type=float)
+    find_parser.add_argument('--language')
+    find_parser.add_argument('--readability-metric')
+    find_parser.add_argument('--diversity-metric')
+    find_parser.add_argument('--since')
+    find_parser.add_argument('--until')
+
+    export_parser = subparsers.add_parser('export', help='write the csv files of a run')
+    export_parser.add_argument('run_id')
+    export_parser.add_argument('dir_out')
+
+    sql_parser = subparsers.add_parser('sql', help='run a SQL query')
+    sql_parser.add_argument('query')
+    args = parser.parse_args()
+
+    with ResultStore(args.store) as store:
+        if args.command == 'runs':
+            print(store.runs(args.language, args.since, args.until).drop(columns=['parameters']).to_string(index=False))
+        elif args.command == 'find':
+            df = store.find_runs(args.output, args.feature, args.min, args.max, args.language, args.since, args.until, args.readability_metric, args.diversity_metric)
+            print(df.drop(columns=['parameters']).to_string(index=False))
+        elif args.command == 'export':
+            store.export_csv(args.run_id, args.dir_out)
+        else:
+            print(store.query(args.query).to_string(index=False))
@@ -1,16 +1,12 @@
-import os, shutil
-import util, visualizations, warnings
+import os, shutil, uuid, codecs, importlib
+import util, pipeline, features, dedup, metrics, profiling, sampling, staging, isolation, sketch, trajectories, visualizations, warnings
 from configparser import ConfigParser
-from statistics import mean, stdev
+from contextlib import nullcontext
+from functools import partial
 from tqdm import tqdm
-
-import pandas as pd
-import spacy, pyphen
-import numpy as np
-from spacy.matcher import Matcher
 #______________________________________________________________________________________________
 
-def main():
+def main(profile=False):
     
     warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -21,33 +17,110 @@ def main():
     huggingface_config = config_object['HUGGINGFACE_CONFIG']
     output_config = config_object["OUTPUT_CONFIG"]
     dir_out = output_config['output_dir']
+    run_metrics = metrics.RunMetrics(enabled=bool(int(output_config.get('metrics', '1'))))
+
+    # modules that register additional features and outputs (see features.feature), and the outputs to compute:
+    # only the features these outputs depend on are computed (empty: all outputs)
+    feature_modules = [m.strip() for m in output_config.get('feature_modules', '').split(',') if m.strip()]
+    for module in feature_modules:
+        importlib.import_module(module)
+    outputs = features.resolve_outputs([o.strip() for o in output_config.get('outputs', '').split(',') if o.strip()])
+
+    # corpus vocabulary statistics in fixed memory (see sketch.VocabularySketch), which can also bound the
+    # function_word_distribution to the max_function_words most frequent function words of the corpus
+    max_function_words = int(output_config.get('max_function_words', '0'))
+    vocabulary = None
+    if int(output_config.get('vocabulary_sketch', '0')) or max_function_words:
+        vocabulary = sketch.VocabularySketch(top_k=max(int(output_config.get('sketch_top_k', '100')), max_function_words))
+    # vocabulary growth (Heaps) and rank-frequency (Zipf) curves of the corpus, in one pass over the token stream
+    growth = sketch.VocabularyGrowth(int(output_config.get('zipf_ranks', '1000'))) if int(output_config.get('vocabulary_growth', '0')) else None
+    # within-document trajectories: the metrics of every window of trajectory_window tokens (words), with consecutive
+    # windows trajectory_step tokens apart (default: trajectory_window, i.e. non-overlapping windows)
+    trajectory_window = int(output_config.get('trajectory_window', '0'))
+    trajectory_step = int(output_config.get('trajectory_step', '0')) or trajectory_window
+    if trajectory_window < 0 or trajectory_step < 0:
+        raise ValueError('trajectory_window and trajectory_step must be positive numbers of tokens (or 0 to disable trajectories).')
+    settings = {'window_size': trajectory_window, 'window_step': trajectory_step}
+    # values of every document that are only used for these corpus-level outputs (not kept in the results)
+    extra_values = (['vocabulary_counts'] if vocabulary is not None else []) + (['tokens'] if growth is not None else []) + (['trajectory'] if trajectory_window else [])
+
+    # bounded-memory mode: documents are streamed from the input and their results are spilled to disk in chunks
+    max_memory = int(input_config.get('max_memory', '0'))
+    dedup_mode = input_config.get('deduplication', 'off').strip()
+    if max_memory and dedup_mode != 'off':
+        raise ValueError('Deduplication is not available in bounded-memory mode, please set max_memory to 0 or deduplication to "off".')
+
+    # sampling mode: a random (optionally stratified) sample is analyzed in batches until the confidence intervals
+    # of all corpus means are narrower than sample_tolerance
+    sample_tolerance = float(input_config.get('sample_tolerance', '0'))
+    sample_stratify = input_config.get('sample_stratify', '').strip()
+    if max_memory and sample_tolerance:
+        raise ValueError('Sampling is not available in bounded-memory mode, please set max_memory or sample_tolerance to 0.')
+    if sample_tolerance and dedup_mode != 'off': # duplicates can only be detected by loading the whole corpus
+        raise ValueError('Deduplication is not available in sampling mode, please set sample_tolerance to 0 or deduplication to "off".')
+
+    # group-by analysis: the mean and std of every output are also computed per value of a metadata column
+    group_by = input_config.get('group_by', '').strip()
+    if max_memory and group_by:
+        raise ValueError('Group-by analysis is not available in bounded-memory mode, please set max_memory to 0 or leave group_by empty.')
+    # metadata columns that are loaded next to the texts
+    metadata_columns = [c for c in dict.fromkeys([sample_stratify if sample_tolerance else '', group_by]) if c]
 
 #LOAD_DATA_____________________________________________________________________________________
     print("Loading data...")
 
-    if input_config['input_format'].lower().strip() in {'csv', 'zip'}:
-        text_column = input_config['text_column'] if input_config['input_format'] == 'csv' else None
-        delimiter = input_config['delimiter'] if input_config['input_format'] == 'csv' else None
-
-        texts, infiles = util.load_data(
-            input_config['input_format'],
-            input_config['input'],
-            text_column,
-            delimiter
-            )
-    elif input_config['input_format'].lower().strip() == 'huggingface':
-        dataset_name = huggingface_config['dataset_name']
-        subset = huggingface_config['subset']
-        split = huggingface_config['split']
-        column_name = huggingface_config['text_column']
-        texts, infiles = util.load_huggingface(
-            dataset_name, 
-            subset, 
-            split, 
-            column_name
-            )
-    else:
-        raise ValueError('Please select one of the following input types: "csv", "zip", or "huggingface"')
+    with run_metrics.stage('load_data'):
+        if input_config['input_format'].lower().strip() in {'csv', 'parquet', 'zip'}:
+            text_column = input_config['text_column'] if input_config['input_format'] in {'csv', 'parquet'} else None
+            delimiter = input_config['delimiter'] if input_config['input_format'] == 'csv' else None
+
+            # text files of a zip folder that are not valid UTF-8 are decoded with the first of these encodings that can
+            # decode them ('detect' guesses the encoding), in load_threads threads
+            encodings = [e.strip() for e in input_config.get('encoding_fallback', ', '.join(util.FALLBACK_ENCODINGS)).split(',') if e.strip()]
+            for encoding in encodings:
+                if encoding != 'detect':
+                    codecs.lookup(encoding) # unknown encodings raise a LookupError before anything is read
+
+            if sample_tolerance: # only the doc indices, the texts of the sampled documents are loaded while processing
+                data = None, util.document_ids(input_config['input_format'], input_config['input'], text_column, delimiter)
+                load_texts = partial(util.load_documents, input_config['input_format'], input_config['input'], text_column=text_column,
+                                     delimiter=delimiter, encodings=encodings, n_threads=int(input_config.get('load_threads', '4')))
+            else:
+                load = util.iter_data if max_memory else util.load_data
+                data = load(
+                    input_config['input_format'],
+                    input_config['input'],
+                    text_column,
+                    delimiter,
+                    encodings=encodings,
+                    n_threads=int(input_config.get('load_threads', '4')),
+                    )
+            metadata = {c: util.load_column(input_config['input_format'], input_config['input'], c, delimiter) for c in metadata_columns}
+        elif input_config['input_format'].lower().strip() == 'huggingface':
+            dataset_name = huggingface_config['dataset_name']
+            subset = huggingface_config['subset']
+            split = huggingface_config['split']
+            column_name = huggingface_config['text_column']
+            if sample_tolerance:
+                data = None, util.huggingface_ids(dataset_name, subset, split, column_name)
+                load_texts = partial(util.load_huggingface_documents, dataset_name, subset, split, column_name)
+            else:
+                load = util.iter_huggingface if max_memory else util.load_huggingface
+                data = load(
+                    dataset_name, 
+                    subset, 
+                    split, 
+                    column_name
+                    )
+            metadata = {c: util.load_huggingface_column(dataset_name, subset, split, c) for c in metadata_columns}
+        else:
+            raise ValueError('Please select one of the following input types: "csv", "parquet", "zip", or "huggingface"')
+    if not max_memory:
+        texts, infiles = data
+        if not sample_tolerance:
+            run_metrics.count('load_data', docs=len(texts))
+        # {column: {doc: value}}, infiles are unique, so the values stay aligned after deduplication and sampling
+        metadata = {c: dict(zip(infiles, values)) for c, values in metadata.items()}
     
 #PREPARE_OUTPUT_DIR____________________________________________________________________________
     dir_out = output_config['output_dir']
@@ -64,285 +137,195 @@ def main():
     os.mkdir(dir_out)
     os.mkdir(os.path.join(dir_out, 'visualizations'))
 
-    length_dfs = []
-    lexical_richness_dfs = []
-    readability_dfs = []
-    distribution_dfs = {
-        'punctuation_distribution': [],
-        'function_word_distribution': [],
-        'pos_profile': [],
-        'dependency_profile': [],
-        'word_length_distribution': [],
-    }
-
-    pos_outputs = []
-    dependency_outputs = []
+#DEDUPLICATION_________________________________________________________________________________
+    # exact and near-duplicates are detected before parsing
+    # 'flag': all texts are kept and exact duplicates reuse the results of their first occurrence
+    # 'skip': only the first text of every duplicate cluster is kept
+    if dedup_mode != 'off':
+        print("Detecting duplicates...")
+    if max_memory: # the input is only read while processing
+        documents = run_metrics.iterate('load_data', data)
+        duplicates_of = {}
+    elif sample_tolerance: # the texts are only loaded once they are sampled (see below)
+        duplicates_of = {}
+    else:
+        with run_metrics.stage('deduplication'):
+            texts, infiles, duplicates_of = dedup.deduplicate(
+                texts,
+                infiles,
+                dedup_mode,
+                float(input_config.get('duplicate threshold', '0.9')),
+                dir_out
+                )
+        documents = zip(texts, infiles)
+
+    if sample_tolerance:
+        print("Sampling...")
+        order = sampling.sample_order(
+            len(infiles),
+            [metadata[sample_stratify][f] for f in infiles] if sample_stratify else None,
+            int(input_config.get('sample_seed', '0'))
+            )
+        n_documents = len(infiles)
+        sample_batch_size = int(input_config.get('sample_batch_size', '100'))
+        documents = run_metrics.iterate('load_data', sampling.iter_sample(order, infiles, load_texts, sample_batch_size))
+        intervals = pipeline.sample_intervals(len(infiles), sample_tolerance, float(input_config.get('sample_confidence', '0.95')))
+        n_tracked = 0
 
 #PREPROCESSING_________________________________________________________________________________
     
     # Determine language
     lang = input_config['language'].strip()
-    if lang == 'Dutch':
-        nlp = spacy.load("nl_core_news_lg")
-        dic = pyphen.Pyphen(lang='nl_NL')
-    elif lang == 'English':
-        nlp = spacy.load("en_core_web_lg")
-        dic = pyphen.Pyphen(lang='en')
-    elif lang == 'French':
-        nlp = spacy.load("fr_core_news_lg")
-        dic = pyphen.Pyphen(lang='fr_FR')
-    elif lang == 'German':
-        nlp = spacy.load("de_core_news_lg")
-        dic = pyphen.Pyphen(lang='de')
-    else:
-        ValueError('Please provide one of the following languages: "Dutch", "English", "French", "German".')
-    
-    # Initialize the SpaCy matcher with a vocab and passive rules
-    passive_rules = [
-        [{'DEP': 'nsubj:pass'}, {'DEP': 'aux:pass'}],
-        [{'DEP': 'aux:pass'}],
-        [{'DEP': 'nsubj:pass'}],
-    ]
-    matcher = Matcher(nlp.vocab)  
-    matcher.add('Passive',  passive_rules)
+    with run_metrics.stage('load_model'):
+        nlp, dic = pipeline.load_language(lang)
+        # comma-separated dependency labels that mark a passive sentence (default: pipeline.PASSIVE_LABELS)
+        passive_labels = [l.strip() for l in input_config.get('passive_labels', '').split(',') if l.strip()]
+        passive_labels = pipeline.get_passive_labels(nlp, lang, passive_labels or None)
 
     # Check readability and lexical diversity metrics
     diversity_metric = input_config['lexical diversity metric'].strip()
     readability_metric = input_config['readability metric'].strip()
-  
-    print("Processing data...")
-    for text in tqdm(texts): # Analyze text by text
+    span_size = int(input_config['STTR span size'])
 
-        # check if text is empty
-        if not text.strip():
-            dummy_df = pd.DataFrame(data={'__Dummy__': ['dummy']}) # add dummy data to output
-            length_dfs.append(dummy_df)
-            lexical_richness_dfs.append(dummy_df)
-            readability_dfs.append(dummy_df)
-            for k in distribution_dfs.keys():
-                distribution_dfs[k].append(dummy_df)
-            continue # skip to the next text
-    
-        text = ' '.join(text.split()) # remove redundant whitespace
-
-        # tokenization, parsing, etc.
-        doc = nlp(text)
-        parsed_sentences = [[(w.text, w.pos_) for w in s] for s in doc.sents]
-        pos_tags = [w.pos_ for s in doc.sents for w in s]
-        dependencies = [w.dep_ for s in doc.sents for w in s if w.dep_]
-        tokenized_sentences = [[t for t, pos in s if pos not in {'PUNCT', 'SYM', 'X'}] for s in parsed_sentences]
-        tokens = [t for s in parsed_sentences for t, pos in s if pos not in {'PUNCT', 'SYM', 'X'}]
-        types = set([t.lower() for t in tokens])
-        syllables = [[util.get_n_syllables(t, dic) for t, pos in s if pos not in {'PUNCT', 'SYM', 'X'}] for s in parsed_sentences]
-
-        # store parsing results
-        pos_outputs.append(' '.join(pos_tags))
-        dependency_outputs.append(' '.join(dependencies))
-
-#LENGTH STATISTICS_____________________________________________________________________________
-
-        # check if text is empty (or contains only punctuation/symbols/other) -> skip
-        n_tokens = len(tokens)
-        n_char = len(text.replace(' ', ''))
-        n_syllables = sum([syl for sent in syllables for syl in sent])
-        n_polysyllabic = len([i for sent in syllables for i in sent if i > 1])
-        n_longer_than_6_char = len([t for t in tokens if len(t) > 6])
-        n_types = len(types)
-        n_sentences = len(list(doc.sents))
-
-        avg_char_per_word = mean([len(t) for t in tokens]) if n_tokens > 0 else 0
-        std_char_per_word = stdev([len(t) for t in tokens]) if n_tokens > 1 else 0
-
-        avg_syl_per_word = mean([s for sent in syllables for s in sent]) if n_tokens > 0  else 0
-        std_syl_per_word = stdev([s for sent in syllables for s in sent]) if n_tokens > 1 else 0
-
-        avg_words_per_sent = mean([len(s) for s in tokenized_sentences])
-        std_words_per_sent = stdev([len(s) for s in tokenized_sentences]) if n_sentences > 1 else 0
-
-        ratio_long_words = 0 if n_tokens == 0 else n_longer_than_6_char/n_tokens
-        ratio_content_words = util.ratio_content_words(doc)
-        ratio_passive_sentences = util.get_passive_ratio(doc, matcher)
-
-        stats = {
-        'n_characters': [n_char],
-        'n_syllables': [n_syllables],
-        'n_tokens': [n_tokens],
-        'n_polysyllabic_tokens': [n_polysyllabic],
-        'n_long_tokens': [n_longer_than_6_char],
-        'n_types': [n_types],
-        'n_sentences': [n_sentences],
-        'avg_characters_per_word': [avg_char_per_word],
-        'std_characters_per_word': [std_char_per_word],
-        'avg_syllables_per_word': [avg_syl_per_word],
-        'std_syllables_per_word': [std_syl_per_word],
-        'ratio_long_words': [ratio_long_words],
-        'ratio_content_words': [ratio_content_words],
-        'ratio_passive_sentences': [ratio_passive_sentences],
-        'avg_words_per_sentence': [avg_words_per_sent],
-        'std_words_per_sentence': [std_words_per_sent],
-        }
-
-        length_df = pd.DataFrame(data=stats)
-        length_dfs.append(length_df)
-
-
-#LEXICAL DIVERSITY______________________________________________________________________________
-        if diversity_metric == 'TTR':
-            score = util.ttr(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'RTTR':
-            score = util.rttr(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'CTTR':
-            score = util.cttr(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'STTR':
-            span_size = int(input_config['STTR span size'])
-            score = util.sttr(tokens, span_size) if n_tokens != 0 else None
-        elif diversity_metric == 'Herdan':
-            score = util.Herdan(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'Summer':
-            score = util.Summer(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'Dugast':
-            score = util.Dugast(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'Maas':
-            score = util.Maas(n_types, n_tokens) if n_tokens != 0 else None
-        else:
-            ValueError('Please provide one of the following lexical diversity metrics: "TTR", "RTTR", "CTTR", "STTR", "Herdan", "Summer", "Dugast", "Maas"')
-
-        lr = {
-        'score': [score],
-        }
-
-        lexical_richness_dfs.append(pd.DataFrame(data=lr))
-
-#READABILITY___________________________________________________________________________________
-        if readability_metric == 'ARI':
-            score = util.ARI(n_char, n_tokens, n_sentences) if n_tokens != 0 else None
-        elif readability_metric == 'Coleman-Liau':
-            score = util.ColemanLiau(tokens, tokenized_sentences) if n_tokens != 0 else None
-        elif readability_metric == 'Flesch reading ease':
-            score = util.Flesch(avg_words_per_sent, avg_syl_per_word) if n_tokens != 0 else None
-        elif readability_metric == 'Flesch Kincaid grade level':
-            score = util.Kincaid(avg_words_per_sent, avg_syl_per_word) if n_tokens != 0 else None
-        elif readability_metric == 'Gunning Fog':
-            score = util.Fog(avg_words_per_sent, syllables) if n_tokens != 0 else None
-        if readability_metric == 'SMOG':
-            score = util.SMOG(syllables) if n_tokens != 0 else None
-        elif readability_metric == 'LIX':
-            score = util.LIX(n_tokens, n_sentences, n_longer_than_6_char) if n_tokens != 0 else None
-        elif readability_metric == 'RIX':
-            score = util.RIX(n_longer_than_6_char, n_sentences) if n_tokens != 0 else None
-        else:
-            ValueError('Please provide one of the following metrics: "ARI", "Coleman-Liau", "Flesch reading ease", "Flesch Kincaid grade level", "Gunning Fog", "SMOG", "LIX", "RIX".')
-
-        interpretation = util.interpret_readability(score, readability_metric)
-
-        readability = {
-            'score': [score],
-            'interpretation': [interpretation]
-        }
-
-        readability_dfs.append(pd.DataFrame(data=readability))
-
-#DISTRIBUTIONS_________________________________________________________________________________ 
-        punct_dist = util.get_punct_dist(text)
-        function_word_distribution = util.get_function_word_distribution(doc)
-        pos_profile = util.get_ngram_profile(pos_tags)
-        dependency_profile = util.get_dependency_distribution(dependencies)
-        word_length_distribution = util.get_word_length_distribution(tokens)
-        
-        dist = {
-            'punctuation_distribution': punct_dist,
-            'function_word_distribution': function_word_distribution,
-            'pos_profile': pos_profile,
-            'dependency_profile': dependency_profile,
-            'word_length_distribution': word_length_distribution,
-        }
+    # long texts are parsed in segments of at most segment_length characters, in parse_processes processes
+    segment_length = int(input_config.get('segment_length', str(pipeline.SEGMENT_LENGTH)))
+    n_process = int(input_config.get('parse_processes', '1'))
+  
+    # per-document limits: texts with more than max_characters characters, max_tokens tokens or a word longer than
+    # max_word_length characters are analyzed in an isolated worker process, which is killed after max_seconds or when it
+    # allocates more than max_document_memory MB; the documents it could not analyze are reported in skipped_documents.csv.
+    # The worker is spawned and loads its own copy of the language (see isolation.IsolatedAnalyzer), and parses in one process
+    limits = {k: int(input_config.get(k, '0')) for k in ['max_characters', 'max_tokens', 'max_word_length']}
+    analysis = dict(nlp=nlp, dic=dic, passive_labels=passive_labels, diversity_metric=diversity_metric, readability_metric=readability_metric,
+                    span_size=span_size, segment_length=segment_length, n_process=n_process, outputs=outputs, extra_values=extra_values, settings=settings)
+    isolated = None
+    if any(limits.values()):
+        isolated = isolation.IsolatedAnalyzer(
+            partial(pipeline.analyze_isolated, **{k: v for k, v in analysis.items() if k not in ['nlp', 'dic', 'n_process']}, n_process=1),
+            float(input_config.get('max_seconds', '60')),
+            int(input_config.get('max_document_memory', '0')),
+            partial(pipeline.prepare_worker, lang, feature_modules),
+            )
+    skipped = []
+
+    # in profile mode, time and allocations are attributed to the features (not of the documents analyzed in isolation)
+    profiler = profiling.FeatureProfiler() if profile else None
+
+    # pipelined mode: the input is read in a loader thread, the texts are parsed in a parse thread and their features
+    # computed in feature_threads threads, connected by queues of at most queue_size documents, while the results are
+    # aggregated and written in the main thread (see staging.StagedPipeline); 0 runs the stages one after the other
+    feature_threads = int(input_config.get('feature_threads', '0'))
+    if feature_threads and profile:
+        print("Profiling runs the stages one after the other (feature_threads is ignored)")
+        feature_threads = 0
+    stages = [ # SpaCy pipelines are not meant to be called from several threads, so there is one parse thread
+        ('parse', partial(pipeline.parse_document, analysis=dict(analysis, profiler=profiler), limits=limits, isolated=isolated, duplicates_of=duplicates_of, run_metrics=run_metrics), 1),
+        ('features', partial(pipeline.analyze_document, analysis=dict(analysis, profiler=profiler), run_metrics=run_metrics), feature_threads),
+        ]
 
-        for dist_name in dist.keys():
-            df = pd.DataFrame(data=dist[dist_name])
-            distribution_dfs[dist_name] = distribution_dfs[dist_name] + [df]
+    print("Processing data...")
+    results = []
+    duplicated = set(duplicates_of.values())
+    duplicated_values = {} # extra values of the documents that have exact duplicates
+    trajectory_writer = trajectories.TrajectoryWriter(dir_out) if trajectory_window else None
+    spiller = pipeline.spill_results(max_memory, dir_out, outputs) if max_memory else None
+    with profiler.profile() if profile else nullcontext(), staging.StagedPipeline(stages, int(input_config.get('queue_size', '16')), threaded=bool(feature_threads)) as staged:
+        for document in tqdm(staged.run(enumerate(documents)), total=None if max_memory else len(infiles)): # Analyze text by text
+            i, infile, result = document['number'], document['infile'], document['result']
+            if i in duplicates_of: # exact duplicate: reuse the results of the first occurrence
+                results.append(results[duplicates_of[i]])
+                if extra_values:
+                    pipeline.add_document_values(infile, duplicated_values[duplicates_of[i]], vocabulary, growth, trajectory_writer, run_metrics)
+                continue
+            if document['skipped'] is not None:
+                skipped.append(document['skipped'])
+            if extra_values:
+                values = {k: result.pop(k) for k in extra_values if k in result}
+                pipeline.add_document_values(infile, values, vocabulary, growth, trajectory_writer, run_metrics)
+                if i in duplicated:
+                    duplicated_values[i] = values
+            if spiller is not None:
+                spiller.add(infile, result)
+            else:
+                results.append(result)
+            if sample_tolerance and len(results) - n_tracked == sample_batch_size: # check the intervals after every batch
+                with run_metrics.stage('sampling'):
+                    pipeline.update_intervals(intervals, results[n_tracked:], [infiles[j] for j in order[n_tracked:len(results)]], outputs)
+                    n_tracked = len(results)
+                    if intervals.converged(n_tracked):
+                        break
+
+    if isolated is not None:
+        isolated.stop()
+        pipeline.write_skipped_documents(skipped, dir_out)
+        if skipped:
+            print(f"Skipped {len(skipped)} documents (see skipped_documents.csv)")
+
+    if sample_tolerance:
+        with run_metrics.stage('sampling'):
+            if n_tracked < len(results): # last, incomplete batch
+                pipeline.update_intervals(intervals, results[n_tracked:], [infiles[j] for j in order[n_tracked:len(results)]], outputs)
+            # the sampled documents are written in corpus order
+            sampled = order[:len(results)]
+            ranks = sampled.argsort()
+            results = [results[r] for r in ranks]
+            infiles = [infiles[j] for j in sampled[ranks]]
+        print(f"Sampled {len(results)} of {n_documents} documents")
     
 #WRITE RESULTS TO OUTPUT_______________________________________________________________________
     print("Aggregating data, creating visualizations, and saving raw results...")
-
-    # length statistics
-    print('    ...length statistics')
-    length_df = pd.concat(length_dfs, axis=0)
-    length_df = length_df.drop(columns=['__Dummy__']) if '__Dummy__' in length_df.columns else length_df
-    length_df.insert(0, 'doc', infiles)
-
-    mean_length_df = length_df.mean().to_frame().T
-    mean_length_df['doc'] = 'mean'
-
-    std_length_df = length_df.std().to_frame().T
-    std_length_df['doc'] = 'std'
-
-    length_df = pd.concat([length_df, mean_length_df, std_length_df])
-    length_df = length_df.round(3)
-    length_df.to_csv(os.path.join(dir_out, 'length_statistics.csv'), index=False)
-
-    # readability statistics
-    print('    ...readability statistics')
-    readability_df = pd.concat(readability_dfs, axis=0)
-    readability_df = readability_df.drop(columns=['__Dummy__']) if '__Dummy__' in readability_df.columns else readability_df
-    readability_df.insert(0, 'doc', infiles)
-
-    mean_readability_df = readability_df.mean().to_frame().T
-    mean_readability_df['doc'] = 'mean'
-
-    std_readability_df = readability_df.std().to_frame().T
-    std_readability_df['doc'] = 'std'
-
-    readability_df = pd.concat([readability_df, mean_readability_df, std_readability_df])
-    readability_df = readability_df.round(3)
-    readability_df.to_csv(os.path.join(dir_out, 'readability_statistics.csv'), index=False)
-
-    # lexical richness statistics
-    print('    ...lexical richness statistics')
-    lexical_richness_df = pd.concat(lexical_richness_dfs, axis=0)
-    lexical_richness_df = lexical_richness_df.drop(columns=['__Dummy__']) if '__Dummy__' in lexical_richness_df.columns else lexical_richness_df
-    lexical_richness_df.insert(0, 'doc', infiles)
-
-    mean_lexical_richness_df = lexical_richness_df.mean().to_frame().T
-    mean_lexical_richness_df['doc'] = 'mean'
-
-    std_lexical_richness_df = lexical_richness_df.std().to_frame().T
-    std_lexical_richness_df['doc'] = 'std'
-
-    lexical_richness_df = pd.concat([lexical_richness_df, mean_lexical_richness_df, std_lexical_richness_df])
-    lexical_richness_df = lexical_richness_df.round(3)
-    lexical_richness_df.to_csv(os.path.join(dir_out, 'lexical_richness_statistics.csv'), index=False)
-
-    # parsing results
-    parsing_df = pd.DataFrame(data={
-        'document': infiles,
-        'part-of-speech tags': pos_outputs,
-        'syntactic dependencies': dependency_outputs,
-    })
-    parsing_df.to_csv(os.path.join(dir_out, 'parsing_results.csv'), index=False)
-    
-    # distributions
-    print('    ...distributions')
-    for k in dist.keys():
-        distribution_dfs[k] = [df if not df.empty else pd.DataFrame([np.nan], columns=['__Empty__']) for df in distribution_dfs[k]] # when there is an empty dataframe, pd.concat ignores this leading to incongruencies in length
-        df = pd.concat(distribution_dfs[k], axis=0).fillna(0)
-        df = df.drop(columns=['__Dummy__']) if '__Dummy__' in df.columns else df
-        df = df.drop(columns=['__Empty__']) if '__Empty__' in df.columns else df          
-        df.insert(0, 'doc', infiles)
-        mean_df = df.mean().to_frame().T
-        std_df = df.std().to_frame().T
-        mean_df['doc'] = 'mean'
-        std_df['doc'] = 'std'
-        df = pd.concat([df, mean_df, std_df])
-        df = df.round(3)
-        df.to_csv(os.path.join(dir_out, f'{k}.csv'), index=False)
-        # visualizations
-        if k != 'function_word_distribution':
-            df.insert(0, 'source', ['input corpus']*len(df))
-            mean_df, std_df = visualizations.prepare_df(df, k, lang)
-            visualizations.generate_bar_chart(mean_df, std_df, k, dir_out)
+    visualization_mode = output_config.get('visualization_mode', 'separate').strip()
+    parsing_results_csv = bool(int(output_config.get('parsing_results_csv', '1')))
+    function_words = None
+    if vocabulary is not None:
+        with run_metrics.stage('vocabulary_sketch'):
+            vocabulary.write(dir_out)
+        if max_function_words:
+            function_words = vocabulary.top_function_words(max_function_words)
+    # the parameters, per-document results and corpus aggregates are added to the result store while they are
+    # aggregated, and the csv files of the statistics and distributions are written from the store
+    store_path = output_config.get('result_store', 'results.db').strip()
+    run_id = str(uuid.uuid4())
+    parameters = dict(input_config)
+    if input_config['input_format'].lower().strip() == 'huggingface':
+        parameters.update({f'huggingface {k}': v for k, v in huggingface_config.items()})
+        parameters['input'] = huggingface_config['dataset_name']
+    with pipeline.stored_run(store_path, run_id, parameters, dir_out) if store_path else nullcontext() as stored_run:
+        if spiller is not None:
+            try:
+                _, figures = pipeline.write_spilled_results(spiller, dir_out, lang, visualization_mode, run_metrics, parsing_results_csv, function_words, stored_run)
+            finally:
+                spiller.close()
+        else:
+            groups = [metadata[group_by][f] for f in infiles] if group_by else None
+            _, figures = pipeline.write_results(results, infiles, dir_out, lang, visualization_mode, run_metrics, parsing_results_csv, groups, group_by, outputs, function_words, stored_run)
+    if store_path:
+        print(f"Stored run {run_id} in {store_path}")
+    if growth is not None:
+        print('    ...vocabulary growth')
+        with run_metrics.stage('vocabulary_growth'):
+            figures.update(pipeline.write_vocabulary_growth(growth, dir_out, visualization_mode))
+    if trajectory_writer is not None:
+        print('    ...trajectories')
+        with run_metrics.stage('trajectories'):
+            figures.update(pipeline.write_trajectories(trajectory_writer, dir_out, visualization_mode))
+    if visualization_mode == 'dashboard' and (growth is not None or trajectory_writer is not None): # add their charts to the dashboard
+        with run_metrics.stage('visualizations'):
+            visualizations.generate_dashboard(figures, dir_out)
+    if sample_tolerance:
+        intervals.write(dir_out, len(results))
+
+    run_metrics.write(dir_out)
+    if profile:
+        profiler.write(dir_out)
+        print(profiler.report().round(3).to_string(index=False))
 
     print("Done!")
 
 #______________________________________________________________________________________________
 if __name__ == "__main__":
-    main() 
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the stylometry pipeline with the settings in config.ini.')
+    parser.add_argument('--profile', action='store_true', help='attribute time and allocations to the feature functions (profile_report.csv, profile.folded)')
+    args = parser.parse_args()
+    main(profile=args.profile)
@@ -1,15 +1,18 @@
-import os, shutil
-import util, visualizations, warnings
-from statistics import mean, stdev
+import os, shutil, time
+import util, pipeline, dedup, metrics, profiling, jobs, warnings
+from contextlib import nullcontext
 
 import pandas as pd
 import gradio as gr
-import spacy, pyphen
-from spacy.matcher import Matcher
-import numpy as np
 #______________________________________________________________________________________________
 stop_que = False
 
+# seconds between the partial results shown while a corpus is analyzed
+UPDATE_INTERVAL = float(os.environ.get('STYLOSCOPE_UPDATE_INTERVAL', '2'))
+
+# background jobs whose results are sent by email (see submit_job)
+JOBS = jobs.JobQueue(max_workers=int(os.environ.get('STYLOSCOPE_JOB_WORKERS', '1')))
+
 def stop_function():
     """
     Changes flag used to track whether to stop the pipeline to True.
@@ -19,7 +22,7 @@ def stop_function():
     print("Process cancelled by user!")
     return gr.update(visible=False), gr.update(visible=False)
 
-def main(
+def iter_pipeline(
     input_type, 
     fn, 
     dataset_name, 
@@ -31,13 +34,28 @@ def main(
     diversity_metric, 
     span_size, 
     unique_output_id,
-    error_or_canceled=True,
-    progress=gr.Progress(track_tqdm=True),
+    dedup_mode='Off',
+    profile=False,
+    progress=None,
+    should_stop=lambda: False,
+    update_interval=None,
     ):
 
-    global stop_que # flag for tracking if cancel button has been pressed
+    """
+    Runs the pipeline on an uploaded corpus or HuggingFace dataset and archives the output directory,
+    reporting partial results along the way.
+    Arguments:
+        input_type ... dedup_mode, profile: see main
+        progress: gr.Progress that tracks the analysis, or None (no progress bar)
+        should_stop: function that returns True when the run must be canceled
+        update_interval: seconds between partial results (None: no partial results)
+    Yields:
+        ('partial', (n documents analyzed, n documents, running statistics)) at most every update_interval seconds
+        (see pipeline.partial_results), then ('result', result) with result as returned by run_pipeline
+    """
 
-    progress(0, desc="Loading data...")    
+    if progress is not None:
+        progress(0, desc="Loading data...")    
     warnings.simplefilter(action='ignore', category=FutureWarning)
 
     # first check if directory where all outputs are stored exists
@@ -53,341 +71,133 @@ def main(
     os.mkdir(os.path.join(unique_dir_out, 'visualizations'))
 
     # check cancel flag
-    if stop_que:
-        stop_que = False
-        return (
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            error_or_canceled,
-        )
+    if should_stop():
+        yield 'result', None
+        return
 
 #LOAD_DATA_____________________________________________________________________________________
-    if input_type == 'Corpus':
-        format = 'csv' if fn[-3:] == 'csv' else 'zip'
-        if format == "zip":
-            column_name = 'text'
-        file_size = os.path.getsize(fn.name)
-        assert file_size < 1000000000 # ensure uploaded corpus is smaller than 1GB
-        print(file_size)
-        texts, infiles = util.load_data(format, fn, column_name, ',')
-    else: #Huggingface dataset
-        texts, infiles = util.load_huggingface(dataset_name, subset, split, column_name)
-
-    if stop_que:
-        stop_que = False
-        return (
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            gr.update(visible=False),
-            error_or_canceled
-        )
+    run_metrics = metrics.RunMetrics()
+    with run_metrics.stage('load_data'):
+        if input_type == 'Corpus':
+            format = 'csv' if fn[-3:] == 'csv' else 'zip'
+            if format == "zip":
+                column_name = 'text'
+            file_size = os.path.getsize(fn)
+            assert file_size < 1000000000 # ensure uploaded corpus is smaller than 1GB
+            print(file_size)
+            texts, infiles = util.load_data(format, fn, column_name, ',')
+        else: #Huggingface dataset
+            texts, infiles = util.load_huggingface(dataset_name, subset, split, column_name)
+    run_metrics.count('load_data', docs=len(texts))
+
+    if should_stop():
+        yield 'result', None
+        return
     
-#PREPARE_OUTPUT_DIR____________________________________________________________________________
-
-    length_dfs = []
-    lexical_richness_dfs = []
-    readability_dfs = []
-    distribution_dfs = {
-        'punctuation_distribution': [],
-        'function_word_distribution': [],
-        'pos_profile': [],
-        'dependency_profile': [],
-        'word_length_distribution': [],
-    }
-
-    pos_outputs = []
-    dependency_outputs = []
+#DEDUPLICATION_________________________________________________________________________________
+    with run_metrics.stage('deduplication'):
+        texts, infiles, duplicates_of = dedup.deduplicate(texts, infiles, dedup_mode.lower(), 0.9, unique_dir_out)
 
 #PREPROCESSING_________________________________________________________________________________
     
     # Determine language
-    if lang == 'Dutch':
-        nlp = spacy.load("nl_core_news_lg")
-        dic = pyphen.Pyphen(lang='nl_NL')
-    elif lang == 'English':
-        nlp = spacy.load("en_core_web_lg")
-        dic = pyphen.Pyphen(lang='en')
-    elif lang == 'French':
-        nlp = spacy.load("fr_core_news_lg")
-        dic = pyphen.Pyphen(lang='fr_FR')
-    else:
-        nlp = spacy.load("de_core_news_lg")
-        dic = pyphen.Pyphen(lang='de')
-    
-    # Initialize the SpaCy matcher with a vocab and passive rules
-    passive_rules = [
-        [{'DEP': 'nsubj:pass'}, {'DEP': 'aux:pass'}],
-        [{'DEP': 'aux:pass'}],
-        [{'DEP': 'nsubj:pass'}],
-    ]
-    matcher = Matcher(nlp.vocab)  
-    matcher.add('Passive',  passive_rules)
+    with run_metrics.stage('load_model'):
+        nlp, dic = pipeline.load_language(lang)
+        passive_labels = pipeline.get_passive_labels(nlp, lang)
 
-    print("Processing data...")
+    # in profile mode, time and allocations are attributed to the features
+    profiler = profiling.FeatureProfiler() if profile else None
 
-    for text in progress.tqdm(texts, unit='documents processed'): # Analyze text by text
-        if stop_que:
-            stop_que = False
-            return (
-                gr.update(visible=False),
-                gr.update(visible=False),
-                gr.update(visible=False),
-                gr.update(visible=False),
-                gr.update(visible=False),
-                gr.update(visible=False),
-                error_or_canceled
-            )
-
-
-        # check if text is empty
-        if not text.strip():
-            dummy_df = pd.DataFrame(data={'__Dummy__': ['dummy']}) # add dummy data to output
-            length_dfs.append(dummy_df)
-            lexical_richness_dfs.append(dummy_df)
-            readability_dfs.append(dummy_df)
-            for k in distribution_dfs.keys():
-                distribution_dfs[k].append(dummy_df)
-            continue # skip to the next text
+    print("Processing data...")
+    results = []
+    # partial results are computed from running statistics, updated with the documents analyzed since the last update;
+    # the wait between updates is stretched when they are slow, so they take at most ~10% of the analysis time
+    statistics = pipeline.running_statistics() if update_interval is not None else None
+    n_aggregated, last_update, wait = 0, time.monotonic(), update_interval
+    with profiler.profile() if profile else nullcontext():
+        for i, text in enumerate(progress.tqdm(texts, unit='documents processed') if progress is not None else texts): # Analyze text by text
+            if should_stop():
+                yield 'result', None
+                return
+
+            if i in duplicates_of: # exact duplicate: reuse the results of the first occurrence
+                results.append(results[duplicates_of[i]])
+            else:
+                results.append(pipeline.analyze_text(text, nlp, dic, passive_labels, diversity_metric, readability_metric, span_size, run_metrics, profiler=profiler))
+
+            if statistics is not None and time.monotonic() - last_update >= wait and i+1 < len(texts):
+                start, first = time.monotonic(), n_aggregated == 0
+                with run_metrics.stage('partial_results'):
+                    pipeline.update_running_statistics(statistics, results[n_aggregated:], infiles[n_aggregated:i+1])
+                n_aggregated = i+1
+                yield 'partial', (n_aggregated, len(texts), statistics)
+                last_update = time.monotonic()
+                if not first: # the first update also loads plotly and the reference corpora
+                    wait = max(update_interval, 9 * (last_update - start))
     
-        text = ' '.join(text.split()) # remove redundant whitespace
-
-        # tokenization, parsing, etc.
-        doc = nlp(text)
-        parsed_sentences = [[(w.text, w.pos_) for w in s] for s in doc.sents]
-        pos_tags = [w.pos_ for s in doc.sents for w in s]
-        dependencies = [w.dep_ for s in doc.sents for w in s if w.dep_]
-        tokenized_sentences = [[t for t, pos in s if pos not in {'PUNCT', 'SYM', 'X'}] for s in parsed_sentences]
-        tokens = [t for s in parsed_sentences for t, pos in s if pos not in {'PUNCT', 'SYM', 'X'}]
-        types = set([t.lower() for t in tokens])
-        syllables = [[util.get_n_syllables(t, dic) for t, pos in s if pos not in {'PUNCT', 'SYM', 'X'}] for s in parsed_sentences]
-
-        # store parsing results
-        pos_outputs.append(' '.join(pos_tags))
-        dependency_outputs.append(' '.join(dependencies))
-
-#LENGTH STATISTICS_____________________________________________________________________________
-
-        # check if text is empty (or contains only punctuation/symbols/other) -> skip
-        n_tokens = len(tokens)
-        n_char = len(text.replace(' ', ''))
-        n_syllables = sum([syl for sent in syllables for syl in sent])
-        n_polysyllabic = len([i for sent in syllables for i in sent if i > 1])
-        n_longer_than_6_char = len([t for t in tokens if len(t) > 6])
-        n_types = len(types)
-        n_sentences = len(list(doc.sents))
-
-        avg_char_per_word = mean([len(t) for t in tokens]) if n_tokens > 0 else 0
-        std_char_per_word = stdev([len(t) for t in tokens]) if n_tokens > 1 else 0
-
-        avg_syl_per_word = mean([s for sent in syllables for s in sent]) if n_tokens > 0  else 0
-        std_syl_per_word = stdev([s for sent in syllables for s in sent]) if n_tokens > 1 else 0
-
-        avg_words_per_sent = mean([len(s) for s in tokenized_sentences])
-        std_words_per_sent = stdev([len(s) for s in tokenized_sentences]) if n_sentences > 1 else 0
-
-        ratio_long_words = 0 if n_tokens == 0 else n_longer_than_6_char/n_tokens
-        ratio_content_words = util.ratio_content_words(doc)
-        ratio_passive_sentences = util.get_passive_ratio(doc, matcher)
-
-        stats = {
-        'n_characters': [n_char],
-        'n_syllables': [n_syllables],
-        'n_tokens': [n_tokens],
-        'n_polysyllabic_tokens': [n_polysyllabic],
-        'n_long_tokens': [n_longer_than_6_char],
-        'n_types': [n_types],
-        'n_sentences': [n_sentences],
-        'avg_characters_per_word': [avg_char_per_word],
-        'std_characters_per_word': [std_char_per_word],
-        'avg_syllables_per_word': [avg_syl_per_word],
-        'std_syllables_per_word': [std_syl_per_word],
-        'ratio_long_words': [ratio_long_words],
-        'ratio_content_words': [ratio_content_words],
-        'ratio_passive_sentences': [ratio_passive_sentences],
-        'avg_words_per_sentence': [avg_words_per_sent],
-        'std_words_per_sentence': [std_words_per_sent],
+#WRITE RESULTS TO OUTPUT_______________________________________________________________________
+    print("Aggregating results, creating visualizations, and saving raw results...")
+    if progress is not None:
+        progress(1, desc="Aggregating data. Please wait...")
+
+    # the run is added to the result store of the app (STYLOSCOPE_RESULT_STORE, empty: off) while its results are
+    # aggregated, and the csv files of the statistics and distributions are written from the store
+    store_path = os.environ.get('STYLOSCOPE_RESULT_STORE', os.path.join(main_dir_out, 'results.db'))
+    parameters = {
+        'input': fn if input_type == 'Corpus' else dataset_name,
+        'input_type': input_type,
+        'subset': subset,
+        'split': split,
+        'text_column': column_name,
+        'language': lang,
+        'readability metric': readability_metric,
+        'lexical diversity metric': diversity_metric,
+        'STTR span size': span_size,
+        'deduplication': dedup_mode,
         }
+    with pipeline.stored_run(store_path, unique_output_id, parameters, unique_dir_out) if store_path else nullcontext() as stored_run:
+        outputs, figures = pipeline.write_results(results, infiles, unique_dir_out, lang, run_metrics=run_metrics, stored_run=stored_run)
 
-        length_df = pd.DataFrame(data=stats)
-        length_dfs.append(length_df)
-
-
-#LEXICAL DIVERSITY______________________________________________________________________________
-        if diversity_metric == 'TTR':
-            score = util.ttr(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'RTTR':
-            score = util.rttr(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'CTTR':
-            score = util.cttr(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'STTR':
-            score = util.sttr(tokens, int(span_size)) if n_tokens != 0 else None
-        elif diversity_metric == 'Herdan':
-            score = util.Herdan(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'Summer':
-            score = util.Summer(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'Dugast':
-            score = util.Dugast(n_types, n_tokens) if n_tokens != 0 else None
-        elif diversity_metric == 'Maas':
-            score = util.Maas(n_types, n_tokens) if n_tokens != 0 else None
-        else:
-            ValueError('Please provide one of the following lexical diversity metrics: "TTR", "RTTR", "CTTR", "STTR", "Herdan", "Summer", "Dugast", "Maas"')
+    run_metrics.write(unique_dir_out)
+    if profile:
+        profiler.write(unique_dir_out)
+    with run_metrics.stage('make_archive'):
+        archive = shutil.make_archive(base_name=os.path.join(unique_dir_out), format='zip', base_dir=unique_dir_out)
+    metrics.TOTALS.add_stage('make_archive', run_metrics.stages['make_archive'])
 
-        lr = {
-        'score': [score],
-        }
+    yield 'result', (archive, outputs, figures)
 
-        lexical_richness_dfs.append(pd.DataFrame(data=lr))
-
-#READABILITY___________________________________________________________________________________
-        if readability_metric == 'ARI':
-            score = util.ARI(n_char, n_tokens, n_sentences) if n_tokens != 0 else None
-        elif readability_metric == 'Coleman-Liau':
-            score = util.ColemanLiau(tokens, tokenized_sentences) if n_tokens != 0 else None
-        elif readability_metric == 'Flesch reading ease':
-            score = util.Flesch(avg_words_per_sent, avg_syl_per_word) if n_tokens != 0 else None
-        elif readability_metric == 'Flesch Kincaid grade level':
-            score = util.Kincaid(avg_words_per_sent, avg_syl_per_word) if n_tokens != 0 else None
-        elif readability_metric == 'Gunning Fog':
-            score = util.Fog(avg_words_per_sent, syllables) if n_tokens != 0 else None
-        if readability_metric == 'SMOG':
-            score = util.SMOG(syllables) if n_tokens != 0 else None
-        elif readability_metric == 'LIX':
-            score = util.LIX(n_tokens, n_sentences, n_longer_than_6_char) if n_tokens != 0 else None
-        elif readability_metric == 'RIX':
-            score = util.RIX(n_longer_than_6_char, n_sentences) if n_tokens != 0 else None
-        else:
-            ValueError('Please provide one of the following metrics: "ARI", "Coleman-Liau", "Flesch reading ease", "Flesch Kincaid grade level", "Gunning Fog", "SMOG", "LIX", "RIX".')
+def run_pipeline(*args, **kwargs):
 
-        interpretation = util.interpret_readability(score, readability_metric)
+    """
+    Runs the pipeline on an uploaded corpus or HuggingFace dataset and archives the output directory.
+    Shared by the interactive app (main) and background jobs (see jobs.py).
+    Arguments:
+        see iter_pipeline
+    Returns:
+        path of the zip archive, {output name: pd.DataFrame}, {distribution name: plotly Figure},
+        or None if the run was canceled
+    """
 
-        readability = {
-            'score': [score],
-            'interpretation': [interpretation]
-        }
+    for event, value in iter_pipeline(*args, **kwargs):
+        if event == 'result':
+            return value
 
-        readability_dfs.append(pd.DataFrame(data=readability))
-
-#DISTRIBUTIONS_________________________________________________________________________________ 
-        punct_dist = util.get_punct_dist(text)
-        function_word_distribution = util.get_function_word_distribution(doc)
-        pos_profile = util.get_ngram_profile(pos_tags)
-        dependency_profile = util.get_dependency_distribution(dependencies)
-        word_length_distribution = util.get_word_length_distribution(tokens)
-        
-        dist = {
-            'punctuation_distribution': punct_dist,
-            'function_word_distribution': function_word_distribution,
-            'pos_profile': pos_profile,
-            'dependency_profile': dependency_profile,
-            'word_length_distribution': word_length_distribution,
-        }
+def basic_statistics_table(outputs):
 
-        for dist_name in dist.keys():
-            df = pd.DataFrame(data=dist[dist_name])
-            distribution_dfs[dist_name] = distribution_dfs[dist_name] + [df]
-    
-#WRITE RESULTS TO OUTPUT_______________________________________________________________________
-    print("Aggregating results, creating visualizations, and saving raw results...")
-    progress(1, desc="Aggregating data. Please wait...")
-
-    # length statistics
-    print('    ...length statistics')
-    length_df = pd.concat(length_dfs, axis=0)
-    length_df = length_df.drop(columns=['__Dummy__']) if '__Dummy__' in length_df.columns else length_df
-    length_df.insert(0, 'doc', infiles)
-
-    mean_length_df = length_df.mean().to_frame().T
-    mean_length_df['doc'] = 'mean'
-
-    std_length_df = length_df.std().to_frame().T
-    std_length_df['doc'] = 'std'
-
-    length_df = pd.concat([length_df, mean_length_df, std_length_df])
-    length_df = length_df.round(3)
-    length_df.to_csv(os.path.join(unique_dir_out, 'length_statistics.csv'), index=False)
-
-    # readability statistics
-    print('    ...readability statistics')
-    readability_df = pd.concat(readability_dfs, axis=0)
-    readability_df = readability_df.drop(columns=['__Dummy__']) if '__Dummy__' in readability_df.columns else readability_df
-    readability_df.insert(0, 'doc', infiles)
-
-    mean_readability_df = readability_df.mean().to_frame().T
-    mean_readability_df['doc'] = 'mean'
-    mean_readability_df = mean_readability_df.round(3)
-
-    std_readability_df = readability_df.std().to_frame().T
-    std_readability_df['doc'] = 'std'
-    std_readability_df = std_readability_df.round(3)
-
-    readability_df = pd.concat([readability_df, mean_readability_df, std_readability_df])
-    readability_df.to_csv(os.path.join(unique_dir_out, 'readability_statistics.csv'), index=False)
-
-    # lexical richness statistics
-    print('    ...lexical richness statistics')
-    lexical_richness_df = pd.concat(lexical_richness_dfs, axis=0)
-    lexical_richness_df = lexical_richness_df.drop(columns=['__Dummy__']) if '__Dummy__' in lexical_richness_df.columns else lexical_richness_df
-    lexical_richness_df.insert(0, 'doc', infiles)
-
-    mean_lexical_richness_df = lexical_richness_df.mean().to_frame().T
-    mean_lexical_richness_df['doc'] = 'mean'
-    mean_lexical_richness_df = mean_lexical_richness_df.round(3)
-
-    std_lexical_richness_df = lexical_richness_df.std().to_frame().T
-    std_lexical_richness_df['doc'] = 'std'
-    std_lexical_richness_df = std_lexical_richness_df.round(3)
-
-    lexical_richness_df = pd.concat([lexical_richness_df, mean_lexical_richness_df, std_lexical_richness_df])
-    lexical_richness_df.to_csv(os.path.join(unique_dir_out, 'lexical_richness_statistics.csv'), index=False)
-
-    # parsing results
-    parsing_df = pd.DataFrame(data={
-        'document': infiles,
-        'part-of-speech tags': pos_outputs,
-        'syntactic dependencies': dependency_outputs,
-    })
-    parsing_df.to_csv(os.path.join(unique_dir_out, 'parsing_results.csv'), index=False)
-    
-    # distributions
-    print('    ...distributions')
-    for k in dist.keys():
-        distribution_dfs[k] = [df if not df.empty else pd.DataFrame([np.nan], columns=['__Empty__']) for df in distribution_dfs[k]] # when there is an empty dataframe, pd.concat ignores this leading to incongruencies in length
-        df = pd.concat(distribution_dfs[k], axis=0).fillna(0)
-        df = df.drop(columns=['__Dummy__']) if '__Dummy__' in df.columns else df
-        df = df.drop(columns=['__Empty__']) if '__Empty__' in df.columns else df          
-        df.insert(0, 'doc', infiles)
-        mean_df = df.mean().to_frame().T
-        std_df = df.std().to_frame().T
-        mean_df['doc'] = 'mean'
-        std_df['doc'] = 'std'
-        df = pd.concat([df, mean_df, std_df])
-        df = df.round(3)
-        df.to_csv(os.path.join(unique_dir_out, f'{k}.csv'), index=False)
-        
-        # visualizations
-        if k != 'function_word_distribution':
-            df.insert(0, 'source', ['input corpus']*len(df))
-            mean_df, std_df = visualizations.prepare_df(df, k, lang)
-            plt = visualizations.generate_bar_chart(mean_df, std_df, k, unique_dir_out)
-            if k == 'punctuation_distribution':
-                punct_plot = plt 
-            elif k == 'dependency_profile':
-                dep_plot = plt 
-            elif k == 'pos_profile':
-                pos_plot = plt 
-            elif k == 'word_length_distribution':
-                len_plot = plt
-            else:
-                pass
+    """
+    Table of the corpus mean and std of the main statistics.
+    Arguments:
+        outputs: {output name: pd.DataFrame whose last two rows are the mean and std} (at least the statistics)
+    Returns:
+        pd.DataFrame
+    """
 
-    basic_statistics = pd.DataFrame(data={
+    length_df = outputs['length_statistics']
+    lexical_richness_df = outputs['lexical_richness_statistics']
+    readability_df = outputs['readability_statistics']
+
+    return pd.DataFrame(data={
         'Corpus statistics': ['n Tokens', 'n Sentences', 'n Syllables', 'n Characters', 'Lexical diversity', 'Readability'],
         'Mean': [
             length_df.iloc[-2]['n_tokens'],
@@ -407,15 +217,127 @@ def main(
             ]
     })
 
+def main(
+    input_type, 
+    fn, 
+    dataset_name, 
+    subset, 
+    split, 
+    column_name, 
+    lang, 
+    readability_metric, 
+    diversity_metric, 
+    span_size, 
+    unique_output_id,
+    dedup_mode='Off',
+    profile=False,
+    error_or_canceled=True,
+    progress=gr.Progress(track_tqdm=True),
+    ):
+
+    def should_stop():
+        global stop_que # flag for tracking if cancel button has been pressed
+        if stop_que:
+            stop_que = False
+            return True
+        return False
+
+    # the statistics and charts are shown while the corpus is analyzed, updated every UPDATE_INTERVAL seconds
+    events = iter_pipeline(
+        input_type, fn, dataset_name, subset, split, column_name, lang, readability_metric, diversity_metric, span_size,
+        unique_output_id, dedup_mode, profile, progress, should_stop, UPDATE_INTERVAL,
+        )
+    for event, value in events:
+        if event == 'partial':
+            n_analyzed, n_docs, statistics = value
+            summaries, figures = pipeline.partial_results(statistics, lang)
+            yield (
+                gr.update(),
+                gr.update(value=basic_statistics_table(summaries), label=f'Corpus statistics ({n_analyzed} of {n_docs} documents analyzed)', visible=True),
+                gr.update(value=figures['dependency_profile'], visible=True),
+                gr.update(value=figures['pos_profile'], visible=True),
+                gr.update(value=figures['punctuation_distribution'], visible=True),
+                gr.update(value=figures['word_length_distribution'], visible=True),
+                gr.update(),
+            )
+        else:
+            result = value
+
+    if result is None: # canceled
+        yield (
+            gr.update(visible=False),
+            gr.update(visible=False),
+            gr.update(visible=False),
+            gr.update(visible=False),
+            gr.update(visible=False),
+            gr.update(visible=False),
+            error_or_canceled,
+        )
+        return
+    archive, outputs, figures = result
+
     progress(1, desc="Done!")
     error_or_canceled='' # False when cast to boolean
 
-    return (
-        shutil.make_archive(base_name=os.path.join(unique_dir_out), format='zip', base_dir=unique_dir_out),
-        basic_statistics,
-        dep_plot,
-        pos_plot,
-        punct_plot,
-        len_plot,
+    yield (
+        archive,
+        gr.update(value=basic_statistics_table(outputs), label='Corpus statistics'),
+        figures['dependency_profile'],
+        figures['pos_profile'],
+        figures['punctuation_distribution'],
+        figures['word_length_distribution'],
         error_or_canceled
-    )
\ No newline at end of file
+    )
+
+def run_job(staged_dir, *args):
+    """
+    Runs the pipeline as a background job and returns the path of the output archive
+    (the uploaded input that was staged for the job is removed afterwards).
+    """
+    try:
+        return run_pipeline(*args)[0]
+    finally:
+        if staged_dir is not None:
+            shutil.rmtree(staged_dir, ignore_errors=True)
+
+def submit_job(
+    input_type, 
+    fn, 
+    dataset_name, 
+    subset, 
+    split, 
+    column_name, 
+    lang, 
+    readability_metric, 
+    diversity_metric, 
+    span_size, 
+    unique_output_id,
+    dedup_mode='Off',
+    profile=False,
+    email='',
+    ):
+
+    """
+    Queues a run in the background and returns immediately: the results are emailed when the run has finished,
+    so the browser does not have to stay open. Arguments as in main, plus the email address of the recipient.
+    Returns:
+        gr.update of the job status message
+    """
+
+    email = email.strip()
+    if '@' not in email:
+        return gr.update(value='Please provide a valid email address.', visible=True)
+    if input_type == 'Corpus' and not fn:
+        return gr.update(value='Please upload a corpus.', visible=True)
+
+    staged_dir = None
+    if input_type == 'Corpus': # uploaded files are copied, so they are still available when the job starts
+        staged_dir = os.path.join('jobs', unique_output_id)
+        fn = jobs.stage_input(fn, staged_dir)
+
+    JOBS.submit(
+        unique_output_id, email, run_job, staged_dir,
+        input_type, fn, dataset_name, subset, split, column_name, lang, readability_metric, diversity_metric, span_size,
+        unique_output_id, dedup_mode, profile,
+        )
+    return gr.update(value=f'Run {unique_output_id} was queued. The results will be sent to {email} when it has finished, you can close this page.', visible=True)
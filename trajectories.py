@@ -0,0 +1,199 @@
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import util, features, parse_store
+
+# parts of speech of the words (tokens that are not punctuation, symbols or other, see features.NON_WORDS)
+POS_TAGS = [t for t in parse_store.UPOS if t not in features.NON_WORDS]
+
+# window values that are lists (sliced from the document for every window, and only if the selected metrics need them:
+# their cost is O(windows x window_size)), the others are counts that are updated incrementally from one window to the next
+SEQUENCES = {'tokens', 'tokenized_sentences', 'syllables'}
+
+COLUMNS = ['window', 'start', 'end', 'position', 'n_tokens', 'lexical_diversity', 'readability'] + [f'pos_{t}' for t in POS_TAGS]
+
+def window_starts(n_tokens, window_size, window_step):
+    """
+    First token of every window. Windows advance by window_step tokens (tumbling windows if it equals window_size,
+    sliding windows if it is smaller), and the last window ends at the end of the document, so every token is covered.
+    """
+    if not n_tokens:
+        return []
+    if n_tokens <= window_size:
+        return [0]
+    starts = list(range(0, n_tokens - window_size + 1, window_step))
+    if starts[-1] + window_size < n_tokens:
+        starts.append(n_tokens - window_size)
+    return starts
+
+def window_sequences(names, tokens, syllables, sentence_ids, start, end):
+    """
+    The sequence values in names (see SEQUENCES) of the window [start, end): only these are sliced from the document.
+    """
+    values = {}
+    if 'tokens' in names:
+        values['tokens'] = tokens[start:end]
+    if names & {'tokenized_sentences', 'syllables'}:
+        bounds = [start] + (np.flatnonzero(np.diff(sentence_ids[start:end])) + start + 1).tolist() + [end]
+        for name, sequence in [('tokenized_sentences', tokens), ('syllables', syllables)]:
+            if name in names:
+                values[name] = [sequence[a:b] for a, b in zip(bounds, bounds[1:])]
+    return values
+
+def metric_inputs(diversity_metric, readability_metric):
+    """
+    The window values the metrics are computed from (see features.DIVERSITY_METRICS and features.READABILITY_METRICS).
+    """
+    settings = {'diversity_metric': diversity_metric, 'readability_metric': readability_metric}
+    return features.diversity_inputs(settings)[2:], features.readability_inputs(settings)[2:]
+
+def trajectory_inputs(settings):
+    diversity, readability = metric_inputs(settings['diversity_metric'], settings['readability_metric'])
+    inputs = ['parsed_sentences', 'diversity_metric', 'readability_metric', 'span_size', 'window_size', 'window_step']
+    if {'syllables', 'avg_syllables_per_word'} & set(diversity + readability): # syllabification only when a metric needs it
+        inputs.append('syllables')
+    return inputs
+
+@features.feature('trajectory', trajectory_inputs, stage='trajectories')
+def trajectory(parsed_sentences, diversity_metric, readability_metric, span_size, window_size, window_step, syllables=None):
+
+    """
+    The lexical diversity, readability and part-of-speech mix of every window of a document.
+    The counts of a window (tokens, types, characters, long tokens, syllables, sentences and parts of speech) are
+    updated incrementally from the previous window: from prefix sums, and for the types by adding the tokens that
+    enter the window and removing those that leave it, so the metrics that are computed from counts cost O(n_tokens)
+    in total. Metrics that are defined on the token or sentence sequence (STTR, Coleman-Liau, Gunning Fog, SMOG) are
+    computed on the slice of the document in the window (only the sequences they need are sliced), so they cost
+    O(windows x window_size): with a small window_step, they dominate. Sentences that are partly in a window count as
+    sentences of the window.
+    Arguments:
+        parsed_sentences, syllables: see features
+        diversity_metric, readability_metric, span_size: see pipeline.analyze_text
+        window_size: number of tokens (words) per window
+        window_step: number of tokens between the starts of consecutive windows
+    Returns:
+        pd.DataFrame with one row per window: window (number), start and end (token offsets, end exclusive),
+        position (relative position of the middle of the window in the document), n_tokens, lexical_diversity,
+        readability, and the share of every part of speech (pos_<tag>)
+    """
+
+    sentences = [[(t, pos) for t, pos in s if pos not in features.NON_WORDS] for s in parsed_sentences]
+    sentences = [s for s in sentences if s]
+    tokens = [t for s in sentences for t, _ in s]
+    n = len(tokens)
+    starts = window_starts(n, window_size, window_step)
+    if not starts:
+        return pd.DataFrame(columns=COLUMNS)
+
+    sentence_ids = np.repeat(np.arange(len(sentences)), [len(s) for s in sentences])
+    syllables = [s for sent in syllables for s in sent] if syllables is not None else [0] * n
+    lengths = np.array([len(t) for t in tokens])
+    prefix = {k: np.concatenate([[0], np.cumsum(v)]) for k, v in [('n_characters', lengths), ('n_long_tokens', lengths > 6), ('n_syllables', syllables)]}
+    tag_ids = {t: j for j, t in enumerate(POS_TAGS)}
+    pos = np.zeros((n + 1, len(POS_TAGS)), dtype=np.int64)
+    for i, tag in enumerate(tag for s in sentences for _, tag in s):
+        if tag in tag_ids:
+            pos[i+1, tag_ids[tag]] = 1
+    pos = np.cumsum(pos, axis=0)
+
+    diversity_inputs, readability_inputs = metric_inputs(diversity_metric, readability_metric)
+    sequences = SEQUENCES & set(diversity_inputs + readability_inputs)
+    diversity_function = getattr(util, features.DIVERSITY_METRICS[diversity_metric][0])
+    readability_function = getattr(util, features.READABILITY_METRICS[readability_metric][0])
+
+    # counts of all windows at once, from the prefix sums
+    starts = np.array(starts)
+    ends = np.minimum(starts + window_size, n)
+    counts = {k: (v[ends] - v[starts]).tolist() for k, v in prefix.items()}
+    counts['n_tokens'] = (ends - starts).tolist()
+    counts['n_sentences'] = (sentence_ids[ends-1] - sentence_ids[starts] + 1).tolist()
+    pos_shares = (pos[ends] - pos[starts]) / (ends - starts)[:, None]
+
+    lowercased = [t.lower() for t in tokens]
+    types = Counter()
+    diversity, readability = [], []
+    previous_start, previous_end = 0, 0
+    for w, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        # incremental update of the types: remove the tokens that left the window, add those that entered it
+        if start >= previous_end:
+            types = Counter(lowercased[start:end])
+        else:
+            for t in lowercased[previous_start:start]:
+                types[t] -= 1
+                if not types[t]:
+                    del types[t]
+            types.update(lowercased[previous_end:end])
+        previous_start, previous_end = start, end
+
+        window = {k: v[w] for k, v in counts.items()}
+        window['n_types'] = len(types)
+        window['span_size'] = int(span_size)
+        window['avg_words_per_sentence'] = window['n_tokens'] / window['n_sentences']
+        window['avg_syllables_per_word'] = window['n_syllables'] / window['n_tokens']
+        if sequences:
+            window.update(window_sequences(sequences, tokens, syllables, sentence_ids, start, end))
+        diversity.append(diversity_function(*[window[i] for i in diversity_inputs]))
+        readability.append(readability_function(*[window[i] for i in readability_inputs]))
+
+    return pd.DataFrame({
+        'window': np.arange(len(starts)),
+        'start': starts,
+        'end': ends,
+        'position': (starts + ends) / 2 / n,
+        'n_tokens': ends - starts,
+        'lexical_diversity': diversity,
+        'readability': readability,
+        **dict(zip(COLUMNS[7:], pos_shares.T)),
+        })
+
+class TrajectoryWriter:
+
+    """
+    Writes the windows of every document to trajectories.csv as they are analyzed, in batches of at most
+    batch_size windows (so that memory does not grow with the corpus), and keeps the trajectories of the first
+    max_charted documents for the chart.
+    """
+
+    def __init__(self, dir_out, max_charted=10, batch_size=10000):
+        self.path = os.path.join(dir_out, 'trajectories.csv')
+        self.max_charted = max_charted
+        self.batch_size = batch_size
+        self.batch = [] # [(doc, windows)]
+        self.n_batched = 0
+        self.charted = []
+        self.first = True
+
+    @staticmethod
+    def combine(batch):
+        if not batch:
+            return pd.DataFrame(columns=['doc'] + COLUMNS)
+        df = pd.concat([df for _, df in batch], ignore_index=True)
+        df.insert(0, 'doc', np.repeat([doc for doc, _ in batch], [len(df) for _, df in batch]))
+        return df
+
+    def add(self, doc, df):
+        if df.empty:
+            return
+        self.batch.append((doc, df))
+        self.n_batched += len(df)
+        if len(self.charted) < self.max_charted:
+            self.charted.append((doc, df))
+        if self.n_batched >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch and not self.first:
+            return
+        self.combine(self.batch).round(3).to_csv(self.path, mode='w' if self.first else 'a', header=self.first, index=False)
+        self.batch, self.n_batched, self.first = [], 0, False
+
+    def close(self):
+        """
+        Writes the remaining windows.
+        Returns:
+            pd.DataFrame with the windows of the charted documents
+        """
+        self.flush()
+        return self.combine(self.charted)
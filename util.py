@@ -1,16 +1,31 @@
 from math import log, sqrt, floor
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from statistics import mean
 from string import punctuation
-import operator, zipfile, os
-from datasets import load_dataset
-from datasets.utils.logging import disable_progress_bar
-from sklearn.feature_extraction.text import CountVectorizer
+import operator, zipfile, gzip, posixpath
+import numpy as np
 import pandas as pd
 
-import smtplib 
+def open_huggingface(dataset_name, subset, split):
+	"""
+	Opens a dataset (or, without a split, all splits) with the HuggingFace datasets library.
+	"""
+
+	# the datasets library is slow to import, so it is only loaded when a HuggingFace dataset is used
+	from datasets import load_dataset
+	from datasets.utils.logging import disable_progress_bar
+	disable_progress_bar()
 
-disable_progress_bar()
+	if subset.strip() and split.strip():
+		return load_dataset(dataset_name, subset, split=split)
+	elif subset.strip() and not split.strip():
+		return load_dataset(dataset_name, subset)
+	elif not subset.strip() and split.strip():
+		return load_dataset(dataset_name, split=split)
+	else: # not subset.strip() and not split.strip()
+		return load_dataset(dataset_name)
 
 def load_huggingface(dataset_name, subset, split, column_name):
 	"""
@@ -25,18 +40,8 @@ def load_huggingface(dataset_name, subset, split, column_name):
 		infiles: doc indices
 	"""
 
-    # Load dataset
-	if subset.strip() and split.strip():
-		dataset = load_dataset(dataset_name, subset, split=split)
-	elif subset.strip() and not split.strip():
-		dataset = load_dataset(dataset_name, subset)
-	elif not subset.strip() and split.strip():
-		dataset = load_dataset(dataset_name, split=split)
-	else: # not subset.strip() and not split.strip()
-		dataset = load_dataset(dataset_name)
-
 	# Convert to DataFrame
-	df = pd.DataFrame(dataset)
+	df = pd.DataFrame(open_huggingface(dataset_name, subset, split))
 	
 	# prepare output
 	texts = df[column_name].tolist()
@@ -44,47 +49,301 @@ def load_huggingface(dataset_name, subset, split, column_name):
 
 	return texts, infiles
 
-def load_data(input_format, input_dir, text_column=None, delimiter=None):
+# encodings tried, in order, for the text files of a zip folder that are not valid UTF-8 (see decode_text)
+FALLBACK_ENCODINGS = ['cp1252', 'latin-1']
+
+def decode_text(data, encodings=FALLBACK_ENCODINGS):
+	"""
+	Decodes a text file as UTF-8, else with the first fallback encoding that can decode it.
+	Arguments:
+		data: bytes
+		encodings: fallback encodings, 'detect' guesses the encoding with charset_normalizer
+	Returns:
+		text, and the encoding that was used (None if none could decode the text, which is then decoded as UTF-8
+		with replacement characters)
+	"""
+	for encoding in ['utf-8'] + list(encodings):
+		if encoding == 'detect':
+			from charset_normalizer import from_bytes # only needed for detection
+			match = from_bytes(data).best()
+			if match is None:
+				continue
+			encoding = match.encoding
+		try:
+			return data.decode(encoding), encoding
+		except UnicodeDecodeError:
+			continue
+	return data.decode('utf-8', errors='replace'), None
+
+def zip_members(zip_file):
+	"""
+	The text files (.txt, or gzipped .txt.gz) of a zip folder, also in nested folders, sorted by name.
+	The name of a file is its path in the folder that contains all text files, e.g. its file name if they are all in
+	the same folder. Files of the resource forks that macOS adds to zip folders are left out.
+	Returns:
+		[(zipfile.ZipInfo, name)]
+	"""
+	members = [
+		f for f in zip_file.infolist()
+		if f.filename.endswith(('.txt', '.txt.gz')) and not f.is_dir()
+		and not f.filename.startswith('__MACOSX/') and not posixpath.basename(f.filename).startswith('._')
+		]
+	if not members:
+		return []
+	root = posixpath.commonpath([posixpath.dirname(f.filename) for f in members])
+	return sorted(((f, f.filename[len(root)+1:] if root else f.filename) for f in members), key=lambda m: m[1])
+
+def read_member(zip_file, member, encodings=FALLBACK_ENCODINGS):
+	"""
+	Decompresses and decodes one text file of a zip folder (see decode_text).
+	"""
+	with zip_file.open(member) as f:
+		data = f.read()
+	if member.filename.endswith('.gz'):
+		data = gzip.decompress(data)
+	return decode_text(data, encodings)
+
+def read_zip(input_dir, encodings=FALLBACK_ENCODINGS, n_threads=4):
+	"""
+	Reads the text files of a zip folder in order of name (see zip_members). The files are decompressed and decoded
+	in n_threads threads, at most 2*n_threads files ahead of the caller, so memory does not grow with the folder.
+	The files that are not valid UTF-8 are reported at the end.
+	Arguments:
+		input_dir: path of the zip folder
+		encodings: see decode_text
+		n_threads: number of threads
+	Yields:
+		(text, name)
+	"""
+	decoded_as = {} # {encoding: names} of the files that were not decoded as UTF-8
+	with zipfile.ZipFile(input_dir, 'r') as zip_file, ThreadPoolExecutor(max(n_threads, 1)) as executor:
+		members = iter(zip_members(zip_file))
+		pending = deque()
+		try:
+			while True:
+				for member, name in islice(members, 2*max(n_threads, 1) - len(pending)):
+					pending.append((executor.submit(read_member, zip_file, member, encodings), name))
+				if not pending:
+					break
+				future, name = pending.popleft()
+				text, encoding = future.result()
+				if encoding != 'utf-8':
+					decoded_as.setdefault(encoding, []).append(name)
+				yield text, name
+		finally:
+			executor.shutdown(cancel_futures=True)
+	report_decoding(decoded_as)
+
+def report_decoding(decoded_as):
+	"""
+	Reports the text files that were not decoded as UTF-8 ({encoding: names}, see decode_text).
+	"""
+	for encoding, names in decoded_as.items():
+		files = ', '.join(names[:5]) + (f' and {len(names)-5} more' if len(names) > 5 else '')
+		if encoding is None:
+			print(f"Could not decode {len(names)} files, invalid characters were replaced: {files}")
+		else:
+			print(f"Decoded {len(names)} files as {encoding}: {files}")
+
+def load_data(input_format, input_dir, text_column=None, delimiter=None, encodings=FALLBACK_ENCODINGS, n_threads=4):
 
 	"""
 	Load the dataset.
 	Arguments:
-		input_format: input format specified in the config file (csv or zip),
+		input_format: input format specified in the config file (csv, parquet or zip),
 		input_dir: input directory specified in the config file,
-		text_column: if input_format==csv, column name containing texts,
-		delimiter: if input_format==csv, delimiter for reading the csv file.
+		text_column: if input_format==csv or parquet, column name containing texts,
+		delimiter: if input_format==csv, delimiter for reading the csv file,
+		encodings: if input_format==zip, encodings tried for files that are not UTF-8 (see decode_text),
+		n_threads: if input_format==zip, number of threads that decompress and decode the files.
 	Returns:
 		texts: list of strings,
 		infiles: doc indices
 	"""
 
 	if input_format == 'zip': # zip folder with txt
-		filenames = []
-		texts = []
-
-		with zipfile.ZipFile(input_dir, 'r') as zip_file:
-			for file_info in zip_file.infolist():
-				if file_info.filename.endswith('.txt'):
-					filename = os.path.basename(file_info.filename)
-					with zip_file.open(file_info) as txt_file:
-						text = txt_file.read().decode('utf-8')  # Assuming UTF-8 encoding
-						texts.append(text)
-						filenames.append(filename)
-
-		df = pd.DataFrame(data={'filename': filenames, 'text': texts})
-		df = df.sort_values('filename')
-		texts = list(df.text)
-		infiles = list(df.filename) 
+		documents = list(read_zip(input_dir, encodings, n_threads))
+		texts = [text for text, _ in documents]
+		infiles = [name for _, name in documents]
 	
 	elif input_format == 'csv': 
 		df = pd.read_csv(input_dir, delimiter=delimiter)
 		texts = list(df[text_column])
 		infiles = list(df.index)
+
+	elif input_format == 'parquet':
+		df = pd.read_parquet(input_dir, columns=[text_column])
+		texts = list(df[text_column])
+		infiles = list(range(len(df)))
 	
 	else: # directory of txt files
-		raise ValueError("Input type must be 'csv' or 'zip'.")
+		raise ValueError("Input type must be 'csv', 'parquet' or 'zip'.")
 
 	return texts, infiles
+
+def document_ids(input_format, input_dir, text_column=None, delimiter=None, chunk_size=10000):
+
+	"""
+	The doc indices of load_data, without loading the texts (e.g. to draw a sample before any text is loaded).
+	Arguments:
+		input_format, input_dir, text_column, delimiter: see load_data,
+		chunk_size: if input_format==csv, number of rows parsed at once (the rows are counted, the texts are not kept).
+	Returns:
+		infiles: doc indices
+	"""
+
+	if input_format == 'zip':
+		with zipfile.ZipFile(input_dir, 'r') as zip_file:
+			return [name for _, name in zip_members(zip_file)]
+	elif input_format == 'csv':
+		return list(range(sum(len(chunk) for chunk in pd.read_csv(input_dir, delimiter=delimiter, usecols=[text_column], chunksize=chunk_size))))
+	elif input_format == 'parquet':
+		import pyarrow.parquet as pq
+		return list(range(pq.ParquetFile(input_dir).metadata.num_rows))
+	raise ValueError("Input type must be 'csv', 'parquet' or 'zip'.")
+
+def load_documents(input_format, input_dir, ids, text_column=None, delimiter=None, encodings=FALLBACK_ENCODINGS, n_threads=4, chunk_size=10000):
+
+	"""
+	Loads the texts of some documents: zip files by name, parquet files by row group, csv files in one pass
+	that only keeps the requested rows.
+	Arguments:
+		input_format, input_dir, text_column, delimiter, encodings, n_threads: see load_data,
+		ids: doc indices (see document_ids),
+		chunk_size: if input_format==csv, number of rows parsed at once.
+	Returns:
+		texts: list of strings, in the order of ids
+	"""
+
+	if input_format == 'zip':
+		decoded_as = {}
+		with zipfile.ZipFile(input_dir, 'r') as zip_file, ThreadPoolExecutor(max(n_threads, 1)) as executor:
+			members = {name: member for member, name in zip_members(zip_file)}
+			decoded = list(executor.map(lambda name: read_member(zip_file, members[name], encodings), ids))
+		for (_, encoding), name in zip(decoded, ids):
+			if encoding != 'utf-8':
+				decoded_as.setdefault(encoding, []).append(name)
+		report_decoding(decoded_as)
+		return [text for text, _ in decoded]
+
+	texts = {}
+	if input_format == 'csv':
+		wanted = pd.Index(ids)
+		for chunk in pd.read_csv(input_dir, delimiter=delimiter, usecols=[text_column], chunksize=chunk_size):
+			chunk = chunk[chunk.index.isin(wanted)]
+			texts.update(zip(chunk.index, chunk[text_column]))
+	elif input_format == 'parquet':
+		import pyarrow.parquet as pq
+		parquet_file = pq.ParquetFile(input_dir)
+		ends = np.cumsum([parquet_file.metadata.row_group(g).num_rows for g in range(parquet_file.num_row_groups)])
+		groups = {}
+		for i in ids:
+			groups.setdefault(int(np.searchsorted(ends, i, side='right')), []).append(i)
+		for g, rows in groups.items():
+			column = parquet_file.read_row_group(g, columns=[text_column]).column(text_column)
+			start = ends[g] - len(column)
+			texts.update((i, column[i - start].as_py()) for i in rows)
+	else:
+		raise ValueError("Input type must be 'csv', 'parquet' or 'zip'.")
+	return [texts[i] for i in ids]
+
+def load_column(input_format, input_dir, column, delimiter=None):
+
+	"""
+	Loads another column of the dataset, aligned with the texts of load_data (e.g. a stratum or group per text).
+	Arguments:
+		input_format: input format specified in the config file (only csv and parquet have columns),
+		input_dir: input directory specified in the config file,
+		column: column name,
+		delimiter: delimiter for reading the csv file.
+	Returns:
+		list of values
+	"""
+
+	if input_format == 'csv':
+		return list(pd.read_csv(input_dir, delimiter=delimiter, usecols=[column])[column])
+	elif input_format == 'parquet':
+		return list(pd.read_parquet(input_dir, columns=[column])[column])
+	raise ValueError(f"Column '{column}' is only available for csv, parquet or HuggingFace input.")
+
+def load_huggingface_column(dataset_name, subset, split, column_name):
+	"""
+	Loads another column of a HuggingFace dataset, aligned with the texts of load_huggingface.
+	"""
+	dataset = open_huggingface(dataset_name, subset, split)
+	if split.strip():
+		return list(dataset[column_name])
+	return pd.DataFrame(dataset)[column_name].tolist()
+
+def huggingface_ids(dataset_name, subset, split, column_name):
+	"""
+	The doc indices of load_huggingface. Without a split, the dataset is loaded at once with load_huggingface.
+	"""
+	if not split.strip():
+		return load_huggingface(dataset_name, subset, split, column_name)[1]
+	return list(range(len(open_huggingface(dataset_name, subset, split))))
+
+def load_huggingface_documents(dataset_name, subset, split, column_name, ids):
+	"""
+	Loads the texts of some documents of a HuggingFace dataset (see huggingface_ids), in the order of ids.
+	Without a split, the dataset is loaded at once with load_huggingface.
+	"""
+	if not split.strip():
+		texts = load_huggingface(dataset_name, subset, split, column_name)[0]
+		return [texts[i] for i in ids]
+	return list(open_huggingface(dataset_name, subset, split).select(ids)[column_name])
+
+def iter_data(input_format, input_dir, text_column=None, delimiter=None, chunk_size=100, encodings=FALLBACK_ENCODINGS, n_threads=4):
+
+	"""
+	Streams the dataset instead of loading it at once (same documents and order as load_data).
+	Arguments:
+		input_format: input format specified in the config file (csv, parquet or zip),
+		input_dir: input directory specified in the config file,
+		text_column: if input_format==csv or parquet, column name containing texts,
+		delimiter: if input_format==csv, delimiter for reading the csv file,
+		chunk_size: if input_format==csv or parquet, number of rows read at once,
+		encodings, n_threads: see load_data.
+	Yields:
+		(text, doc index)
+	"""
+
+	if input_format == 'zip': # zip folder with txt, read a few files at a time
+		yield from read_zip(input_dir, encodings, n_threads)
+
+	elif input_format == 'csv':
+		for chunk in pd.read_csv(input_dir, delimiter=delimiter, chunksize=chunk_size):
+			yield from zip(chunk[text_column], chunk.index)
+
+	elif input_format == 'parquet':
+		import pyarrow.parquet as pq
+		start = 0
+		for batch in pq.ParquetFile(input_dir).iter_batches(batch_size=chunk_size, columns=[text_column]):
+			texts = batch.column(text_column).to_pylist()
+			yield from zip(texts, range(start, start+len(texts)))
+			start += len(texts)
+
+	else:
+		raise ValueError("Input type must be 'csv', 'parquet' or 'zip'.")
+
+def iter_huggingface(dataset_name, subset, split, column_name, batch_size=100):
+
+	"""
+	Streams a split of a HuggingFace dataset in batches (the dataset itself is memory-mapped by the datasets library).
+	Without a split, the dataset is loaded at once with load_huggingface.
+	Arguments: see load_huggingface
+	Yields:
+		(text, doc index)
+	"""
+
+	if not split.strip():
+		yield from zip(*load_huggingface(dataset_name, subset, split, column_name))
+		return
+
+	dataset = open_huggingface(dataset_name, subset, split)
+	for start in range(0, len(dataset), batch_size):
+		texts = dataset[start:start+batch_size][column_name]
+		yield from zip(texts, range(start, start+len(texts)))
 	
 #BASELINE_SYLLABIFIER________________________________________________________________
 def get_n_syllables(word, dic):
@@ -130,26 +389,31 @@ def ratio_content_words(doc):
 	except (ValueError, ZeroDivisionError):
 		return 0
 
-def get_passive_ratio(doc, matcher):
+def get_passive_ratio(doc, passive_labels, auxiliary=None):
 
 	"""
-	Computes ratio of sentences that contain a passive verb construction.
+	Computes ratio of sentences that contain a passive verb construction, i.e. a token with a passive dependency label,
+	or (with auxiliary) a participle that depends on a passive auxiliary.
 	Arguments:
 		doc: Spacy doc object
-		matcher: Spacy matcher object
+		passive_labels: np.ndarray of the hashes of the passive dependency labels (see pipeline.get_passive_labels)
+		auxiliary: (lemma of the auxiliary, dependency label, tag of the participle), e.g. ('werden', 'oc', 'VVPP')
+			for German, whose labels do not mark agentless passives, or None
 	Returns:
 		Ratio of passive sentencs
 	"""
 
-	total = 0
-	passive = 0
-
-	for s in doc.sents:
-		total += 1
-		matches = matcher(s)
-		if matches:
-			passive += 1
-	return round(passive/total, 3)
+	attrs = doc.to_array(['DEP', 'SENT_START'] + (['HEAD', 'LEMMA', 'TAG'] if auxiliary is not None else []))
+	sent_starts = attrs[:, 1].astype(np.int64) == 1
+	sent_starts[0] = True
+	sent_ids = np.cumsum(sent_starts) - 1 # sentence of every token
+	passive = np.isin(attrs[:, 0], passive_labels)
+	if auxiliary is not None:
+		lemma, dep, tag = [doc.vocab.strings.add(s) for s in auxiliary]
+		heads = np.arange(len(doc)) + attrs[:, 2].astype(np.int64) # HEAD is the offset of the head
+		passive |= (attrs[:, 0] == dep) & (attrs[:, 4] == tag) & (attrs[:, 3][heads] == lemma)
+	n_passive = np.count_nonzero(np.bincount(sent_ids[passive], minlength=sent_ids[-1]+1))
+	return round(n_passive/(sent_ids[-1]+1), 3)
 
 #LEXICAL_RICHNESS_SCORES_____________________________________________________________
 """
@@ -454,6 +718,18 @@ def get_dependency_distribution(dependencies):
 # 	profile = dict(sorted(profile.items(), key=operator.itemgetter(1),reverse=True))
 # 	return profile
 
+FUNCTION_WORD_POS = {'ADP', 'AUX', 'CCONJ', 'DET', 'PART', 'PRON', 'SCONJ'}
+
+def get_function_words(doc):
+	"""
+	Get the function words of a document
+	Arguments:
+		doc: Stanza doc object
+	Returns:
+		list of lowercased function words (words with a part of speech in FUNCTION_WORD_POS)
+	"""
+	return [w.text.lower() for s in doc.sents for w in s if w.pos_ in FUNCTION_WORD_POS]
+
 def get_function_word_distribution(doc):
 	"""
 	Compute function word distribution
@@ -462,8 +738,7 @@ def get_function_word_distribution(doc):
 	Returns:
 		{function word: rel_freq}
 	"""
-	allowed_pos = {'ADP', 'AUX', 'CCONJ', 'DET', 'PART', 'PRON', 'SCONJ'}
-	function_words = [w.text.lower() for s in doc.sents for w in s if w.pos_ in allowed_pos]
+	function_words = get_function_words(doc)
 	n_function_words = len(function_words)
 	dist = dict(Counter(function_words))
 	dist = {k:v/n_function_words for k,v in dist.items()}
@@ -556,12 +831,7 @@ def get_ngram_profile(tokens):
 		{ngram: freq}
 	"""
 
-	tokens = [[t.lower() for t in tokens]]
-	vec = CountVectorizer(analyzer=lambda x:x)
-	X = vec.fit_transform(tokens)
-	document_lengths = X.sum(axis=1)
-	X_normalized = X / document_lengths
-	profile = dict()
-	for v,k in zip(X_normalized.toarray().flatten(), vec.get_feature_names_out()):
-		profile[k] = [v]
+	tokens = [t.lower() for t in tokens]
+	dist = dict(Counter(tokens))
+	profile = {k: [v/len(tokens)] for k,v in sorted(dist.items())} # sorted like the CountVectorizer vocabulary it replaces
 	return profile
@@ -1,27 +1,17 @@
 import pandas as pd
 import numpy as np
-import plotly.graph_objs as go
 import os
+import reference_store
 
 def prepare_df(input_df, task_name, lang): 
 
     """
     Prepares datafame for bar chart visualization.
     """
-    #load and concatenate reference statistics
-    if lang == 'Dutch':
-        reference_df = pd.read_csv(f'reference_corpora/nl/{task_name}_combined.csv')
-    elif lang == 'English':
-        reference_df = pd.read_csv(f'reference_corpora/en/{task_name}_combined.csv')
-    elif lang == 'German':
-        reference_df = pd.read_csv(f'reference_corpora/de/{task_name}_combined.csv')
-    elif lang == 'French':
-        reference_df = pd.read_csv(f'reference_corpora/fr/{task_name}_combined.csv')
-    else:
-        raise ValueError('Language must be one of the following: "Dutch", "English", "German", "French".')
+    #load and concatenate reference statistics (served from the in-memory reference store)
+    reference_df = reference_store.reference_frame(lang, task_name)
         
-    if task_name == 'word_length_distribution':
-        reference_df.columns = [int(col) if col not in {"source", "doc"} else col for col in reference_df.columns]
+    if task_name == 'word_length_distribution': # reference store already holds word lengths as integers
         input_df.columns = [int(col) if col not in {"source", "doc"} else col for col in input_df.columns]
     
     reference_df = pd.concat([input_df, reference_df]).fillna(0)
@@ -38,17 +28,24 @@ def prepare_df(input_df, task_name, lang):
 
     return mean_df, std_df
 
-def generate_bar_chart(mean_df, std_df, savename, output_dir):
+def generate_bar_chart(mean_df, std_df, savename, output_dir, mode='separate', visible=('input corpus',)):
 
     """
     Generates bar chart visualizations for various feature comparisons.
     Arguments:
         dataframe: pd.DataFrame (rows are documents, columns are features)
         savename: filename that should be used to save the bar chart
+        mode: 'separate' (one html file per chart, sharing a single plotly.min.js),
+              'dashboard' (figure json only, combine with generate_dashboard),
+              'inline' (standalone html files that each embed plotly.js),
+              or None (the figure is not saved, e.g. for partial results)
+        visible: series shown initially (the others, e.g. reference corpora, can be toggled)
     Returns:
-        None
+        plotly Figure
     """
 
+    import plotly.graph_objs as go # plotly is only imported once charts are generated (keeps startup fast)
+
     if savename == 'word_length_distribution': # remove columns of word length 26 and up which is usually noise and completely distorts the visualization
         filtered_columns = [col for col in mean_df.columns if type(col) == int and col < 24]
         mean_df = mean_df[filtered_columns]
@@ -65,7 +62,7 @@ def generate_bar_chart(mean_df, std_df, savename, output_dir):
             x=transposed_df.index,
             y=transposed_df[column],
             name=column,
-            visible=(column == 'input corpus'),  # Show only 'Input corpus' initially, reference corpora can be toggled
+            visible=(column in visible),  # Show only 'Input corpus' (and groups) initially, reference corpora can be toggled
             error_y=dict(
                 type='data',
                 array=std_df[column],
@@ -90,7 +87,7 @@ def generate_bar_chart(mean_df, std_df, savename, output_dir):
 
     # Update visibility toggling for legend items
     for i in range(len(fig.data)):
-        if fig.data[i].name != 'input corpus':
+        if fig.data[i].name not in visible:
             fig.data[i].visible = 'legendonly'
 
     # Sort columns based on 'input corpus' values
@@ -101,8 +98,141 @@ def generate_bar_chart(mean_df, std_df, savename, output_dir):
         sorted_columns = input_corpus_values.sort_values(ascending=False).index
     fig.update_xaxes(categoryorder='array', categoryarray=sorted_columns)
 
-    # Display the plot
-    save_path = os.path.join(output_dir, 'visualizations', savename+'.html')
-    fig.write_html(save_path)
+    save_figure(fig, savename, output_dir, mode)
+    return fig
+
+def save_figure(fig, savename, output_dir, mode='separate'):
+    """
+    Saves a chart to the visualizations folder of the output directory (see generate_bar_chart for the modes).
+    """
+    if mode is None:
+        pass
+    elif mode == 'separate': # plotly.min.js is copied once into the visualizations folder and referenced by every chart
+        save_path = os.path.join(output_dir, 'visualizations', savename+'.html')
+        fig.write_html(save_path, include_plotlyjs='directory')
+    elif mode == 'dashboard':
+        save_path = os.path.join(output_dir, 'visualizations', savename+'.json')
+        fig.write_json(save_path)
+    elif mode == 'inline':
+        save_path = os.path.join(output_dir, 'visualizations', savename+'.html')
+        fig.write_html(save_path)
+    else:
+        raise ValueError('Visualization mode must be one of the following: "separate", "dashboard", "inline".')
+
+def generate_power_law_chart(df, x, y, coefficient, exponent, savename, output_dir, mode='separate'):
+
+    """
+    Generates a line chart on log-log axes of a curve and the power law fitted to it (e.g. vocabulary growth or rank-frequency curves).
+    Arguments:
+        df: pd.DataFrame with the columns x and y
+        x, y: column names, also used as axis titles
+        coefficient, exponent: fitted power law y = coefficient * x ** exponent (NaN: not shown)
+        savename, output_dir, mode: see generate_bar_chart
+    Returns:
+        plotly Figure
+    """
+
+    import plotly.graph_objs as go
+
+    data = [go.Scatter(x=df[x], y=df[y], mode='lines+markers', name='input corpus')]
+    if not (np.isnan(coefficient) or np.isnan(exponent)):
+        data.append(go.Scatter(
+            x=df[x],
+            y=coefficient * df[x].astype(float) ** exponent,
+            mode='lines',
+            line=dict(dash='dash'),
+            name=f'fit: {coefficient:.3g} * {x} ^ {exponent:.3f}',
+        ))
+    layout = go.Layout(
+        width=1024,
+        height=512,
+        showlegend=True,
+        template='plotly_white',
+        xaxis=dict(type='log', title=x.replace('_', ' ')),
+        yaxis=dict(type='log', title=y.replace('_', ' ')),
+    )
+    fig = go.Figure(data=data, layout=layout)
+    save_figure(fig, savename, output_dir, mode)
+    return fig
+
+def generate_trajectory_chart(df, savename, output_dir, mode='separate'):
+
+    """
+    Generates a line chart of the trajectories of documents: a metric per window, against the relative position of the
+    window in the document, with one line per document and a menu to select the metric.
+    Arguments:
+        df: pd.DataFrame with the columns doc, position and the metrics (see trajectories.trajectory)
+        savename, output_dir, mode: see generate_bar_chart
+    Returns:
+        plotly Figure
+    """
+
+    import plotly.graph_objs as go
+
+    metrics = ['lexical_diversity', 'readability'] + [c for c in df.columns if c.startswith('pos_')]
+    docs = list(dict.fromkeys(df['doc']))
+    data = []
+    for i, metric in enumerate(metrics):
+        for doc in docs:
+            doc_df = df[df['doc'] == doc]
+            data.append(go.Scatter(x=doc_df['position'], y=doc_df[metric], mode='lines', name=str(doc), visible=i == 0))
+    buttons = [
+        dict(
+            label=metric.replace('_', ' '),
+            method='update',
+            args=[{'visible': [j // len(docs) == i for j in range(len(data))]}, {'yaxis': {'title': metric.replace('_', ' ')}}],
+        )
+        for i, metric in enumerate(metrics)
+    ]
+    layout = go.Layout(
+        width=1024,
+        height=512,
+        showlegend=True,
+        template='plotly_white',
+        xaxis=dict(title='position in the document', range=[0, 1]),
+        yaxis=dict(title=metrics[0].replace('_', ' ')),
+        updatemenus=[dict(buttons=buttons, direction='down', x=0, xanchor='left', y=1.15, yanchor='top')],
+    )
+    fig = go.Figure(data=data, layout=layout)
+    save_figure(fig, savename, output_dir, mode)
+    return fig
+
+def generate_dashboard(figures, output_dir):
+
+    """
+    Combines bar charts into a single html dashboard that references a local copy of plotly.js (works offline).
+    Arguments:
+        figures: {savename: plotly Figure}
+        output_dir: output directory of the run
+    Returns:
+        path to the dashboard
+    """
+
+    vis_dir = os.path.join(output_dir, 'visualizations')
+    plotlyjs_path = os.path.join(vis_dir, 'plotly.min.js')
+    if not os.path.exists(plotlyjs_path):
+        from plotly.offline import get_plotlyjs
+        with open(plotlyjs_path, 'w', encoding='utf-8') as f:
+            f.write(get_plotlyjs())
+
+    sections = []
+    for savename, fig in figures.items():
+        title = savename.replace('_', ' ').capitalize()
+        div = fig.to_html(full_html=False, include_plotlyjs=False)
+        sections.append(f'<h2>{title}</h2>\n{div}')
+
+    html = '\n'.join([
+        '<html>',
+        '<head><meta charset="utf-8" /><title>Styloscope</title>',
+        '<script src="plotly.min.js"></script></head>',
+        '<body style="font-family: sans-serif">',
+        '\n'.join(sections),
+        '</body>',
+        '</html>',
+    ])
+
+    save_path = os.path.join(vis_dir, 'dashboard.html')
+    with open(save_path, 'w', encoding='utf-8') as f:
+        f.write(html)
 
-    return fig
\ No newline at end of file
+    return save_path
\ No newline at end of file